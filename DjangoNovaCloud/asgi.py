@@ -11,16 +11,22 @@ import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
-from django.urls import path
-from tcp_server.routing import tcp_routes
+from channels.security.websocket import AllowedHostsOriginValidator
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DjangoNovaCloud.settings')
 
-# 获取Django ASGI应用
+# 获取Django ASGI应用（需在导入消费者和模型之前完成Django初始化）
 django_asgi_app = get_asgi_application()
 
+from iot_devices.routing import websocket_urlpatterns  # noqa: E402
+from tcp_server.routing import tcp_routes  # noqa: E402,F401
+
 # 定义ASGI应用，支持多种协议
 application = ProtocolTypeRouter({
     # HTTP请求由Django处理
     "http": django_asgi_app,
+    # WebSocket连接使用会话认证，只接受ALLOWED_HOSTS中的来源
+    "websocket": AllowedHostsOriginValidator(
+        AuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+    ),
 })
@@ -76,6 +76,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'admin_panel.context_processors.roles',
             ],
         },
     },
@@ -173,6 +174,9 @@ MQTT_CONFIG = {
     'CLIENT_ID_PREFIX': 'novacloud_server_',  # 客户端ID前缀，后面会加上随机字符串
     'CLEAN_SESSION': True,
     'QOS': 1,                         # 消息质量（0: 最多一次，1: 至少一次，2: 只有一次）
+    'CONNECT_TIMEOUT': 5,             # 首次发布时等待连接建立的最长时间（秒）
+    'SHARED_SUBSCRIPTION_GROUP': None,  # 共享订阅分组（如'novacloud-ingest'），多个run_mqtt_ingest进程分摊设备消息，需要Broker支持$share
+    'EMBEDDED_BROKER': False,         # 连接前在本进程中启动MQTT Broker（离线开发/压测，需将BROKER_HOST设为127.0.0.1且不使用TLS）
     
     # MQTT主题配置
     'TOPIC_PREFIX': 'novacloud/',     # 所有主题的前缀
@@ -182,24 +186,169 @@ MQTT_CONFIG = {
     'DEVICE_CONFIG_TOPIC': 'devices/{device_id}/config',  # 设备配置主题模板
 }
 
-# 是否在Django启动时自动连接MQTT
+# Web进程是否在首次发布命令时自动连接MQTT（只发布，不订阅设备数据；设备数据由manage.py run_mqtt_ingest接入）
 MQTT_AUTO_CONNECT = True
 
+# MQTT传感器数据批量写入配置
+MQTT_INGEST_CONFIG = {
+    'BATCH_SIZE': 500,         # 单批最多写入的消息数
+    'FLUSH_INTERVAL': 0.5,     # 最长等待时间（秒），未凑满一批也会写入
+    'MAX_QUEUE_SIZE': 10000,   # 待写入队列上限，超出后丢弃新消息
+    'WRITER_THREADS': 1,       # 写入线程数，PostgreSQL/MySQL可适当增大；SQLite并发写入会锁库，应保持为1
+    'DECODE_QUEUE_SIZE': 10000,  # 网络线程到解码线程的原始消息队列上限
+    'DRAIN_TIMEOUT': 30,       # 停止接入时等待解码和写入队列排空的最长时间（秒）
+    'STATS_INTERVAL': 60,      # 吞吐量统计日志输出间隔（秒），0表示不输出
+    'SHARED_GROUP': 'novacloud-ingest',  # run_mqtt_ingest默认使用的共享订阅分组
+    'LEADER_LEASE_TTL': 15,    # 领导者租约有效期（秒），领导者进程异常退出后最多这么久由其他进程接管
+    'LEADER_RENEW_INTERVAL': 5,  # 租约续期间隔（秒）
+    'COMMAND_TIMEOUT': 60,     # 执行器命令超过该时间（秒）仍为待响应时由领导者标记为超时，0表示不标记
+}
+
+# 数据接入指标配置（管理面板 /admin-panel/metrics/ 以Prometheus格式导出）
+METRICS_CONFIG = {
+    'SNAPSHOT_DIR': None,      # 多进程指标快照目录，None表示系统临时目录下的novacloud-metrics
+    'SNAPSHOT_INTERVAL': 5,    # 数据接入、TCP服务器进程写入快照的间隔（秒）
+    'SNAPSHOT_TTL': 60,        # 超过该时间未更新的快照视为进程已退出（秒）
+    'TOKEN': None,             # 设置后Prometheus可通过 Authorization: Bearer <TOKEN> 免登录抓取
+}
+
+# 性能剖析配置（运行中的数据接入、TCP服务器进程收到SIGNAL信号时开启/关闭，见 manage.py profile_pipeline）
+PROFILING_CONFIG = {
+    'OUTPUT_DIR': None,        # 剖析结果目录，None表示BASE_DIR/logs/profiles
+    'SAMPLE_INTERVAL': 0.005,  # 调用栈采样间隔（秒），0表示只记录阶段耗时
+    'MAX_DURATION': 300,       # 单次剖析最长时间（秒），超时自动关闭并输出结果
+    'SIGNAL': 'SIGUSR1',       # 开关信号
+}
+
+# 实时数据推送配置（WebSocket ws/sensors/，数据接入进程与Web进程需共享通道层）
+REALTIME_CONFIG = {
+    'ENABLED': True,
+    'TICK': 0.5,               # 合并间隔（秒），每个传感器每tick最多推送一条最新读数
+    'MAX_SUBSCRIPTIONS': 100,  # 每个WebSocket连接最多订阅的传感器数
+}
+
+# 设备元数据缓存配置（数据接入路径按device_id缓存设备主键和传感器列表）
+DEVICE_METADATA_CACHE = {
+    'MAX_ENTRIES': 10000,  # 最多缓存的设备数，超出后按LRU淘汰
+    'TTL': 300,            # 条目过期时间（秒），用于兜底其他进程中的修改
+    'MISSING_TTL': 5,      # 未知设备的缓存时间（秒），0表示不缓存未知设备
+}
+
+# 下级用户ID缓存时间（秒），本进程内用户上下级变更会立即清空缓存，0表示不缓存
+SUBORDINATE_CACHE_TTL = 30
+
+# 传感器数据汇总配置（1分钟/1小时/1天粒度的预聚合数据）
+SENSOR_ROLLUP_CONFIG = {
+    'ENABLED': True,            # 数据接入时增量更新汇总表
+    'READ_FROM_ROLLUPS': True,  # 图表和统计优先读取汇总表（历史数据需先执行backfill_rollups）
+}
+
+# 数据保留配置（没有项目/传感器保留策略时使用，None或0表示永久保留）
+DATA_RETENTION_CONFIG = {
+    'SENSOR_DATA_DAYS': None,       # 原始传感器数据
+    'ROLLUP_MINUTE_DAYS': None,     # 1分钟汇总
+    'ROLLUP_HOUR_DAYS': None,       # 1小时汇总
+    'ROLLUP_DAY_DAYS': None,        # 1天汇总
+    'ACTUATOR_DATA_DAYS': None,     # 执行器数据
+    'ACTUATOR_COMMAND_DAYS': None,  # 执行器命令
+    'CHUNK_SIZE': 1000,             # 每个事务删除的最大行数
+    'CHUNK_SLEEP': 0.05,            # 两次删除之间的休眠时间（秒），让出数据库锁
+    'SCHEDULE_INTERVAL': 0,         # run_mqtt_ingest领导者进程的定时清理间隔（秒），0表示不启用，改用apply_retention命令
+}
+
 # TCP服务器配置
 TCP_SERVER_CONFIG = {
     'HOST': '0.0.0.0',       # 监听所有接口
     'PORT': 9000,            # TCP服务端口
-    'BUFFER_SIZE': 1024,     # 接收缓冲区大小
+    'BUFFER_SIZE': 65536,    # 单次读取的最大字节数
+    'CONNECTION_QUEUE_SIZE': 64,  # 每个连接待处理数据块的上限，队列满时暂停读取该连接
+    'MAX_CONNECTIONS': 10000,     # 最大并发连接数，超出后拒绝新连接，0表示不限制
+    'MAX_INFLIGHT_FRAMES': 256,   # 全局同时处理的帧数上限，0表示不限制
     'FRAME_DELIMITER': b'\n',  # 帧分隔符（这里使用换行符作为消息分隔）
     'MAX_MESSAGE_SIZE': 131072,  # 最大消息大小（128KB）
     'CONNECTION_TIMEOUT': 300,  # 连接超时时间（秒）
+    'DATA_BATCH_SIZE': 100,   # 每个连接累积多少条数据消息后一次写入数据库，1表示逐条写入
+    'DATA_BATCH_DELAY': 0.005,  # 未满一批时最多等待的时间（秒），确认在写入后发送
+    'WORKERS': 1,             # 工作进程数，大于1时通过SO_REUSEPORT共享端口（仅Linux/BSD）
+    'STATS_INTERVAL': 60,     # 连接数和吞吐量统计输出间隔（秒），0表示不输出
+    'EVENT_LOOP': 'auto',     # 事件循环：auto（已安装uvloop时使用）、uvloop或asyncio
+}
+
+# TCP/MQTT消息使用的JSON库：auto（按orjson、ujson、json的顺序选择已安装的库）、orjson、ujson或json
+JSON_CODEC = 'auto'
+
+# 策略引擎配置
+STRATEGY_ENGINE_CONFIG = {
+    'RULE_INDEX_TTL': 60,  # 策略规则索引全量重建间隔（秒），用于同步其他进程中的修改
+    'ASYNC_ACTIONS': True,       # 是否由独立线程池异步执行策略动作
+    'ACTION_WORKERS': 4,         # 动作执行线程数
+    'ACTION_QUEUE_SIZE': 1000,   # 待执行动作队列上限
+    'ACTION_TIMEOUT': 10,        # 单次WebHook/邮件请求超时时间（秒）
+    'ACTION_MAX_RETRIES': 3,     # 最大执行次数（含首次）
+    'ACTION_RETRY_BACKOFF': 1.0, # 重试退避基数（秒），每次重试翻倍
+    'LOG_BATCH_SIZE': 100,       # 策略日志批量写入条数
+    'LOG_FLUSH_INTERVAL': 1.0,   # 策略日志最长写入间隔（秒）
 }
 
+# Redis地址（如 redis://127.0.0.1:6379/0），设置后通道层和事件总线跨进程共享
+REDIS_URL = os.environ.get('REDIS_URL')
+
 # Channels配置
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
+# 内存通道层只在单个进程内有效：TCP服务器、run_mqtt_ingest和Web进程分开运行时必须使用Redis通道层，
+# 否则实时推送和事件无法送达其他进程
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+                'capacity': 1000,  # 每个通道最多缓存的消息数
+                'expiry': 60,      # 未被接收的消息过期时间（秒）
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# 内部事件总线配置（读数写入、设备状态变化、命令确认）
+EVENT_BUS_CONFIG = {
+    'BACKEND': 'channels' if REDIS_URL else 'local',  # channels: 通过通道层跨进程分发；local: 只在本进程内分发
+    'GROUP_PREFIX': 'events',                         # 通道层组名前缀，组名为 <前缀>.<事件类型>
+    'PUBLISH_EVENTS': None,                           # 发布到通道层的事件类型列表，None表示全部，[]表示不发布
+    'MAX_PENDING': 10000,                             # 待发送事件队列上限，超过时丢弃新事件
+}
+
+# 缓存配置：设置了REDIS_URL时使用Redis（各进程共享，信号失效对所有进程生效），否则使用进程内存
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'novacloud',
+            'TIMEOUT': 300,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'novacloud',
+            'KEY_PREFIX': 'novacloud',
+            'TIMEOUT': 300,
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+    }
+
+# 页面数据缓存时间（秒），数据变更时由模型信号失效，过期时间只用于兜底
+# 进程内存缓存的失效只对本进程生效（其他Web进程、数据接入进程的更新无法送达），未使用Redis时只短时缓存
+VIEW_CACHE_CONFIG = {
+    'COUNTS_TTL': 300 if REDIS_URL else 30,       # 项目设备数、设备传感器/执行器数
+    'LATEST_VALUE_TTL': 300 if REDIS_URL else 5,  # 传感器最新值（数据接入每批写入后更新）
+    'ROLE_TTL': 300 if REDIS_URL else 30,         # 用户角色权限判断
 }
 
 # 会话安全设置
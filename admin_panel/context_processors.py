@@ -0,0 +1,15 @@
+import functools
+
+from .utils import is_role_admin
+
+
+def roles(request):
+    """
+    模板中的角色判断
+    
+    值为可调用对象，模板实际用到时才计算（结果来自角色权限缓存）
+    """
+    user = getattr(request, 'user', None)
+    if user is None:
+        return {}
+    return {'user_is_role_admin': functools.partial(is_role_admin, user)}
@@ -1,9 +1,10 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import m2m_changed, post_save, post_delete
 from django.contrib.auth.signals import user_logged_in, user_logged_out, user_login_failed
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from .utils import create_audit_log
-from .models import AuditLog
+from accounts.models import UserProfile
+from .utils import create_audit_log, invalidate_role_flags, subordinate_cache
+from .models import AuditLog, Role
 
 User = get_user_model()
 
@@ -42,4 +43,26 @@ def log_user_login_failed(sender, credentials, request, **kwargs):
         action=AuditLog.ACTION_USER_LOGIN_FAILED,
         details=f"用户名 '{username}' 登录失败",
         request=request
-    ) 
\ No newline at end of file
+    )
+
+# 上下级关系变更时清空下级用户缓存
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_subordinate_cache(sender, instance, **kwargs):
+    """用户资料保存或删除时清空下级用户缓存"""
+    subordinate_cache.clear()
+
+# 用户角色变更时失效该用户的角色权限缓存
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_user_role_flags(sender, instance, **kwargs):
+    """用户资料保存或删除时失效该用户的角色权限缓存"""
+    invalidate_role_flags(instance.user_id)
+
+# 角色删除或角色权限变更时失效所有用户的角色权限缓存
+@receiver(post_delete, sender=Role)
+@receiver(m2m_changed, sender=Role.permissions.through)
+def invalidate_all_role_flags(sender, action=None, **kwargs):
+    """角色删除或权限增删时失效全部角色权限缓存（m2m_changed只处理post_add/post_remove/post_clear）"""
+    if action is None or action.startswith('post_'):
+        invalidate_role_flags()
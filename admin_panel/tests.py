@@ -1,3 +1,131 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from .models import Role
+from .utils import ROLE_VERSION_KEY, can_manage_users, get_role_flags, is_role_admin
+
+User = get_user_model()
+
+
+class RoleFlagsCacheTests(TestCase):
+    """角色权限缓存及其失效"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.permission, _ = Permission.objects.get_or_create(
+            codename='can_manage_users', content_type=ContentType.objects.get_for_model(Role),
+            defaults={'name': '管理用户'},
+        )
+        cls.role = Role.objects.create(name='管理员')
+        cls.user = User.objects.create_user(username='manager', password='x')
+        cls.user.profile.role = cls.role
+        cls.user.profile.save()
+
+    def setUp(self):
+        cache.clear()
+
+    def flags(self):
+        # 每次使用新的用户对象，避免命中对象上的请求级缓存
+        return get_role_flags(User.objects.get(pk=self.user.pk))
+
+    def test_cached_flags(self):
+        self.assertEqual(self.flags(), {'has_permissions': False, 'can_manage_users': False})
+        with self.assertNumQueries(1):
+            # 只查询用户本身
+            self.flags()
+
+    def test_role_permission_change_bumps_version(self):
+        self.flags()
+        version = cache.get(ROLE_VERSION_KEY)
+
+        self.role.permissions.add(self.permission)
+
+        self.assertEqual(cache.get(ROLE_VERSION_KEY), version + 1)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(is_role_admin(user))
+        self.assertTrue(can_manage_users(user))
+
+        self.role.permissions.remove(self.permission)
+        self.assertEqual(cache.get(ROLE_VERSION_KEY), version + 2)
+        self.assertFalse(self.flags()['can_manage_users'])
+
+    def test_role_delete_bumps_version(self):
+        self.role.permissions.add(self.permission)
+        self.assertTrue(self.flags()['has_permissions'])
+        version = cache.get(ROLE_VERSION_KEY)
+
+        self.role.delete()
+
+        self.assertEqual(cache.get(ROLE_VERSION_KEY), version + 1)
+        self.assertFalse(self.flags()['has_permissions'])
+
+    def test_version_key_missing(self):
+        self.flags()
+        cache.delete(ROLE_VERSION_KEY)
+        self.role.permissions.add(self.permission)
+        self.assertTrue(self.flags()['can_manage_users'])
+
+    def test_profile_change_invalidates_user(self):
+        self.role.permissions.add(self.permission)
+        self.assertTrue(self.flags()['has_permissions'])
+        version = cache.get(ROLE_VERSION_KEY)
+
+        profile = User.objects.get(pk=self.user.pk).profile
+        profile.role = None
+        profile.save()
+
+        # 只删除该用户的条目，不影响其他用户
+        self.assertEqual(cache.get(ROLE_VERSION_KEY), version)
+        self.assertFalse(self.flags()['has_permissions'])
+
+
+class GlobalProjectListViewTests(TestCase):
+    """全局项目列表"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='x')
+
+    def test_query_string_for_page_links(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin_panel:global_project_list'), {'page': '1', 'sort': 'name'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['query_string'], 'sort=name')
+
+
+@override_settings(METRICS_CONFIG={'TOKEN': 'secret'})
+class MetricsViewTests(TestCase):
+    """指标接口的访问控制"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='viewer', password='x')
+
+    def setUp(self):
+        self.url = reverse('admin_panel:metrics')
+
+    def test_non_superuser_denied(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_token_accepted(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+    def test_wrong_token_denied(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 302)
+
+    def test_token_only_allows_get(self):
+        response = self.client.post(self.url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 405)
+
+    def test_non_ascii_authorization_header(self):
+        response = self.client.get(self.url, HTTP_AUTHORIZATION='Bearer 令牌')
+        self.assertEqual(response.status_code, 302)
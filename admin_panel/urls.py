@@ -22,6 +22,10 @@ urlpatterns = [
     # 新增：审计日志
     path('audit-logs/', views.AuditLogListView.as_view(), name='audit_log_list'),
     
+    # 系统监控
+    path('monitor/', views.SystemMonitorView.as_view(), name='system_monitor'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
+    
     # 角色管理
     path('roles/', views.RoleListView.as_view(), name='role_list'),
     path('roles/create/', views.RoleCreateView.as_view(), name='role_create'),
@@ -1,40 +1,208 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import DatabaseError, connection
 from .models import AuditLog
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
+
+
+# 下级用户递归查询：一条WITH RECURSIVE语句获取整棵下级树
+# 使用UNION（而非UNION ALL）去重，即使上下级关系中存在环也能结束
+SUBORDINATES_SQL = """
+    WITH RECURSIVE subordinates(id) AS (
+        SELECT {user} FROM {table} WHERE {parent} = %s
+        UNION
+        SELECT p.{user} FROM {table} p INNER JOIN subordinates s ON p.{parent} = s.id
+    )
+    SELECT id FROM subordinates
+"""
+
+
+class SubordinateCache:
+    """
+    下级用户ID的短时缓存
+
+    上下级关系很少变化，项目列表、设备详情等页面却每次请求都要计算。
+    - 每个条目在ttl秒后过期（用于兜底其他进程中的修改）
+    - 本进程内UserProfile的保存和删除会通过信号清空缓存
+    """
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._entries = {}  # 用户ID -> (下级用户ID元组, 过期时间)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        """根据settings.SUBORDINATE_CACHE_TTL创建缓存"""
+        return cls(ttl=getattr(settings, 'SUBORDINATE_CACHE_TTL', 30))
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def set(self, user_id, subordinate_ids):
+        if not self.ttl:
+            return
+        with self._lock:
+            self._entries[user_id] = (tuple(subordinate_ids), time.monotonic() + self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# 进程级缓存实例
+subordinate_cache = SubordinateCache.from_settings()
+
+
+def _query_subordinate_ids(user_id):
+    """查询用户的所有下级用户ID（数据库不支持递归CTE时逐层查询）"""
+    from accounts.models import UserProfile
+
+    opts = UserProfile._meta
+    sql = SUBORDINATES_SQL.format(
+        table=connection.ops.quote_name(opts.db_table),
+        user=connection.ops.quote_name(opts.get_field('user').column),
+        parent=connection.ops.quote_name(opts.get_field('parent_user').column),
+    )
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user_id])
+            return [row[0] for row in cursor.fetchall() if row[0] != user_id]
+    except DatabaseError:
+        if connection.in_atomic_block:
+            raise
+        logger.warning("数据库不支持递归查询，改为逐层查询下级用户")
+
+    # 逐层查询：每一层一次查询
+    subordinate_ids = set()
+    level = {user_id}
+    while level:
+        level = set(
+            UserProfile.objects.filter(parent_user_id__in=level).values_list('user_id', flat=True)
+        ) - subordinate_ids - {user_id}
+        subordinate_ids |= level
+    return list(subordinate_ids)
+
 
 def get_subordinate_user_ids(user):
     """
     获取用户的所有下级用户ID（包括直接和间接下级）
     
+    结果先后在用户对象（同一请求内复用）和进程内短时缓存中保存，
+    未命中时用一条递归查询获取整棵下级树
+    
     参数:
         user: 用户对象
     
     返回:
         包含用户ID的列表
     """
-    # 用于存储所有下级用户ID的集合
-    subordinate_ids = set()
+    # 同一请求内request.user是同一个对象，直接复用
+    cached = getattr(user, '_subordinate_user_ids', None)
+    if cached is None:
+        cached = subordinate_cache.get(user.id)
+        if cached is None:
+            cached = tuple(_query_subordinate_ids(user.id))
+            subordinate_cache.set(user.id, cached)
+        user._subordinate_user_ids = cached
     
-    # 内部递归函数，用于获取用户及其下级用户的ID
-    def get_subordinates(user_id):
-        # 获取直接下级用户
-        direct_subordinates = User.objects.filter(
-            profile__parent_user_id=user_id
-        ).values_list('id', flat=True)
-        
-        # 将直接下级添加到集合
-        for sub_id in direct_subordinates:
-            subordinate_ids.add(sub_id)
-            # 递归获取每个下级的下级
-            get_subordinates(sub_id)
-    
-    # 从当前用户开始递归
-    get_subordinates(user.id)
-    
-    # 将结果转换为列表
-    return list(subordinate_ids)
+    return list(cached)
+
+# 角色权限缓存：所有用户的缓存键都带有版本号，角色或角色权限变更时递增版本号使全部条目失效
+ROLE_VERSION_KEY = 'perm:role_version'
+
+
+def _role_flags_key(user_id):
+    try:
+        version = cache.get_or_set(ROLE_VERSION_KEY, 1, None)
+    except Exception as e:
+        logger.warning(f"读取缓存失败: {str(e)}")
+        return None
+    return f"perm:v{version}:user:{user_id}"
+
+
+def _query_role_flags(user_id):
+    """一次查询用户角色的全部权限"""
+    from django.contrib.auth.models import Permission
+
+    codenames = set(Permission.objects.filter(roles__users__user=user_id).values_list('codename', flat=True))
+    return {
+        'has_permissions': bool(codenames),
+        'can_manage_users': 'can_manage_users' in codenames,
+    }
+
+
+def get_role_flags(user):
+    """
+    获取用户角色的权限判断结果
+    
+    结果先后在用户对象（同一请求内复用）和Django缓存中保存，
+    用户资料变更时删除该用户的条目，角色或角色权限变更时整体失效
+    
+    返回:
+        {'has_permissions': 角色是否有任何权限, 'can_manage_users': 是否有can_manage_users权限}
+    """
+    flags = getattr(user, '_role_flags', None)
+    if flags is not None:
+        return flags
+    
+    key = _role_flags_key(user.id)
+    try:
+        flags = cache.get(key) if key else None
+    except Exception as e:
+        logger.warning(f"读取缓存失败: {str(e)}")
+        flags = None
+    if flags is None:
+        flags = _query_role_flags(user.id)
+        if key:
+            try:
+                cache.set(key, flags, getattr(settings, 'VIEW_CACHE_CONFIG', {}).get('ROLE_TTL', 300))
+            except Exception as e:
+                logger.warning(f"写入缓存失败: {str(e)}")
+    user._role_flags = flags
+    return flags
+
+
+def is_role_admin(user):
+    """用户的角色是否有任何权限（视为管理员，可以查看下级用户的项目和设备）"""
+    return user.is_authenticated and get_role_flags(user)['has_permissions']
+
+
+def can_manage_users(user):
+    """用户的角色是否有can_manage_users权限"""
+    return user.is_authenticated and get_role_flags(user)['can_manage_users']
+
+
+def invalidate_role_flags(user_id=None):
+    """
+    失效角色权限缓存
+    
+    参数:
+        user_id: 用户ID，为None时使所有用户的条目失效
+    """
+    try:
+        if user_id is None:
+            try:
+                cache.incr(ROLE_VERSION_KEY)
+            except ValueError:
+                cache.set(ROLE_VERSION_KEY, 2, None)
+        else:
+            key = _role_flags_key(user_id)
+            if key:
+                cache.delete(key)
+    except Exception as e:
+        logger.warning(f"删除缓存失败: {str(e)}")
 
 def get_user_and_subordinates_queryset(user):
     """
@@ -7,15 +7,22 @@ from django.contrib import messages
 from django.db.models import Q, Count
 from django.contrib.auth.forms import SetPasswordForm
 from django.contrib.auth import get_user_model
-from django.http import JsonResponse, HttpResponseForbidden
+from django.http import JsonResponse, HttpResponse, HttpResponseForbidden
 from django.utils import timezone
+from django.conf import settings
 from datetime import timedelta
+import hmac
+import math
+import time
 
 from accounts.models import UserProfile
 from admin_panel.models import Role, AuditLog
 from admin_panel.forms import UserCreateForm, UserEditForm, RoleForm
-from .utils import get_subordinate_user_ids, get_user_and_subordinates_queryset, create_audit_log
+from .utils import can_manage_users, get_subordinate_user_ids, get_user_and_subordinates_queryset, create_audit_log
 from iot_devices.models import Project
+from iot_devices.view_cache import project_device_counts
+from core.pagination import KeysetPaginationMixin
+from core import metrics
 
 User = get_user_model()
 
@@ -26,11 +33,7 @@ class AdminRequiredMixin(UserPassesTestMixin):
     def test_func(self):
         # 检查用户是否是管理员
         # 可以通过角色判断或直接检查特定权限
-        return self.request.user.is_staff or (
-            hasattr(self.request.user, 'profile') and 
-            self.request.user.profile.role and 
-            self.request.user.profile.role.permissions.filter(codename='can_manage_users').exists()
-        )
+        return self.request.user.is_staff or can_manage_users(self.request.user)
 
 # 用户列表视图
 class UserListView(LoginRequiredMixin, AdminRequiredMixin, ListView):
@@ -284,15 +287,20 @@ class GlobalProjectListView(LoginRequiredMixin, AdminRequiredMixin, ListView):
         
         # 超级管理员可查看所有项目
         if user.is_superuser:
-            return Project.objects.all()
+            return Project.objects.select_related('owner')
         
         # 其他管理员可查看其下级用户的项目
         user_ids = get_subordinate_user_ids(user)
-        return Project.objects.filter(owner__id__in=user_ids)
+        return Project.objects.filter(owner__id__in=user_ids).select_related('owner')
     
     def get_context_data(self, **kwargs):
         """添加额外上下文"""
         context = super().get_context_data(**kwargs)
+        projects = list(context['projects'])
+        device_counts = project_device_counts(project.pk for project in projects)
+        for project in projects:
+            project.device_count = device_counts[project.pk]
+        context['projects'] = context['object_list'] = projects
         context['title'] = '全局项目'
         context['is_admin_view'] = True
         
@@ -305,7 +313,7 @@ class GlobalProjectListView(LoginRequiredMixin, AdminRequiredMixin, ListView):
         return context
 
 # 审计日志列表视图
-class AuditLogListView(LoginRequiredMixin, AdminRequiredMixin, ListView):
+class AuditLogListView(LoginRequiredMixin, AdminRequiredMixin, KeysetPaginationMixin, ListView):
     """审计日志列表视图，仅限管理员访问"""
     model = AuditLog
     template_name = 'admin_panel/audit_logs/audit_log_list.html'
@@ -405,12 +413,6 @@ class AuditLogListView(LoginRequiredMixin, AdminRequiredMixin, ListView):
         # 获取用户列表供筛选使用
         context['users'] = User.objects.all()
         
-        # 保存当前查询字符串，便于分页使用
-        query_params = self.request.GET.copy()
-        if 'page' in query_params:
-            del query_params['page']
-        context['query_string'] = query_params.urlencode()
-        
         return context
 
 # 用户层级树状图视图
@@ -594,3 +596,52 @@ class RoleDeleteView(LoginRequiredMixin, SuperuserRequiredMixin, DeleteView):
         
         messages.success(request, f'角色 {role_name} 已删除！')
         return response
+
+# 指标导出视图
+class MetricsView(LoginRequiredMixin, SuperuserRequiredMixin, View):
+    """
+    以Prometheus文本格式导出数据接入指标（合并数据接入、TCP服务器等进程的快照），
+    ?format=json时返回按标签汇总的结果供系统监控页面使用。
+    配置了METRICS_CONFIG['TOKEN']时，Prometheus可通过Authorization: Bearer <token>免登录抓取。
+    """
+    
+    def dispatch(self, request, *args, **kwargs):
+        token = getattr(settings, 'METRICS_CONFIG', {}).get('TOKEN')
+        # 按字节比较：compare_digest不支持含非ASCII字符的str
+        authorization = request.headers.get('Authorization', '').encode('utf-8')
+        if token and hmac.compare_digest(authorization, f'Bearer {token}'.encode('utf-8')):
+            # 令牌只用于抓取指标，不放行其他请求方法
+            if request.method != 'GET':
+                return self.http_method_not_allowed(request, *args, **kwargs)
+            return self.get(request, *args, **kwargs)
+        return super().dispatch(request, *args, **kwargs)
+    
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('format') == 'json':
+            return JsonResponse({
+                'timestamp': time.time(),
+                'metrics': _json_safe(metrics.summarize()),
+            })
+        return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _json_safe(value):
+    """把直方图分位数中的inf转换为字符串（JSON不支持Infinity）"""
+    if isinstance(value, dict):
+        return {key: _json_safe(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_json_safe(item) for item in value]
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf'
+    return value
+
+# 系统监控视图
+class SystemMonitorView(LoginRequiredMixin, SuperuserRequiredMixin, TemplateView):
+    """系统监控页面，定期从指标接口获取数据，展示吞吐量、队列长度和各阶段耗时"""
+    template_name = 'admin_panel/monitor/system_monitor.html'
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['title'] = '系统监控'
+        context['processes'] = [process for process, _ in metrics.collect_all()]
+        return context
@@ -0,0 +1,116 @@
+import json
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+# 自动选择时的优先顺序
+CODEC_PREFERENCE = ('orjson', 'ujson', 'json')
+
+
+class JSONCodec:
+    """
+    可替换的JSON编解码器
+
+    统一TCP服务器和MQTT客户端的消息编解码，支持orjson、ujson和标准库json：
+    - loads接受str、bytes、bytearray和memoryview（orjson直接解析memoryview，无需复制）
+    - dumps统一返回UTF-8编码的bytes，可直接写入socket或作为MQTT载荷
+    - 解析失败统一抛出ValueError（json.JSONDecodeError、orjson.JSONDecodeError和ujson的错误都是其子类）
+    - 快速编码器不支持的类型（如Decimal）回退到标准库json，保证输出与原来一致
+    """
+
+    DecodeError = ValueError
+
+    def __init__(self, name='auto'):
+        """
+        初始化编解码器
+        :param name: orjson、ujson、json或auto（按CODEC_PREFERENCE选择第一个已安装的库）
+        """
+        candidates = CODEC_PREFERENCE if name == 'auto' else (name,)
+        for candidate in candidates:
+            try:
+                self.name, self._loads, self._dumps = getattr(self, f'_load_{candidate}')()
+                break
+            except ImportError:
+                logger.debug(f"JSON库 {candidate} 未安装")
+            except AttributeError:
+                raise ValueError(f"不支持的JSON编解码器: {candidate}")
+        else:
+            logger.warning(f"JSON库 {name} 未安装，使用标准库json")
+            self.name, self._loads, self._dumps = self._load_json()
+
+    @classmethod
+    def from_settings(cls):
+        """根据settings.JSON_CODEC创建编解码器"""
+        return cls(getattr(settings, 'JSON_CODEC', 'auto'))
+
+    @staticmethod
+    def _load_orjson():
+        import orjson
+        return 'orjson', orjson.loads, orjson.dumps
+
+    @staticmethod
+    def _load_ujson():
+        import ujson
+
+        def loads(data):
+            # ujson不接受bytearray/memoryview
+            return ujson.loads(data if isinstance(data, (str, bytes)) else bytes(data))
+
+        def dumps(obj):
+            return ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+        return 'ujson', loads, dumps
+
+    @staticmethod
+    def _load_json():
+        def loads(data):
+            return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+        def dumps(obj):
+            return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+        return 'json', loads, dumps
+
+    def loads(self, data):
+        """解析JSON数据"""
+        return self._loads(data)
+
+    def dumps(self, obj):
+        """编码为UTF-8 JSON bytes"""
+        try:
+            return self._dumps(obj)
+        except TypeError:
+            if self.name == 'json':
+                raise
+            return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    def __repr__(self):
+        return f'<JSONCodec {self.name}>'
+
+
+# 解析失败时抛出的异常类型（except codec.DecodeError）
+DecodeError = JSONCodec.DecodeError
+
+_codec = None
+
+
+def get_codec():
+    """获取全局编解码器（首次使用时根据设置创建）"""
+    global _codec
+    if _codec is None:
+        _codec = JSONCodec.from_settings()
+        logger.info(f"JSON编解码器: {_codec.name}")
+    return _codec
+
+
+def loads(data):
+    """使用全局编解码器解析JSON"""
+    return get_codec().loads(data)
+
+
+def dumps(obj):
+    """使用全局编解码器编码为UTF-8 JSON bytes"""
+    return get_codec().dumps(obj)
@@ -0,0 +1,305 @@
+"""
+内部事件总线
+
+数据接入、TCP服务器和Web进程之间通过事件通知彼此，不直接调用对方的代码：
+- READING_INGESTED：一批传感器数据已写入数据库
+- DEVICE_STATUS_CHANGED：设备上线、离线或上报了状态
+- COMMAND_ACKED：设备响应了执行器命令
+事件内容只包含可序列化的基本类型（dict/list/str/int/float/bool/None），时间为ISO格式字符串。
+
+后端由settings.EVENT_BUS_CONFIG['BACKEND']选择：
+- channels：通过Channels通道层（生产环境为Redis）的组分发，每个订阅了该事件类型的进程都会收到一份
+- local：只在本进程内同步分发，用于开发环境和测试（测试中可直接检查published列表）
+事件是尽力投递的通知，不保证送达，需要可靠性的数据应以数据库为准。
+"""
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+
+from core.metrics import EVENTS_PUBLISHED
+
+logger = logging.getLogger(__name__)
+
+
+# 事件类型（同时用作通道层组名的一部分，只能包含ASCII字母、数字、连字符、下划线和点）
+READING_INGESTED = 'reading.ingested'
+DEVICE_STATUS_CHANGED = 'device.status_changed'
+COMMAND_ACKED = 'command.acked'
+
+EVENT_TYPES = (READING_INGESTED, DEVICE_STATUS_CHANGED, COMMAND_ACKED)
+
+
+class EventBus:
+    """事件总线基类：维护订阅关系并把事件分发给处理函数"""
+
+    def __init__(self):
+        self._handlers = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        """根据settings.EVENT_BUS_CONFIG创建事件总线"""
+        config = getattr(settings, 'EVENT_BUS_CONFIG', {})
+        backend = config.get('BACKEND', 'local')
+        if backend == 'channels':
+            return ChannelLayerEventBus(
+                group_prefix=config.get('GROUP_PREFIX', 'events'),
+                event_types=config.get('PUBLISH_EVENTS'),
+                max_pending=config.get('MAX_PENDING', 10000),
+            )
+        if backend != 'local':
+            logger.warning(f"未知的事件总线后端: {backend}，使用进程内总线")
+        return LocalEventBus()
+
+    def subscribe(self, event_type, handler):
+        """
+        订阅事件
+        :param event_type: 事件类型
+        :param handler: 处理函数，参数为(event_type, payload)
+        """
+        with self._lock:
+            if handler not in self._handlers[event_type]:
+                self._handlers[event_type].append(handler)
+
+    def unsubscribe(self, event_type, handler):
+        """取消订阅"""
+        with self._lock:
+            if handler in self._handlers.get(event_type, ()):
+                self._handlers[event_type].remove(handler)
+
+    def wants(self, event_type):
+        """是否可能有接收者，没有时发布方可以跳过构造事件内容"""
+        return True
+
+    def publish(self, event_type, payload):
+        """发布事件（不会抛出异常，失败时只记录日志）"""
+        raise NotImplementedError
+
+    def start(self):
+        """开始接收其他进程的事件"""
+
+    def stop(self, timeout=5):
+        """停止接收事件"""
+
+    def dispatch(self, event_type, payload):
+        """
+        把事件交给本进程的处理函数，单个处理函数出错不影响其他处理函数
+        :return: 调用的处理函数数
+        """
+        with self._lock:
+            handlers = list(self._handlers.get(event_type, ()))
+        for handler in handlers:
+            try:
+                handler(event_type, payload)
+            except Exception as e:
+                logger.exception(f"处理事件 {event_type} 时出错: {str(e)}")
+        return len(handlers)
+
+
+class LocalEventBus(EventBus):
+    """
+    进程内事件总线
+
+    publish()在调用线程中同步调用处理函数，并把事件记录到published列表，
+    测试可以替换全局总线后检查发布了哪些事件。
+    """
+
+    def __init__(self, record=False):
+        """
+        :param record: 是否记录发布的事件（测试用，长期运行的进程不要开启）
+        """
+        super().__init__()
+        self.record = record
+        self.published = []
+
+    def wants(self, event_type):
+        return self.record or bool(self._handlers.get(event_type))
+
+    def publish(self, event_type, payload):
+        EVENTS_PUBLISHED.inc(event=event_type)
+        if self.record:
+            self.published.append((event_type, payload))
+        self.dispatch(event_type, payload)
+
+    def clear(self):
+        """清空已记录的事件"""
+        self.published = []
+
+
+class ChannelLayerEventBus(EventBus):
+    """
+    基于Channels通道层的跨进程事件总线
+
+    每种事件类型对应一个通道层组（<前缀>.<事件类型>），发布即向该组group_send；
+    订阅了事件的进程在后台线程中创建自己的通道并加入相应的组，收到消息后在该线程中调用处理函数。
+    publish()只把事件放入待发送队列，由发送线程批量group_send（与RealtimePublisher相同），
+    数据接入写入线程、TCP事件循环都不会等待通道层；队列超过max_pending时丢弃新事件。
+    """
+
+    # 通道层的组成员关系会过期（channels_redis默认一天），定期重新加入
+    GROUP_REFRESH_INTERVAL = 3600
+
+    def __init__(self, group_prefix='events', event_types=None, max_pending=10000):
+        """
+        :param event_types: 发布的事件类型，None表示全部；其他类型wants()返回False，发布方直接跳过
+        :param max_pending: 待发送队列的最大长度
+        """
+        super().__init__()
+        self.group_prefix = group_prefix
+        self.event_types = None if event_types is None else frozenset(event_types)
+        self.max_pending = max_pending
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sender = None
+        self._sender_stop = threading.Event()
+
+    def group(self, event_type):
+        """事件类型对应的通道层组名"""
+        return f"{self.group_prefix}.{event_type}"
+
+    def subscribe(self, event_type, handler):
+        super().subscribe(event_type, handler)
+        self.start()
+
+    def wants(self, event_type):
+        return self.event_types is None or event_type in self.event_types
+
+    def publish(self, event_type, payload):
+        if not self.wants(event_type):
+            return
+        with self._pending_lock:
+            if len(self._pending) >= self.max_pending:
+                logger.warning(f"待发送事件超过 {self.max_pending} 条，丢弃事件 {event_type}")
+                return
+            self._pending.append((event_type, payload))
+            if self._sender is None or not self._sender.is_alive():
+                self._sender_stop.clear()
+                self._sender = threading.Thread(target=self._send_loop, name='event-bus-sender', daemon=True)
+                self._sender.start()
+        self._wakeup.set()
+
+    def _send_loop(self):
+        while True:
+            self._wakeup.wait(1)
+            self._wakeup.clear()
+            stopping = self._sender_stop.is_set()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"发送事件时出错: {str(e)}")
+            if stopping:
+                break
+
+    def flush(self):
+        """
+        发送队列中的事件
+        :return: 发送的事件数
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+
+        from channels.layers import get_channel_layer
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return 0
+        async_to_sync(self._send_all)(channel_layer, pending)
+        return len(pending)
+
+    async def _send_all(self, channel_layer, pending):
+        for event_type, payload in pending:
+            try:
+                await channel_layer.group_send(self.group(event_type), {
+                    'type': 'event.message',
+                    'event': event_type,
+                    'payload': payload,
+                })
+                EVENTS_PUBLISHED.inc(event=event_type)
+            except Exception as e:
+                logger.error(f"发布事件 {event_type} 失败: {str(e)}")
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='event-bus', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """停止接收事件，并发送队列中剩余的事件"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._sender_stop.set()
+        self._wakeup.set()
+        if self._sender is not None:
+            self._sender.join(timeout)
+            self._sender = None
+
+    def _run(self):
+        try:
+            asyncio.run(self._listen())
+        except Exception as e:
+            logger.exception(f"事件总线接收线程异常退出: {str(e)}")
+
+    async def _listen(self):
+        """接收本进程订阅的事件，新订阅的事件类型在下一次循环时加入对应的组"""
+        from channels.layers import get_channel_layer
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            logger.error("未配置通道层，无法接收事件")
+            return
+
+        channel = await channel_layer.new_channel('events.')
+        joined = {}
+        loop = asyncio.get_running_loop()
+        try:
+            while not self._stop_event.is_set():
+                with self._lock:
+                    event_types = [event_type for event_type, handlers in self._handlers.items() if handlers]
+                now = loop.time()
+                for event_type in event_types:
+                    if now - joined.get(event_type, float('-inf')) >= self.GROUP_REFRESH_INTERVAL:
+                        await channel_layer.group_add(self.group(event_type), channel)
+                        joined[event_type] = now
+
+                try:
+                    message = await asyncio.wait_for(channel_layer.receive(channel), timeout=1)
+                except asyncio.TimeoutError:
+                    continue
+                self.dispatch(message.get('event'), message.get('payload'))
+        finally:
+            for event_type in joined:
+                try:
+                    await channel_layer.group_discard(self.group(event_type), channel)
+                except Exception as e:
+                    logger.warning(f"退出事件组 {event_type} 失败: {str(e)}")
+
+
+# 全局事件总线
+event_bus = EventBus.from_settings()
+
+
+def publish(event_type, payload):
+    """向全局事件总线发布事件"""
+    event_bus.publish(event_type, payload)
+
+
+def subscribe(event_type, handler):
+    """订阅全局事件总线的事件"""
+    event_bus.subscribe(event_type, handler)
+
+
+def wants(event_type):
+    """全局事件总线上是否可能有该事件的接收者"""
+    return event_bus.wants(event_type)
@@ -0,0 +1,62 @@
+import os
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.metrics import read_snapshots
+from core.profiling import profiler
+
+
+class Command(BaseCommand):
+    help = ('对运行中的数据接入、TCP服务器进程做性能剖析：发送开关信号，等待指定时间后再次发送，'
+            '各进程把折叠调用栈和阶段耗时写入PROFILING_CONFIG[\'OUTPUT_DIR\']')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pid', type=int, action='append', default=[],
+                            help='目标进程号，可以指定多次')
+        parser.add_argument('--all', action='store_true',
+                            help='剖析所有正在上报指标快照的进程（run_mqtt_ingest、TCP服务器）')
+        parser.add_argument('--duration', type=float, default=30,
+                            help='剖析持续时间（秒），0表示只发送一次信号（切换开关状态）')
+
+    def handle(self, *args, **options):
+        pids = set(options['pid'])
+        if options['all']:
+            for snapshot in read_snapshots():
+                pids.add(int(snapshot['process'].rsplit('-', 1)[1]))
+        if not pids:
+            raise CommandError('请使用--pid指定进程，或使用--all剖析所有上报指标的进程')
+
+        signal_name = getattr(settings, 'PROFILING_CONFIG', {}).get('SIGNAL', 'SIGUSR1')
+        signum = getattr(signal, signal_name, None)
+        if signum is None:
+            raise CommandError(f"当前平台不支持信号 {signal_name}")
+
+        pids = self.send(pids, signum)
+        if not pids:
+            raise CommandError('没有可剖析的进程')
+        if not options['duration']:
+            self.stdout.write(f"已向 {len(pids)} 个进程发送 {signal_name}（切换剖析开关）")
+            return
+
+        self.stdout.write(f"已开启 {len(pids)} 个进程的性能剖析，{options['duration']}s 后关闭...")
+        try:
+            time.sleep(options['duration'])
+        finally:
+            self.send(pids, signum)
+        self.stdout.write(self.style.SUCCESS(f"剖析结果已写入 {profiler.output_dir}"))
+
+    def send(self, pids, signum):
+        """向进程发送信号，返回发送成功的进程号"""
+        sent = set()
+        for pid in sorted(pids):
+            try:
+                os.kill(pid, signum)
+                sent.add(pid)
+            except ProcessLookupError:
+                self.stdout.write(self.style.WARNING(f"进程 {pid} 不存在"))
+            except PermissionError:
+                self.stdout.write(self.style.WARNING(f"没有权限向进程 {pid} 发送信号"))
+        return sent
@@ -0,0 +1,469 @@
+"""
+进程内指标注册表
+
+提供计数器、仪表和直方图三种指标，以Prometheus文本格式导出。
+数据接入和TCP服务器运行在独立进程中，各进程定期把指标快照写入
+METRICS_CONFIG['SNAPSHOT_DIR']，Web进程导出时合并这些快照（每个进程的序列带process标签）。
+"""
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+# 延迟直方图默认分桶（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labelnames, labels):
+    """按标签名顺序把标签值转换为元组"""
+    if len(labels) != len(labelnames):
+        raise ValueError(f"标签不匹配，需要 {labelnames}，实际 {tuple(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+class Metric:
+    """指标基类，按标签值元组保存各序列的值"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def collect(self):
+        """
+        当前各序列的值
+        :return: [(标签值元组, 值)]
+        """
+        with self._lock:
+            return list(self._values.items())
+
+
+class Counter(Metric):
+    """只增不减的计数器"""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """可增可减的瞬时值，也可以在采集时通过函数读取（如队列长度）"""
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        """采集时调用function()获取该序列的值"""
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+
+        for key, function in functions:
+            try:
+                values[key] = function()
+            except Exception as e:
+                logger.debug(f"读取指标 {self.name} 时出错: {str(e)}")
+        return list(values.items())
+
+
+class Histogram(Metric):
+    """分桶直方图，记录每个桶的计数、总和与样本数"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            # 非累积计数，导出时再累加
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][index] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录with代码块的耗时（秒）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self):
+        with self._lock:
+            return [
+                (key, {'buckets': list(state['buckets']), 'sum': state['sum'], 'count': state['count']})
+                for key, state in self._values.items()
+            ]
+
+
+def histogram_quantile(buckets, counts, total, quantile):
+    """
+    根据分桶计数估算分位数（返回所在桶的上界）
+    :param buckets: 桶上界
+    :param counts: 各桶的非累积计数
+    :param total: 样本总数（包括超出最大桶的样本）
+    :return: 估算值，没有样本时返回None，超出最大桶时返回inf
+    """
+    if not total:
+        return None
+    threshold = quantile * total
+    cumulative = 0
+    for bound, count in zip(buckets, counts):
+        cumulative += count
+        if cumulative >= threshold:
+            return bound
+    return math.inf
+
+
+class MetricsRegistry:
+    """指标注册表，同名指标只创建一次"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.type}")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def snapshot(self):
+        """
+        导出本进程所有指标（可JSON序列化）
+        :return: {指标名: {'type', 'help', 'labelnames', 'buckets', 'values': [[标签值列表, 值]]}}
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        result = {}
+        for metric in metrics:
+            result[metric.name] = {
+                'type': metric.type,
+                'help': metric.documentation,
+                'labelnames': list(metric.labelnames),
+                'buckets': list(getattr(metric, 'buckets', ())),
+                'values': [[list(key), value] for key, value in metric.collect()],
+            }
+        return result
+
+
+def _config():
+    return getattr(settings, 'METRICS_CONFIG', {})
+
+
+def snapshot_dir():
+    """多进程指标快照目录"""
+    return str(_config().get('SNAPSHOT_DIR') or os.path.join(tempfile.gettempdir(), 'novacloud-metrics'))
+
+
+class SnapshotWriter:
+    """定期把本进程的指标快照写入快照目录（文件名为<角色>-<pid>.json）"""
+
+    def __init__(self, registry, role, directory, interval=5):
+        self.registry = registry
+        self.role = role
+        self.directory = directory
+        self.interval = interval
+        self.path = os.path.join(directory, f"{role}-{os.getpid()}.json")
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='metrics-snapshot', daemon=True)
+        self._thread.start()
+        logger.info(f"指标快照写入已启动: {self.path}")
+
+    def stop(self, timeout=5):
+        """停止写入并删除快照文件（进程退出后不再导出其指标）"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def write(self):
+        """原子地写入一次快照"""
+        data = {
+            'process': f"{self.role}-{os.getpid()}",
+            'updated_at': time.time(),
+            'metrics': self.registry.snapshot(),
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while True:
+            try:
+                self.write()
+            except Exception as e:
+                logger.error(f"写入指标快照时出错: {str(e)}")
+            if self._stop_event.wait(self.interval):
+                break
+
+
+def read_snapshots(directory=None, max_age=None):
+    """
+    读取其他进程的指标快照，跳过本进程和已过期的快照（过期文件会被删除）
+    :return: [快照dict]
+    """
+    directory = directory or snapshot_dir()
+    if max_age is None:
+        max_age = _config().get('SNAPSHOT_TTL', 60)
+    if not os.path.isdir(directory):
+        return []
+
+    own_suffix = f"-{os.getpid()}.json"
+    now = time.time()
+    snapshots = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json') or filename.endswith(own_suffix):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+        if now - data.get('updated_at', 0) > max_age:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        snapshots.append(data)
+    return snapshots
+
+
+def collect_all(include_snapshots=True):
+    """
+    合并本进程和其他进程的指标
+    :return: [(进程名, 指标快照)]
+    """
+    sources = [(f"{_process_role}-{os.getpid()}", registry.snapshot())]
+    if include_snapshots:
+        sources.extend((data['process'], data['metrics']) for data in read_snapshots())
+    return sources
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(sources=None):
+    """以Prometheus文本格式导出指标，每个进程的序列带process标签"""
+    if sources is None:
+        sources = collect_all()
+
+    families = {}
+    for process, metrics in sources:
+        for name, family in metrics.items():
+            merged = families.setdefault(name, dict(family, series=[]))
+            merged['series'].extend((process, labels, value) for labels, value in family['values'])
+
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        labelnames = ['process'] + family['labelnames']
+        for process, labels, value in family['series']:
+            values = [process] + labels
+            if family['type'] != 'histogram':
+                lines.append(f"{name}{_format_labels(labelnames, values)} {_format_value(value)}")
+                continue
+
+            cumulative = 0
+            for bound, count in zip(family['buckets'], value['buckets']):
+                cumulative += count
+                bucket_labels = _format_labels(labelnames + ['le'], values + [_format_value(bound)])
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            inf_labels = _format_labels(labelnames + ['le'], values + ['+Inf'])
+            lines.append(f"{name}_bucket{inf_labels} {value['count']}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(value['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labelnames, values)} {value['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def summarize(sources=None):
+    """
+    按标签汇总所有进程的指标（管理面板展示用）
+    直方图给出样本数、平均值和p50/p95/p99估算值（秒）
+    :return: {指标名: {'type', 'help', 'labelnames', 'series': [{'labels': dict, 'value'...}]}}
+    """
+    if sources is None:
+        sources = collect_all()
+
+    merged = {}
+    for _, metrics in sources:
+        for name, family in metrics.items():
+            target = merged.setdefault(name, {
+                'type': family['type'],
+                'help': family['help'],
+                'labelnames': family['labelnames'],
+                'buckets': family['buckets'],
+                'values': {},
+            })
+            for labels, value in family['values']:
+                key = tuple(labels)
+                if family['type'] != 'histogram':
+                    target['values'][key] = target['values'].get(key, 0) + value
+                    continue
+                state = target['values'].setdefault(key, {'buckets': [0] * len(family['buckets']), 'sum': 0.0, 'count': 0})
+                state['buckets'] = [a + b for a, b in zip(state['buckets'], value['buckets'])]
+                state['sum'] += value['sum']
+                state['count'] += value['count']
+
+    summary = {}
+    for name in sorted(merged):
+        family = merged[name]
+        series = []
+        for key, value in sorted(family['values'].items()):
+            item = {'labels': dict(zip(family['labelnames'], key))}
+            if family['type'] == 'histogram':
+                count = value['count']
+                item.update({
+                    'count': count,
+                    'sum': value['sum'],
+                    'avg': value['sum'] / count if count else None,
+                    'p50': histogram_quantile(family['buckets'], value['buckets'], count, 0.5),
+                    'p95': histogram_quantile(family['buckets'], value['buckets'], count, 0.95),
+                    'p99': histogram_quantile(family['buckets'], value['buckets'], count, 0.99),
+                })
+            else:
+                item['value'] = value
+            series.append(item)
+        summary[name] = {'type': family['type'], 'help': family['help'], 'series': series}
+    return summary
+
+
+# 全局指标注册表
+registry = MetricsRegistry()
+
+_process_role = 'web'
+_snapshot_writer = None
+
+
+def start_snapshot_writer(role):
+    """
+    在独立运行的进程（数据接入、TCP服务器）中启动快照写入，
+    使Web进程的指标接口能够导出这些进程的指标
+    """
+    global _process_role, _snapshot_writer
+
+    _process_role = role
+    if _snapshot_writer is None:
+        _snapshot_writer = SnapshotWriter(registry, role, snapshot_dir(), _config().get('SNAPSHOT_INTERVAL', 5))
+        _snapshot_writer.start()
+    return _snapshot_writer
+
+
+def stop_snapshot_writer():
+    """停止快照写入并删除本进程的快照文件"""
+    global _snapshot_writer
+
+    if _snapshot_writer is not None:
+        _snapshot_writer.stop()
+        _snapshot_writer = None
+
+
+# 数据接入链路指标
+MESSAGES_RECEIVED = registry.counter(
+    'novacloud_messages_received_total', '接收的设备消息数', ['protocol'])
+MESSAGES_DROPPED = registry.counter(
+    'novacloud_messages_dropped_total', '因队列已满丢弃的消息数', ['queue'])
+DECODE_ERRORS = registry.counter(
+    'novacloud_decode_errors_total', '无法解码的设备消息数', ['protocol'])
+READINGS_WRITTEN = registry.counter(
+    'novacloud_readings_written_total', '写入数据库的传感器数据行数')
+WRITE_ERRORS = registry.counter(
+    'novacloud_write_errors_total', '失败的批量写入次数')
+QUEUE_DEPTH = registry.gauge(
+    'novacloud_queue_depth', '接入队列中等待处理的消息数', ['queue'])
+TCP_CONNECTIONS = registry.gauge(
+    'novacloud_tcp_connections', '当前TCP设备连接数')
+STAGE_LATENCY = registry.histogram(
+    'novacloud_stage_duration_seconds', '数据接入各阶段耗时（decode/lookup/write/evaluate/actions）', ['stage'])
+EVENTS_PUBLISHED = registry.counter(
+    'novacloud_events_published_total', '发布到内部事件总线的事件数', ['event'])
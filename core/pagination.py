@@ -0,0 +1,189 @@
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class InvalidCursor(ValueError):
+    """游标格式无效"""
+
+
+def encode_cursor(timestamp, pk):
+    """把(时间, 主键)编码为URL安全的游标字符串"""
+    raw = f"{timestamp.isoformat()}|{pk}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    解析游标字符串
+    :return: (时间, 主键)；格式无效时抛出InvalidCursor
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, pk = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').split('|', 1)
+        parsed = parse_datetime(timestamp)
+        if parsed is None:
+            raise ValueError(timestamp)
+        return parsed, int(pk)
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise InvalidCursor(f"无效的分页游标: {cursor}") from e
+
+
+class KeysetPage:
+    """游标分页的一页数据"""
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    基于(时间, 主键)的游标分页，按时间倒序（最新的在前）
+
+    每一页只查询per_page + 1行，使用 WHERE (时间, 主键) < 游标 代替OFFSET，
+    任意深度的翻页代价都和第一页相同；总条数只在需要时单独查询。
+    """
+
+    def __init__(self, queryset, per_page, field='timestamp'):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.field = field
+        self._count = None
+
+    @property
+    def count(self):
+        """精确总条数（需要COUNT(*)，仅在模板或调用方显式使用时查询）"""
+        if self._count is None:
+            self._count = self.queryset.count()
+        return self._count
+
+    def page(self, cursor=None, direction='next'):
+        """
+        获取一页数据
+        :param cursor: 上一次返回的next_cursor或previous_cursor，为空时返回第一页
+        :param direction: next表示更早的数据，previous表示更新的数据
+        """
+        field = self.field
+        queryset = self.queryset
+
+        if cursor:
+            timestamp, pk = decode_cursor(cursor)
+            if direction == 'previous':
+                queryset = queryset.filter(Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'pk__gt': pk}))
+            else:
+                queryset = queryset.filter(Q(**{f'{field}__lt': timestamp}) | Q(**{field: timestamp, 'pk__lt': pk}))
+
+        if cursor and direction == 'previous':
+            rows = list(queryset.order_by(field, 'pk')[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            # 从后一页返回，后面一定还有数据
+            has_next, has_previous = bool(rows), has_more
+        else:
+            rows = list(queryset.order_by(f'-{field}', '-pk')[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_next, has_previous = has_more, bool(cursor) and bool(rows)
+
+        return KeysetPage(
+            rows,
+            self,
+            next_cursor=self._cursor_for(rows[-1]) if has_next and rows else None,
+            previous_cursor=self._cursor_for(rows[0]) if has_previous and rows else None,
+        )
+
+    def _cursor_for(self, obj):
+        return encode_cursor(getattr(obj, self.field), obj.pk)
+
+
+class KeysetPaginationMixin:
+    """
+    ListView游标分页混入类
+
+    替换ListView默认的页码分页。模板中使用page_obj.next_cursor / page_obj.previous_cursor
+    构造翻页链接，需要总条数时请求参数带上count=1。
+    """
+    keyset_field = 'timestamp'
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, self.keyset_field)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'), self.request.GET.get('direction', 'next'))
+        except InvalidCursor:
+            # 无效游标回到第一页
+            page = paginator.page()
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+
+        # 翻页链接需要保留的其他查询参数
+        query_params = self.request.GET.copy()
+        for key in ('cursor', 'direction', 'page'):
+            query_params.pop(key, None)
+        context['cursor_query_string'] = query_params.urlencode()
+
+        context['total_count'] = None
+        if self.request.GET.get('count') == '1' and context.get('paginator') is not None:
+            context['total_count'] = context['paginator'].count
+        return context
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    DRF游标分页：与KeysetPaginationMixin相同的游标格式
+    参数：cursor、direction（next/previous）、page_size、count=1时返回总条数
+    """
+    page_size = 50
+    max_page_size = 1000
+    keyset_field = 'timestamp'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        try:
+            page_size = min(int(request.query_params.get('page_size', self.page_size)), self.max_page_size)
+        except ValueError:
+            page_size = self.page_size
+        self.paginator = KeysetPaginator(queryset, max(page_size, 1), self.keyset_field)
+        self.request = request
+
+        try:
+            self.page = self.paginator.page(
+                request.query_params.get('cursor'), request.query_params.get('direction', 'next')
+            )
+        except InvalidCursor as e:
+            raise ValidationError({'cursor': str(e)})
+        return self.page.object_list
+
+    def get_paginated_response(self, data):
+        result = OrderedDict([
+            ('next_cursor', self.page.next_cursor),
+            ('previous_cursor', self.page.previous_cursor),
+        ])
+        if self.request.query_params.get('count') == '1':
+            result['count'] = self.paginator.count
+        result['results'] = data
+        return Response(result)
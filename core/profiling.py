@@ -0,0 +1,273 @@
+"""
+数据接入热路径的性能剖析
+
+- 阶段计时：span(name)包裹的代码块在剖析开启时记录次数、总耗时、自身耗时（扣除嵌套的子阶段）和最大耗时；
+  未开启时返回空上下文，开销可以忽略
+- 采样剖析：后台线程按固定间隔采集所有线程的调用栈，输出flamegraph.pl/speedscope可读取的折叠栈格式
+运行中的进程收到SIGUSR1时开启或关闭剖析，关闭时把结果写入PROFILING_CONFIG['OUTPUT_DIR']
+（也可以用 python manage.py profile_pipeline 发送信号）。
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+# 当前上下文（线程或asyncio任务）中正在执行的阶段，用于计算自身耗时
+_span_stack = contextvars.ContextVar('profiling_span_stack', default=())
+
+# 剖析关闭时span()返回的空上下文
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    """一次阶段计时"""
+
+    __slots__ = ('profiler', 'name', 'started', 'children', 'token')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.children = 0.0
+
+    def __enter__(self):
+        self.token = _span_stack.set(_span_stack.get() + (self,))
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        _span_stack.reset(self.token)
+        stack = _span_stack.get()
+        if stack:
+            stack[-1].children += duration
+        self.profiler.record(self.name, duration, duration - self.children)
+        return False
+
+
+class Profiler:
+    """
+    阶段计时和采样剖析
+
+    start()开启、stop()关闭并输出结果，两者可以在运行中随时切换；
+    超过max_duration秒未关闭时自动关闭，避免长期开启影响性能。
+    """
+
+    def __init__(self, output_dir, sample_interval=0.005, max_duration=300):
+        """
+        初始化剖析器
+        :param output_dir: 结果输出目录
+        :param sample_interval: 调用栈采样间隔（秒），0表示只做阶段计时
+        :param max_duration: 单次剖析的最长时间（秒），0表示不限制
+        """
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.max_duration = max_duration
+        self.role = 'web'
+        self.enabled = False
+
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._stacks = Counter()
+        self._samples = 0
+        self._started_at = None
+        self._sampler = None
+        self._stop_event = threading.Event()
+
+    @classmethod
+    def from_settings(cls):
+        """根据settings.PROFILING_CONFIG创建剖析器"""
+        config = getattr(settings, 'PROFILING_CONFIG', {})
+        output_dir = config.get('OUTPUT_DIR') or os.path.join(settings.BASE_DIR, 'logs', 'profiles')
+        return cls(
+            output_dir=str(output_dir),
+            sample_interval=config.get('SAMPLE_INTERVAL', 0.005),
+            max_duration=config.get('MAX_DURATION', 300),
+        )
+
+    def span(self, name):
+        """阶段计时上下文，剖析关闭时不做任何记录"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def record(self, name, duration, self_duration):
+        """记录一次阶段耗时"""
+        with self._lock:
+            stats = self._timings.get(name)
+            if stats is None:
+                stats = self._timings[name] = {'count': 0, 'total': 0.0, 'self': 0.0, 'max': 0.0}
+            stats['count'] += 1
+            stats['total'] += duration
+            stats['self'] += self_duration
+            if duration > stats['max']:
+                stats['max'] = duration
+
+    def start(self):
+        """开启剖析（清空上一次的结果）"""
+        with self._lock:
+            if self.enabled:
+                return
+            self._timings = {}
+            self._stacks = Counter()
+            self._samples = 0
+            self._started_at = time.time()
+            self._stop_event.clear()
+            self.enabled = True
+
+        self._sampler = threading.Thread(target=self._run_sampler, name='profiler-sampler', daemon=True)
+        self._sampler.start()
+        logger.info(f"性能剖析已开启，采样间隔 {self.sample_interval}s，最长 {self.max_duration}s")
+
+    def stop(self):
+        """
+        关闭剖析并输出结果
+        :return: 输出的文件路径列表
+        """
+        with self._lock:
+            if not self.enabled:
+                return []
+            self.enabled = False
+        self._stop_event.set()
+        if self._sampler is not None and self._sampler is not threading.current_thread():
+            self._sampler.join()
+        self._sampler = None
+
+        paths = self.dump()
+        logger.info(f"性能剖析已关闭，结果: {', '.join(paths)}")
+        return paths
+
+    def toggle(self):
+        """切换剖析状态"""
+        if self.enabled:
+            self.stop()
+        else:
+            self.start()
+
+    def _run_sampler(self):
+        """采样线程：定期采集其他线程的调用栈，并在超时后自动关闭剖析"""
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + self.max_duration if self.max_duration else None
+        interval = self.sample_interval or 1.0
+
+        while not self._stop_event.wait(interval):
+            if deadline is not None and time.monotonic() >= deadline:
+                logger.info("性能剖析已达到最长时间，自动关闭")
+                threading.Thread(target=self.stop, name='profiler-stop', daemon=True).start()
+                return
+            if self.sample_interval:
+                self._sample(own_ident)
+
+    def _sample(self, own_ident):
+        """采集一次所有线程的调用栈（折叠为根在前的字符串）"""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            parts.append(names.get(ident, f'thread-{ident}'))
+            stacks.append(';'.join(reversed(parts)))
+
+        with self._lock:
+            self._stacks.update(stacks)
+            self._samples += 1
+
+    def dump(self):
+        """
+        把本次剖析结果写入输出目录
+        - <角色>-<pid>-<时间>.stacks：折叠栈，可用flamegraph.pl或speedscope生成火焰图
+        - <角色>-<pid>-<时间>.timings.txt：各阶段耗时汇总（按总耗时排序）
+        :return: 文件路径列表
+        """
+        with self._lock:
+            timings = dict(self._timings)
+            stacks = Counter(self._stacks)
+            samples = self._samples
+            started_at = self._started_at or time.time()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(
+            self.output_dir, f"{self.role}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(started_at))}"
+        )
+        elapsed = time.time() - started_at
+        paths = []
+
+        if stacks:
+            path = f"{prefix}.stacks"
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            paths.append(path)
+
+        path = f"{prefix}.timings.txt"
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"# 进程 {self.role}-{os.getpid()}，剖析 {elapsed:.1f}s，调用栈采样 {samples} 次\n")
+            f.write(f"{'阶段':<32}{'次数':>10}{'总耗时(s)':>12}{'自身(s)':>12}{'平均(ms)':>10}{'最大(ms)':>10}\n")
+            for name, stats in sorted(timings.items(), key=lambda item: item[1]['total'], reverse=True):
+                f.write(
+                    f"{name:<32}{stats['count']:>10}{stats['total']:>12.3f}{stats['self']:>12.3f}"
+                    f"{stats['total'] / stats['count'] * 1000:>10.3f}{stats['max'] * 1000:>10.3f}\n"
+                )
+        paths.append(path)
+        return paths
+
+
+# 全局剖析器
+profiler = Profiler.from_settings()
+
+
+def span(name):
+    """阶段计时上下文（剖析关闭时开销可以忽略）"""
+    return profiler.span(name)
+
+
+def profiled(name):
+    """用阶段计时包裹函数或协程函数的装饰器"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with profiler.span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def install_signal_handler(role):
+    """
+    在长期运行的进程（数据接入、TCP服务器）中注册剖析开关信号，必须在主线程调用
+    信号处理函数只启动切换线程，写文件不阻塞主线程的事件循环
+    """
+    signum = getattr(signal, getattr(settings, 'PROFILING_CONFIG', {}).get('SIGNAL', 'SIGUSR1'), None)
+    if signum is None:
+        logger.warning("当前平台不支持剖析开关信号")
+        return
+
+    profiler.role = role
+
+    def handle_signal(signum, frame):
+        threading.Thread(target=profiler.toggle, name='profiler-toggle', daemon=True).start()
+
+    signal.signal(signum, handle_signal)
@@ -1,3 +1,148 @@
-from django.test import TestCase
+import math
+import threading
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase
+
+from . import events, metrics
+from .events import ChannelLayerEventBus, LocalEventBus
+
+
+class LocalEventBusTests(SimpleTestCase):
+    """进程内事件总线"""
+
+    def test_record_and_dispatch(self):
+        bus = LocalEventBus(record=True)
+        received = []
+        bus.subscribe(events.COMMAND_ACKED, lambda event_type, payload: received.append(payload))
+        bus.publish(events.COMMAND_ACKED, {'device_id': 'DEV-1'})
+        self.assertEqual(bus.published, [(events.COMMAND_ACKED, {'device_id': 'DEV-1'})])
+        self.assertEqual(received, [{'device_id': 'DEV-1'}])
+
+    def test_wants(self):
+        bus = LocalEventBus()
+        self.assertFalse(bus.wants(events.READING_INGESTED))
+        bus.subscribe(events.READING_INGESTED, lambda event_type, payload: None)
+        self.assertTrue(bus.wants(events.READING_INGESTED))
+        self.assertTrue(LocalEventBus(record=True).wants(events.DEVICE_STATUS_CHANGED))
+
+    def test_handler_error_does_not_stop_other_handlers(self):
+        bus = LocalEventBus()
+        received = []
+
+        def broken(event_type, payload):
+            raise RuntimeError('broken')
+
+        bus.subscribe(events.DEVICE_STATUS_CHANGED, broken)
+        bus.subscribe(events.DEVICE_STATUS_CHANGED, lambda event_type, payload: received.append(payload))
+        with self.assertLogs('core.events', 'ERROR'):
+            self.assertEqual(bus.dispatch(events.DEVICE_STATUS_CHANGED, {}), 2)
+        self.assertEqual(received, [{}])
+
+
+class ChannelLayerEventBusTests(SimpleTestCase):
+    """通道层事件总线"""
+
+    def receive(self, channel_layer, channel):
+        return async_to_sync(channel_layer.receive)(channel)
+
+    def test_publish_does_not_wait_for_channel_layer(self):
+        bus = ChannelLayerEventBus(group_prefix='test-events')
+        release = threading.Event()
+        sent = []
+
+        class SlowLayer:
+            async def group_send(self, group, message):
+                release.wait(5)
+                sent.append((group, message))
+
+        with mock.patch('channels.layers.get_channel_layer', return_value=SlowLayer()):
+            bus.publish(events.READING_INGESTED, {'device_ids': ['DEV-1']})
+            # 发送线程阻塞在group_send时，发布方仍立即返回
+            bus.publish(events.READING_INGESTED, {'device_ids': ['DEV-2']})
+            self.assertEqual(sent, [])
+            release.set()
+            bus.stop()
+
+        self.assertEqual([message['payload']['device_ids'] for _, message in sent], [['DEV-1'], ['DEV-2']])
+        self.assertEqual(sent[0][0], 'test-events.reading.ingested')
+
+    def test_flush_sends_to_group(self):
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)('test.')
+        bus = ChannelLayerEventBus(group_prefix='flush-events')
+        async_to_sync(channel_layer.group_add)(bus.group(events.COMMAND_ACKED), channel)
+
+        # 不启动发送线程，直接调用flush()
+        bus._sender = mock.Mock(is_alive=lambda: True)
+        bus.publish(events.COMMAND_ACKED, {'device_id': 'DEV-1'})
+        self.assertEqual(bus.flush(), 1)
+
+        message = self.receive(channel_layer, channel)
+        self.assertEqual((message['event'], message['payload']), (events.COMMAND_ACKED, {'device_id': 'DEV-1'}))
+
+    def test_publish_events_filter(self):
+        bus = ChannelLayerEventBus(event_types=[events.DEVICE_STATUS_CHANGED])
+        self.assertTrue(bus.wants(events.DEVICE_STATUS_CHANGED))
+        self.assertFalse(bus.wants(events.READING_INGESTED))
+        bus.publish(events.READING_INGESTED, {})
+        self.assertEqual(bus._pending, [])
+        self.assertIsNone(bus._sender)
+
+    def test_queue_limit(self):
+        bus = ChannelLayerEventBus(max_pending=1)
+        bus._sender = mock.Mock(is_alive=lambda: True)
+        bus.publish(events.COMMAND_ACKED, {'n': 1})
+        with self.assertLogs('core.events', 'WARNING'):
+            bus.publish(events.COMMAND_ACKED, {'n': 2})
+        self.assertEqual(bus._pending, [(events.COMMAND_ACKED, {'n': 1})])
+
+
+class MetricsFormatTests(SimpleTestCase):
+    """指标导出格式"""
+
+    def test_render_prometheus(self):
+        registry = metrics.MetricsRegistry()
+        registry.counter('frames_total', '接收的帧数', ['protocol']).inc(3, protocol='tcp')
+        histogram = registry.histogram('ingest_seconds', '写入耗时', buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 2.0):
+            histogram.observe(value)
+
+        output = metrics.render_prometheus([('ingest-1', registry.snapshot())])
+
+        self.assertEqual(output, (
+            '# HELP frames_total 接收的帧数\n'
+            '# TYPE frames_total counter\n'
+            'frames_total{process="ingest-1",protocol="tcp"} 3\n'
+            '# HELP ingest_seconds 写入耗时\n'
+            '# TYPE ingest_seconds histogram\n'
+            'ingest_seconds_bucket{process="ingest-1",le="0.1"} 1\n'
+            'ingest_seconds_bucket{process="ingest-1",le="1.0"} 3\n'
+            'ingest_seconds_bucket{process="ingest-1",le="+Inf"} 4\n'
+            'ingest_seconds_sum{process="ingest-1"} 3.05\n'
+            'ingest_seconds_count{process="ingest-1"} 4\n'
+        ))
+
+    def test_render_prometheus_merges_processes_and_escapes_labels(self):
+        registry = metrics.MetricsRegistry()
+        registry.gauge('queue_depth', '队列长度', ['queue']).set(2, queue='a"b')
+        snapshot = registry.snapshot()
+
+        output = metrics.render_prometheus([('tcp-1', snapshot), ('tcp-2', snapshot)])
+
+        self.assertEqual(output.splitlines()[2:], [
+            'queue_depth{process="tcp-1",queue="a\\"b"} 2',
+            'queue_depth{process="tcp-2",queue="a\\"b"} 2',
+        ])
+
+    def test_histogram_quantile(self):
+        buckets = (0.1, 1.0, 10.0)
+        counts = [5, 3, 1]
+        self.assertIsNone(metrics.histogram_quantile(buckets, [0, 0, 0], 0, 0.5))
+        self.assertEqual(metrics.histogram_quantile(buckets, counts, 10, 0.5), 0.1)
+        self.assertEqual(metrics.histogram_quantile(buckets, counts, 10, 0.8), 1.0)
+        self.assertEqual(metrics.histogram_quantile(buckets, counts, 10, 0.9), 10.0)
+        # 超出最大桶的样本
+        self.assertEqual(metrics.histogram_quantile(buckets, counts, 10, 0.99), math.inf)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Project, Device, Sensor, Actuator
+from .models import Project, Device, DeviceShadow, Sensor, SensorLatestValue, Actuator, RetentionPolicy
 
 
 class SensorInline(admin.TabularInline):
@@ -52,3 +52,27 @@ class ActuatorAdmin(admin.ModelAdmin):
     list_display = ('name', 'actuator_type', 'device', 'current_state')
     list_filter = ('device', 'actuator_type')
     search_fields = ('name',)
+
+
+@admin.register(RetentionPolicy)
+class RetentionPolicyAdmin(admin.ModelAdmin):
+    """数据保留策略管理界面"""
+    list_display = ('__str__', 'sensor_data_days', 'rollup_minute_days', 'rollup_hour_days',
+                    'rollup_day_days', 'actuator_data_days', 'actuator_command_days', 'updated_at')
+    raw_id_fields = ('project', 'sensor')
+
+
+@admin.register(SensorLatestValue)
+class SensorLatestValueAdmin(admin.ModelAdmin):
+    """传感器最新值管理界面（由数据接入维护，只读）"""
+    list_display = ('sensor', 'value', 'timestamp')
+    raw_id_fields = ('sensor',)
+    readonly_fields = ('sensor', 'sensor_data_id', 'timestamp', 'value_float', 'value_string', 'value_boolean')
+
+
+@admin.register(DeviceShadow)
+class DeviceShadowAdmin(admin.ModelAdmin):
+    """设备影子管理界面"""
+    list_display = ('device', 'version', 'reported_at', 'desired_at')
+    raw_id_fields = ('device',)
+    readonly_fields = ('version', 'reported_at', 'desired_at')
@@ -1,16 +1,20 @@
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import get_object_or_404
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authentication import SessionAuthentication
 
-import datetime
-
-from .models import Sensor, SensorData, Actuator
-from .serializers import SensorDataSerializer, SensorSerializer, ActuatorSerializer
+from core.pagination import KeysetCursorPagination
+from . import export, shadow, timeseries
+from .models import Project, Device, Sensor, SensorData, Actuator, ActuatorData, ActuatorCommand
+from .serializers import (
+    SensorDataSerializer, SensorSerializer, ActuatorSerializer, ActuatorDataSerializer, ActuatorCommandSerializer,
+)
 
 
 class SensorDataAPIView(APIView):
@@ -26,26 +30,21 @@ class SensorDataAPIView(APIView):
         return sensor
     
     def get(self, request, sensor_id, format=None):
-        """获取传感器数据"""
+        """
+        获取传感器数据
+        - 默认返回时间范围内的全部原始数据
+        - 指定agg（avg/min/max/last）或interval时，在数据库中按时间桶聚合并返回列式数据；
+          interval缺省或为auto时根据period和points（目标点数）自动选择
+        """
         sensor = self.get_sensor(sensor_id)
         
-        # 获取时间范围参数
-        period = request.query_params.get('period', '24h')  # 默认24小时
-        
-        # 解析时间范围
-        now = timezone.now()
-        if period == '1h':
-            start_time = now - datetime.timedelta(hours=1)
-        elif period == '12h':
-            start_time = now - datetime.timedelta(hours=12)
-        elif period == '24h':
-            start_time = now - datetime.timedelta(hours=24)
-        elif period == '7d':
-            start_time = now - datetime.timedelta(days=7)
-        elif period == '30d':
-            start_time = now - datetime.timedelta(days=30)
-        else:
-            start_time = now - datetime.timedelta(hours=24)  # 默认24小时
+        # 获取时间范围参数（默认24小时）
+        period, start_time, now = timeseries.time_range(request.query_params.get('period', '24h'))
+        
+        agg = request.query_params.get('agg')
+        interval_param = request.query_params.get('interval')
+        if agg or interval_param:
+            return self.get_downsampled(request, sensor, period, start_time, now, agg or 'avg', interval_param)
         
         # 查询数据
         sensor_data = SensorData.objects.filter(
@@ -64,6 +63,171 @@ class SensorDataAPIView(APIView):
             'start_time': start_time.isoformat(),
             'end_time': now.isoformat()
         })
+    
+    def get_downsampled(self, request, sensor, period, start_time, end_time, agg, interval_param):
+        """按时间桶聚合后的传感器数据"""
+        if agg not in timeseries.AGGREGATES:
+            return Response({'error': f"不支持的聚合方式: {agg}"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            if interval_param and interval_param != 'auto':
+                interval = timeseries.parse_interval(interval_param)
+                timeseries.check_interval(end_time - start_time, interval)
+            else:
+                points = int(request.query_params.get('points', timeseries.DEFAULT_POINTS))
+                interval = timeseries.auto_interval(end_time - start_time, points)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'sensor': SensorSerializer(sensor).data,
+            'buckets': timeseries.downsample(sensor, start_time, end_time, interval, agg),
+            'interval': interval,
+            'agg': agg,
+            'period': period,
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat()
+        })
+
+
+class SensorDataRecordsAPIView(SensorDataAPIView):
+    """传感器数据记录API视图（游标分页，按时间倒序）"""
+    
+    def get(self, request, sensor_id, format=None):
+        """
+        分页获取传感器数据记录
+        - cursor/direction: 上一次返回的next_cursor或previous_cursor，direction=previous表示向更新的数据翻页
+        - page_size: 每页条数
+        - count: 为1时返回总条数
+        """
+        sensor = self.get_sensor(sensor_id)
+        paginator = KeysetCursorPagination()
+        page = paginator.paginate_queryset(SensorData.objects.filter(sensor=sensor), request, view=self)
+        return paginator.get_paginated_response(SensorDataSerializer(page, many=True).data)
+
+
+class ActuatorRecordsAPIView(APIView):
+    """执行器数据/命令记录API视图（游标分页，按时间倒序）"""
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [SessionAuthentication]
+    
+    def get(self, request, actuator_id, format=None):
+        """
+        分页获取执行器记录，type=command时返回命令记录
+        分页参数与SensorDataRecordsAPIView相同
+        """
+        actuator = get_object_or_404(Actuator, id=actuator_id)
+        if actuator.device.project.owner != request.user:
+            raise Http404("执行器不存在或您没有权限访问")
+        
+        if request.query_params.get('type', 'data') == 'command':
+            queryset, serializer_class = ActuatorCommand.objects.filter(actuator=actuator), ActuatorCommandSerializer
+        else:
+            queryset, serializer_class = ActuatorData.objects.filter(actuator=actuator), ActuatorDataSerializer
+        
+        paginator = KeysetCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(serializer_class(page, many=True).data)
+
+
+class DeviceDataExportAPIView(APIView):
+    """设备传感器数据流式导出API视图"""
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [SessionAuthentication]
+    
+    def get_device(self, device_id):
+        """获取设备并验证权限"""
+        device = get_object_or_404(Device, device_id=device_id)
+        if device.project.owner != self.request.user:
+            raise Http404("设备不存在或您没有权限访问")
+        return device
+    
+    def parse_time(self, value):
+        """解析ISO格式时间，未带时区时按当前时区处理"""
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"无效的时间: {value}")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+    
+    def get(self, request, device_id):
+        """
+        导出设备传感器数据
+        - sensors: 逗号分隔的传感器ID，缺省导出设备的全部传感器
+        - start/end: ISO格式起止时间；未指定start时按period（默认24小时）计算
+        - file_format: csv（默认）或ndjson
+        - gzip: 为1时对输出进行gzip压缩
+        数据按(时间, 主键)分批从数据库读取并写出，内存占用与导出行数无关；WSGI和ASGI下都逐块发送
+        """
+        device = self.get_device(device_id)
+        sensors = {sensor.id: sensor for sensor in device.sensors.all()}
+        
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in export.EXPORT_FORMATS:
+            return Response({'error': f"不支持的导出格式: {file_format}"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        sensor_param = request.query_params.get('sensors')
+        if sensor_param:
+            try:
+                sensor_ids = {int(value) for value in sensor_param.split(',') if value.strip()}
+            except ValueError:
+                return Response({'error': f"无效的传感器ID: {sensor_param}"}, status=status.HTTP_400_BAD_REQUEST)
+            unknown = sensor_ids - sensors.keys()
+            if unknown:
+                return Response({'error': f"传感器不属于该设备: {', '.join(map(str, sorted(unknown)))}"},
+                                status=status.HTTP_400_BAD_REQUEST)
+        else:
+            sensor_ids = set(sensors)
+        
+        try:
+            if request.query_params.get('start'):
+                start_time = self.parse_time(request.query_params['start'])
+            else:
+                _, start_time, _ = timeseries.time_range(request.query_params.get('period', '24h'))
+            end_time = self.parse_time(request.query_params['end']) if request.query_params.get('end') else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        content_type, extension = export.EXPORT_FORMATS[file_format]
+        filename = f"{device.device_id}_{start_time.strftime('%Y%m%d%H%M%S')}.{extension}"
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        if compress:
+            content_type = 'application/gzip'
+            filename += '.gz'
+        
+        # ASGI下同步迭代器会被整体读入内存后才发送，需使用异步迭代器（每批数据通过sync_to_async查询）
+        writer = export.ExportWriter(file_format, sensors, compress)
+        if isinstance(request._request, ASGIRequest):
+            content = export.aiter_export(export.aiter_rows(sorted(sensor_ids), start_time, end_time), writer)
+        else:
+            content = export.iter_export(export.iter_rows(sorted(sensor_ids), start_time, end_time), writer)
+        
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class ProjectCurrentValuesAPIView(APIView):
+    """项目当前值API视图（仪表盘一次获取项目下全部设备的状态、传感器最新值和设备影子）"""
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [SessionAuthentication]
+    
+    def get(self, request, project_id, format=None):
+        """
+        获取项目下所有设备的当前值
+        - 传感器最新值来自SensorLatestValue，设备影子来自DeviceShadow，与设备一起用一次查询取出
+        - delta为期望状态中设备尚未回报一致的执行器键
+        """
+        project = get_object_or_404(Project, project_id=project_id)
+        if project.owner_id != request.user.pk:
+            raise Http404("项目不存在或您没有权限访问")
+        
+        return Response({
+            'project_id': project.project_id,
+            'devices': shadow.project_current_values(project),
+            'timestamp': timezone.now().isoformat(),
+        })
 
 
 class ActuatorDetailAPIView(APIView):
@@ -5,3 +5,11 @@ class IotDevicesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'iot_devices'
     verbose_name = '物联网设备'
+    
+    def ready(self):
+        """
+        应用就绪时导入信号模块
+        不在这里启动后台线程：Web、管理命令和测试进程都会执行ready()，
+        数据保留清理由apply_retention命令或run_mqtt_ingest的领导者进程执行
+        """
+        import iot_devices.signals
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from .models import Device, Sensor
+
+logger = logging.getLogger(__name__)
+
+
+# 传感器元数据：数据接入只需要这些字段
+SensorMeta = namedtuple('SensorMeta', ['id', 'name', 'value_key', 'sensor_type', 'unit'])
+
+# 设备元数据：设备主键 + 传感器列表
+DeviceMeta = namedtuple('DeviceMeta', ['pk', 'device_id', 'sensors'])
+
+
+class DeviceMetadataCache:
+    """
+    进程内设备元数据缓存
+
+    按device_id缓存设备主键和传感器列表，供MQTT/TCP数据接入路径使用，
+    避免每条消息都查询Device和Sensor表。
+    - 使用LRU淘汰，条目数不超过max_entries
+    - 每个条目在ttl秒后过期（用于兜底其他进程中的修改）
+    - 未知设备只缓存missing_ttl秒：避免无效设备反复查库，其他进程新建的设备也能很快接入
+    - 本进程内Device/Sensor的保存和删除会通过信号立即失效对应条目
+    - 加载在锁外进行，期间发生过失效时不写回加载结果（失效计数器），避免把失效前读到的旧数据缓存下来
+    """
+
+    # 未知设备缓存的值
+    MISSING = None
+
+    def __init__(self, max_entries=10000, ttl=300, missing_ttl=5):
+        """初始化缓存"""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self._entries = OrderedDict()  # device_id -> (DeviceMeta或None, 过期时间)
+        self._pk_index = {}            # 设备主键 -> device_id，用于按主键失效
+        self._generation = 0           # 每次失效递增
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        """根据settings.DEVICE_METADATA_CACHE创建缓存"""
+        config = getattr(settings, 'DEVICE_METADATA_CACHE', {})
+        return cls(
+            max_entries=config.get('MAX_ENTRIES', 10000),
+            ttl=config.get('TTL', 300),
+            missing_ttl=config.get('MISSING_TTL', 5),
+        )
+
+    def get(self, device_id):
+        """
+        获取设备元数据
+        :return: DeviceMeta，设备不存在时返回None
+        """
+        return self.get_many([device_id]).get(device_id)
+
+    def get_many(self, device_ids):
+        """
+        批量获取设备元数据，未命中的设备用两次查询一起加载
+        :return: {device_id: DeviceMeta}，不存在的设备不在结果中
+        """
+        result = {}
+        missing = []
+        now = time.monotonic()
+
+        with self._lock:
+            generation = self._generation
+            for device_id in set(device_ids):
+                entry = self._entries.get(device_id)
+                if entry is None or entry[1] <= now:
+                    missing.append(device_id)
+                    continue
+                self._entries.move_to_end(device_id)
+                if entry[0] is not None:
+                    result[device_id] = entry[0]
+
+        if missing:
+            loaded = self._load(missing)
+            with self._lock:
+                # 加载期间有失效时本次结果照常返回，但不写入缓存
+                store = generation == self._generation
+                now = time.monotonic()
+                for device_id in missing:
+                    meta = loaded.get(device_id, self.MISSING)
+                    if store and (meta is not None or self.missing_ttl > 0):
+                        self._store(device_id, meta, now + (self.ttl if meta is not None else self.missing_ttl))
+                    if meta is not None:
+                        result[device_id] = meta
+
+        return result
+
+    def _load(self, device_ids):
+        """从数据库加载设备及其传感器"""
+        devices = dict(Device.objects.filter(device_id__in=device_ids).values_list('id', 'device_id'))
+
+        sensors = {pk: [] for pk in devices}
+        sensor_rows = Sensor.objects.filter(device_id__in=devices.keys()).values_list(
+            'device_id', 'id', 'name', 'value_key', 'sensor_type', 'unit'
+        )
+        for device_pk, *fields in sensor_rows:
+            sensors[device_pk].append(SensorMeta(*fields))
+
+        return {
+            device_id: DeviceMeta(pk, device_id, tuple(sensors[pk]))
+            for pk, device_id in devices.items()
+        }
+
+    def _store(self, device_id, meta, expires_at):
+        """写入条目并执行LRU淘汰（调用方需持有锁）"""
+        self._entries[device_id] = (meta, expires_at)
+        self._entries.move_to_end(device_id)
+        if meta is not None:
+            self._pk_index[meta.pk] = device_id
+
+        while len(self._entries) > self.max_entries:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            if evicted is not None:
+                self._pk_index.pop(evicted.pk, None)
+
+    def invalidate(self, device_id=None, device_pk=None):
+        """按device_id或设备主键失效缓存条目"""
+        with self._lock:
+            self._generation += 1
+            if device_pk is not None:
+                cached_device_id = self._pk_index.pop(device_pk, None)
+                if cached_device_id is not None:
+                    self._entries.pop(cached_device_id, None)
+            if device_id is not None:
+                entry = self._entries.pop(device_id, None)
+                if entry is not None and entry[0] is not None:
+                    self._pk_index.pop(entry[0].pk, None)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._pk_index.clear()
+
+
+# 进程级缓存实例
+device_metadata_cache = DeviceMetadataCache.from_settings()
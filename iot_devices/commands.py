@@ -0,0 +1,75 @@
+import logging
+
+from django.utils import timezone
+
+from core import codec, events
+
+from . import shadow
+from .cache import device_metadata_cache
+from .models import Actuator, ActuatorCommand
+
+logger = logging.getLogger(__name__)
+
+
+def is_command_response(message):
+    """设备通过数据通道发送的消息是否为命令响应（见docs/mqtt_api.md“命令响应”）"""
+    return isinstance(message, dict) and 'response' in message
+
+
+def acknowledge_command(device_id, response):
+    """
+    处理设备的命令响应
+
+    设备在响应的data中按执行器的command_key回报执行后的状态，
+    对应执行器最近一条尚未收到响应的命令记录会更新为成功或失败，执行器的当前状态同步为回报值；
+    无论是否匹配到命令记录，都会发布COMMAND_ACKED事件。
+    :param device_id: 设备ID
+    :param response: 响应消息（response、command、success、data）
+    :return: 更新的命令记录数
+    """
+    device = device_metadata_cache.get(device_id)
+    if device is None:
+        logger.warning(f"未知设备ID: {device_id}")
+        return 0
+
+    success = bool(response.get('success', True))
+    data = response.get('data')
+    if not isinstance(data, dict):
+        data = {}
+    now = timezone.now()
+    message = codec.dumps(response).decode('utf-8', errors='replace')[:1000]
+
+    acked = []
+    actuators = Actuator.objects.filter(device_id=device.pk, command_key__in=list(data)) if data else []
+    for actuator in actuators:
+        command = ActuatorCommand.objects.filter(
+            actuator=actuator, response_time__isnull=True, status__in=('pending', 'success')
+        ).order_by('-timestamp').first()
+        if command is not None:
+            command.status = 'success' if success else 'failed'
+            command.response_time = now
+            command.response_message = message
+            command.save(update_fields=['status', 'response_time', 'response_message'])
+            acked.append(command)
+
+        if success:
+            actuator.current_state = str(data[actuator.command_key])[:20]
+            actuator.save(update_fields=['current_state'])
+
+    # 设备影子记录设备回报的全部状态
+    if success and data:
+        shadow.set_reported(device.pk, data)
+
+    logger.info(f"设备 {device_id} 响应命令 {response.get('command')}: {response.get('response')}，"
+                f"更新 {len(acked)} 条命令记录")
+
+    events.publish(events.COMMAND_ACKED, {
+        'device_id': device_id,
+        'command': response.get('command'),
+        'response': response.get('response'),
+        'success': success,
+        'command_ids': [command.pk for command in acked],
+        'actuator_ids': [command.actuator_id for command in acked],
+        'timestamp': now.isoformat(),
+    })
+    return len(acked)
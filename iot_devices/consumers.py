@@ -0,0 +1,110 @@
+import logging
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+
+from .models import Device, Sensor
+from .realtime import sensor_group
+
+logger = logging.getLogger(__name__)
+
+
+class SensorStreamConsumer(AsyncJsonWebsocketConsumer):
+    """
+    传感器实时数据WebSocket消费者
+
+    已登录用户连接后发送订阅消息，按传感器或设备（设备下的全部传感器）订阅：
+        {"action": "subscribe", "sensor_id": 12}
+        {"action": "subscribe", "device_id": "DEV-001"}
+        {"action": "unsubscribe", "sensor_id": 12}
+    之后每个tick收到每个传感器一条合并后的最新读数：
+        {"type": "reading", "sensor_id": 12, "timestamp": "...", "value": 23.5, "count": 4}
+    """
+
+    async def connect(self):
+        """只接受已登录用户的连接"""
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+
+        self.sensor_ids = set()
+        self.max_subscriptions = getattr(settings, 'REALTIME_CONFIG', {}).get('MAX_SUBSCRIPTIONS', 100)
+        await self.accept()
+
+    async def disconnect(self, code):
+        for sensor_id in getattr(self, 'sensor_ids', ()):
+            await self.channel_layer.group_discard(sensor_group(sensor_id), self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        """处理订阅和取消订阅"""
+        action = content.get('action')
+        if action not in ('subscribe', 'unsubscribe'):
+            await self.send_error('unknown_action', f"未知的操作: {action}")
+            return
+
+        if 'sensor_id' in content:
+            sensor_ids = await self.get_sensor_ids(sensor_id=content['sensor_id'])
+        elif 'device_id' in content:
+            sensor_ids = await self.get_sensor_ids(device_id=content['device_id'])
+        else:
+            await self.send_error('invalid_request', "缺少sensor_id或device_id")
+            return
+
+        if sensor_ids is None:
+            await self.send_error('not_found', "传感器或设备不存在或您没有权限访问")
+            return
+
+        if action == 'subscribe':
+            new_ids = [sensor_id for sensor_id in sensor_ids if sensor_id not in self.sensor_ids]
+            if len(self.sensor_ids) + len(new_ids) > self.max_subscriptions:
+                await self.send_error('too_many_subscriptions', f"每个连接最多订阅 {self.max_subscriptions} 个传感器")
+                return
+            for sensor_id in new_ids:
+                await self.channel_layer.group_add(sensor_group(sensor_id), self.channel_name)
+            self.sensor_ids.update(new_ids)
+        else:
+            for sensor_id in sensor_ids:
+                if sensor_id in self.sensor_ids:
+                    await self.channel_layer.group_discard(sensor_group(sensor_id), self.channel_name)
+                    self.sensor_ids.discard(sensor_id)
+
+        await self.send_json({'type': f'{action}d', 'sensor_ids': sorted(sensor_ids)})
+
+    @database_sync_to_async
+    def get_sensor_ids(self, sensor_id=None, device_id=None):
+        """
+        获取用户有权访问的传感器ID（与传感器数据API相同，只允许项目所有者）
+        :return: 传感器ID列表，不存在或无权访问时返回None
+        """
+        user = self.scope['user']
+        if sensor_id is not None:
+            try:
+                sensor = Sensor.objects.select_related('device__project').get(pk=int(sensor_id))
+            except (Sensor.DoesNotExist, TypeError, ValueError):
+                return None
+            if sensor.device.project.owner_id != user.pk:
+                return None
+            return [sensor.pk]
+
+        try:
+            device = Device.objects.select_related('project').get(device_id=str(device_id))
+        except Device.DoesNotExist:
+            return None
+        if device.project.owner_id != user.pk:
+            return None
+        return list(device.sensors.values_list('pk', flat=True))
+
+    async def sensor_reading(self, event):
+        """转发发布器合并后的读数"""
+        await self.send_json({
+            'type': 'reading',
+            'sensor_id': event['sensor_id'],
+            'timestamp': event['timestamp'],
+            'value': event['value'],
+            'count': event['count'],
+        })
+
+    async def send_error(self, code, message):
+        await self.send_json({'type': 'error', 'error_code': code, 'message': message})
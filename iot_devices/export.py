@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+
+from .models import SensorData
+from .timeseries import sensor_value
+
+
+# 支持的导出格式 -> (Content-Type, 文件扩展名)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+# 每次从数据库读取的行数
+ITERATOR_CHUNK_SIZE = 2000
+
+# 累积到该字节数后再向客户端输出一块，减少小块写入的开销
+FLUSH_BYTES = 64 * 1024
+
+CSV_HEADER = ('timestamp', 'sensor_id', 'sensor', 'value_key', 'value', 'unit')
+
+
+def fetch_batch(sensor_ids, start_time=None, end_time=None, after=None):
+    """
+    按(时间, 主键)顺序读取一批（ITERATOR_CHUNK_SIZE行）数据，每批是一次独立的查询，不需要在批次之间保持数据库游标
+    :param after: 上一批最后一行的(时间, 主键)，为空时从头读取
+    :return: [(主键, sensor_id, timestamp, value), ...]
+    """
+    queryset = SensorData.objects.filter(sensor_id__in=sensor_ids)
+    if start_time is not None:
+        queryset = queryset.filter(timestamp__gte=start_time)
+    if end_time is not None:
+        queryset = queryset.filter(timestamp__lt=end_time)
+    if after is not None:
+        timestamp, pk = after
+        queryset = queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, pk__gt=pk))
+
+    rows = queryset.order_by('timestamp', 'id').values_list(
+        'id', 'sensor_id', 'timestamp', 'value_float', 'value_string', 'value_boolean'
+    )[:ITERATOR_CHUNK_SIZE]
+    return [
+        (pk, sensor_id, timestamp, sensor_value(value_float, value_string, value_boolean))
+        for pk, sensor_id, timestamp, value_float, value_string, value_boolean in rows
+    ]
+
+
+def iter_rows(sensor_ids, start_time=None, end_time=None):
+    """
+    按时间顺序逐行读取多个传感器的数据，内存占用与总行数无关（WSGI使用）
+    :return: (sensor_id, timestamp, value)迭代器
+    """
+    after = None
+    while True:
+        batch = fetch_batch(sensor_ids, start_time, end_time, after)
+        for _, sensor_id, timestamp, value in batch:
+            yield sensor_id, timestamp, value
+        if len(batch) < ITERATOR_CHUNK_SIZE:
+            return
+        after = (batch[-1][2], batch[-1][0])
+
+
+async def aiter_rows(sensor_ids, start_time=None, end_time=None):
+    """
+    iter_rows的异步版本（ASGI使用）：每批通过sync_to_async查询，事件循环不会被数据库查询阻塞，
+    响应也不会像同步迭代器那样在ASGI下被整体读入内存后才发送
+    """
+    fetch = sync_to_async(fetch_batch)
+    after = None
+    while True:
+        batch = await fetch(sensor_ids, start_time, end_time, after)
+        for _, sensor_id, timestamp, value in batch:
+            yield sensor_id, timestamp, value
+        if len(batch) < ITERATOR_CHUNK_SIZE:
+            return
+        after = (batch[-1][2], batch[-1][0])
+
+
+class ExportWriter:
+    """
+    把逐行数据格式化为CSV或NDJSON，累积到FLUSH_BYTES后编码为UTF-8输出一块，可选gzip压缩
+    同步和异步导出共用，write()返回需要输出的块（没有时为空bytes）
+    """
+
+    def __init__(self, file_format, sensors, compress=False):
+        """
+        :param sensors: {sensor_id: Sensor}
+        """
+        self.file_format = file_format
+        self.sensors = sensors
+        self.buffer = io.StringIO()
+        self.csv_writer = csv.writer(self.buffer)
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16) if compress else None
+
+        if file_format == 'csv':
+            # UTF-8 BOM，保证Excel能正确识别中文
+            self.buffer.write('\ufeff')
+            self.csv_writer.writerow(CSV_HEADER)
+
+    def write(self, sensor_id, timestamp, value):
+        sensor = self.sensors[sensor_id]
+        if self.file_format == 'csv':
+            self.csv_writer.writerow(
+                (timestamp.isoformat(), sensor_id, sensor.name, sensor.value_key, value, sensor.unit or '')
+            )
+        else:
+            self.buffer.write(json.dumps({
+                'timestamp': timestamp.isoformat(),
+                'sensor_id': sensor_id,
+                'sensor': sensor.name,
+                'value_key': sensor.value_key,
+                'value': value,
+                'unit': sensor.unit,
+            }, ensure_ascii=False) + '\n')
+
+        if self.buffer.tell() >= FLUSH_BYTES:
+            return self._flush()
+        return b''
+
+    def close(self):
+        """输出剩余内容（包括gzip尾部）"""
+        chunk = self._flush()
+        if self.compressor is not None:
+            chunk += self.compressor.flush()
+        return chunk
+
+    def _flush(self):
+        chunk = self.buffer.getvalue().encode('utf-8')
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        if self.compressor is not None:
+            chunk = self.compressor.compress(chunk)
+        return chunk
+
+
+def iter_export(rows, writer):
+    """生成导出内容块（同步）"""
+    for row in rows:
+        chunk = writer.write(*row)
+        if chunk:
+            yield chunk
+    yield writer.close()
+
+
+async def aiter_export(rows, writer):
+    """生成导出内容块（异步），rows为aiter_rows返回的异步迭代器"""
+    async for row in rows:
+        chunk = writer.write(*row)
+        if chunk:
+            yield chunk
+    yield writer.close()
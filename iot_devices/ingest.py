@@ -0,0 +1,136 @@
+"""
+与协议无关的传感器数据写入路径（MQTT和TCP数据接入共用）
+
+一批读数在一个事务中写入SensorData，同时增量更新汇总表、传感器最新值和设备状态；
+事务提交后失效最新值缓存、推送实时数据并发布READING_INGESTED事件。
+"""
+import logging
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from core import events
+from core.metrics import READINGS_WRITTEN, STAGE_LATENCY
+from core.profiling import profiled, span
+
+from .cache import device_metadata_cache
+from .models import Device, SensorData
+from .realtime import reading_value, realtime_publisher
+from .rollups import record_readings
+from .shadow import update_latest_values
+from .view_cache import invalidate_latest_values
+
+logger = logging.getLogger(__name__)
+
+
+# 队列中的一条待写入读数：设备号 + 已解码的消息体
+PendingReading = namedtuple('PendingReading', ['device_id', 'data', 'received_at'])
+
+
+def build_sensor_data(sensor_id, sensor_value):
+    """根据值的类型构造SensorData实例（不保存）"""
+    sensor_data = SensorData(sensor_id=sensor_id)
+
+    # bool是int的子类，必须先判断
+    if isinstance(sensor_value, bool):
+        sensor_data.value_boolean = sensor_value
+    elif isinstance(sensor_value, (int, float)):
+        sensor_data.value_float = float(sensor_value)
+    else:
+        sensor_data.value_string = str(sensor_value)
+
+    return sensor_data
+
+
+def write_readings(batch):
+    """
+    在一个事务中写入一批读数
+    :param batch: PendingReading列表
+    :return: (创建的SensorData列表, 更新的设备数, 是否已触发post_save信号)
+    """
+    # 设备和传感器元数据来自进程内缓存，未命中的设备一起加载
+    with STAGE_LATENCY.time(stage='lookup'), span('ingest.lookup'):
+        devices = device_metadata_cache.get_many(item.device_id for item in batch)
+
+    records = []
+    seen_devices = {}
+    for item in batch:
+        device = devices.get(item.device_id)
+        if device is None:
+            logger.warning(f"未知设备ID: {item.device_id}")
+            continue
+
+        seen_devices[device.pk] = device
+        for sensor in device.sensors:
+            if sensor.value_key in item.data:
+                records.append(build_sensor_data(sensor.id, item.data[sensor.value_key]))
+
+    with STAGE_LATENCY.time(stage='write'), span('ingest.write'), transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            created = SensorData.objects.bulk_create(records)
+            signals_sent = False
+        else:
+            # 数据库不支持批量插入返回主键时逐条保存，保证信号接收者能拿到主键
+            for sensor_data in records:
+                sensor_data.save()
+            created = records
+            signals_sent = True
+
+        # 增量更新汇总表和传感器最新值
+        record_readings(created)
+        update_latest_values(created)
+
+        # 合并本批所有设备的状态更新
+        if seen_devices:
+            Device.objects.filter(pk__in=seen_devices).update(status='online', last_seen=timezone.now())
+
+    READINGS_WRITTEN.inc(len(created))
+
+    # 失效页面使用的传感器最新值缓存（每批一次delete_many）
+    invalidate_latest_values(created)
+
+    # 事务已提交，推送给订阅了这些传感器的浏览器（按tick合并）
+    realtime_publisher.publish(created)
+
+    # 通知其他进程本批数据已写入
+    if created and events.wants(events.READING_INGESTED):
+        events.publish(events.READING_INGESTED, reading_event(created, seen_devices.values()))
+    return created, len(seen_devices), signals_sent
+
+
+def reading_event(created, devices):
+    """
+    构造READING_INGESTED事件内容
+    :param created: 已写入的SensorData列表
+    :param devices: 本批涉及的DeviceMeta
+    """
+    sensor_devices = {sensor.id: device.device_id for device in devices for sensor in device.sensors}
+    return {
+        'device_ids': sorted({sensor_devices[sensor_data.sensor_id] for sensor_data in created}),
+        'readings': [
+            {
+                'id': sensor_data.pk,
+                'sensor_id': sensor_data.sensor_id,
+                'device_id': sensor_devices[sensor_data.sensor_id],
+                'timestamp': sensor_data.timestamp.isoformat(),
+                'value': reading_value(sensor_data),
+            }
+            for sensor_data in created
+        ],
+    }
+
+
+@profiled('ingest.post_save_signals')
+def send_post_save_signals(created):
+    """
+    bulk_create不会触发post_save，在事务提交后补发信号，
+    保证策略引擎等接收者的行为与逐条保存时一致
+    """
+    for sensor_data in created:
+        try:
+            post_save.send(sender=SensorData, instance=sensor_data, created=True,
+                           update_fields=None, raw=False, using=sensor_data._state.db)
+        except Exception as e:
+            logger.error(f"处理传感器数据保存信号时出错: {str(e)}")
@@ -0,0 +1,430 @@
+"""
+设备接入压测
+
+用asyncio在一个进程内模拟成千上万台设备，通过TCP（run_tcp_server.py）或MQTT（本地Broker）
+按指定频率上报数据，统计：
+- 接入吞吐量：每秒发送和被确认的消息数
+- 确认延迟：TCP为data_received确认，MQTT为QoS 1的PUBACK，输出p50/p90/p99/最大值
+- 数据库写入：每秒新增的SensorData行数
+由manage.py load_test调用。
+"""
+import asyncio
+import math
+import random
+import string
+import time
+import uuid
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Max
+
+from core import codec
+from mqtt_client import packets
+from tcp_server.framing import FRAMERS, DelimiterFramer
+
+from .models import Device, Sensor, SensorData
+
+
+# 一台模拟设备：设备号、密钥和上报的值键名
+LoadDevice = namedtuple('LoadDevice', ['device_id', 'device_key', 'fields'])
+
+PAYLOAD_SHAPES = ('numeric', 'mixed')
+
+# 压测创建的设备号前缀
+DEVICE_ID_PREFIX = 'LT-'
+
+
+def percentile(sorted_values, p):
+    """已排序数据的p分位数（最近秩法）"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def prepare_devices(project, count, fields, create=False):
+    """
+    选取项目中的前count台设备作为模拟设备，不足时按需创建（设备号以LT-开头）
+    :return: (LoadDevice列表, 新创建的设备主键列表)
+    """
+    devices = list(project.devices.order_by('id').prefetch_related('sensors')[:count])
+    created_ids = []
+
+    if len(devices) < count and create:
+        batch = uuid.uuid4().hex[:6]
+        new_devices = [
+            Device(
+                device_id=f"{DEVICE_ID_PREFIX}{batch}-{i:06d}",
+                device_identifier=f"loadtest-{batch}-{i}",
+                device_key=uuid.uuid4().hex,
+                name=f"压测设备 {i}",
+                project=project,
+                protocol_type='tcp',
+            )
+            for i in range(count - len(devices))
+        ]
+        # bulk_create不调用save()，设备密钥在上面直接生成
+        Device.objects.bulk_create(new_devices)
+        new_devices = Device.objects.filter(device_id__startswith=f"{DEVICE_ID_PREFIX}{batch}-").order_by('id')
+        Sensor.objects.bulk_create([
+            Sensor(device=device, name=field, sensor_type=field, value_key=field)
+            for device in new_devices for field in fields
+        ])
+        new_devices = list(new_devices.prefetch_related('sensors'))
+        created_ids = [device.pk for device in new_devices]
+        devices += new_devices
+
+    return [
+        LoadDevice(device.device_id, device.device_key,
+                   [sensor.value_key for sensor in device.sensors.all()] or list(fields))
+        for device in devices
+    ], created_ids
+
+
+class PayloadFactory:
+    """
+    生成上报消息
+    - numeric: 每个值键名一个浮点数
+    - mixed: 浮点数、布尔值和短字符串轮流出现
+    - padding_bytes: 额外附加一个指定长度的字符串字段，用于测试大消息
+    """
+
+    def __init__(self, shape='numeric', padding_bytes=0):
+        if shape not in PAYLOAD_SHAPES:
+            raise ValueError(f"不支持的消息格式: {shape}")
+        self.shape = shape
+        self.padding = ''.join(random.choices(string.ascii_letters, k=padding_bytes)) if padding_bytes else None
+
+    def build(self, device, seq):
+        message = {'type': 'data', 'seq': seq, 'timestamp': int(time.time())}
+        for index, field in enumerate(device.fields):
+            if self.shape == 'mixed' and index % 3 == 1:
+                message[field] = random.random() < 0.5
+            elif self.shape == 'mixed' and index % 3 == 2:
+                message[field] = random.choice(('normal', 'warning', 'error'))
+            else:
+                message[field] = round(random.uniform(0, 100), 2)
+        if self.padding:
+            message['padding'] = self.padding
+        return message
+
+
+class LoadStats:
+    """压测计数器（只在事件循环线程中修改，无需加锁）"""
+
+    def __init__(self):
+        self.connected = 0
+        self.connect_failures = 0
+        self.disconnects = 0
+        self.sent = 0
+        self.acked = 0
+        self.errors = 0
+        self.latencies = []          # 全部确认延迟（秒）
+        self._interval_start = 0     # 本统计周期在latencies中的起始位置
+
+    def record_ack(self, sent_at):
+        self.acked += 1
+        self.latencies.append(time.perf_counter() - sent_at)
+
+    def interval_latencies(self):
+        """取出本统计周期的延迟（已排序）"""
+        values = sorted(self.latencies[self._interval_start:])
+        self._interval_start = len(self.latencies)
+        return values
+
+
+class BaseLoadClient:
+    """单台模拟设备：连接后按rate条/秒发送消息，同时接收确认"""
+
+    def __init__(self, device, host, port, rate, payloads, stats):
+        self.device = device
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.payloads = payloads
+        self.stats = stats
+        self.outstanding = {}   # 序号 -> 发送时间
+
+    async def run(self, start_delay, stop_at):
+        """在start_delay秒后连接，运行到stop_at（time.perf_counter()）"""
+        await asyncio.sleep(start_delay)
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            await self.handshake(reader, writer)
+        except (OSError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            self.stats.connect_failures += 1
+            return
+
+        self.stats.connected += 1
+        receiver = asyncio.create_task(self.receive(reader))
+        try:
+            await self.send_loop(writer, stop_at)
+            # 等待最后发出的消息被确认
+            deadline = time.perf_counter() + 5
+            while self.outstanding and not receiver.done() and time.perf_counter() < deadline:
+                await asyncio.sleep(0.05)
+        except (OSError, ConnectionError):
+            self.stats.disconnects += 1
+        finally:
+            receiver.cancel()
+            self.stats.connected -= 1
+            await self.close(writer)
+
+    async def send_loop(self, writer, stop_at):
+        interval = 1 / self.rate
+        # 随机错开第一条消息，避免所有设备同时发送
+        next_send = time.perf_counter() + random.uniform(0, interval)
+        seq = 0
+        while next_send < stop_at:
+            await asyncio.sleep(max(0, next_send - time.perf_counter()))
+            seq += 1
+            await self.send_message(writer, seq, self.payloads.build(self.device, seq))
+            self.stats.sent += 1
+            next_send += interval
+
+    async def close(self, writer):
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (OSError, ConnectionError):
+            pass
+
+    async def handshake(self, reader, writer):
+        raise NotImplementedError
+
+    async def send_message(self, writer, seq, message):
+        raise NotImplementedError
+
+    async def receive(self, reader):
+        raise NotImplementedError
+
+
+class TCPLoadClient(BaseLoadClient):
+    """TCP模拟设备（协议见docs/tcp_api.md）"""
+
+    def __init__(self, *args, ack_mode='each', framing='newline', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ack_mode = ack_mode
+        self.framing = framing
+        self.framer = DelimiterFramer()
+
+    async def handshake(self, reader, writer):
+        writer.write(self.framer.encode(codec.dumps({
+            'device_id': self.device.device_id,
+            'device_key': self.device.device_key,
+            'framing': self.framing,
+            'ack': self.ack_mode,
+            'timestamp': int(time.time()),
+        })))
+        await writer.drain()
+
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                raise ConnectionError("认证时连接被关闭")
+            self.framer.feed(data)
+            for frame in self.framer.frames():
+                response = codec.loads(frame)
+                if response.get('type') != 'auth_success':
+                    raise ConnectionError(f"认证失败: {response.get('message')}")
+                framer_class = FRAMERS.get(response.get('framing'), DelimiterFramer)
+                if not isinstance(self.framer, framer_class):
+                    framer = framer_class()
+                    framer.feed(self.framer.remaining())
+                    self.framer = framer
+                return
+
+    async def send_message(self, writer, seq, message):
+        self.outstanding[seq] = time.perf_counter()
+        writer.write(self.framer.encode(codec.dumps(message)))
+        await writer.drain()
+
+    async def receive(self, reader):
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            self.framer.feed(data)
+            for frame in self.framer.frames():
+                self.handle_response(codec.loads(frame))
+
+    def handle_response(self, response):
+        if response.get('type') == 'data_received':
+            seqs = response['seqs'] if 'seqs' in response else [response.get('seq')]
+        elif response.get('type') == 'error' and ('seq' in response or 'seqs' in response):
+            seqs = response.get('seqs') or [response['seq']]
+            self.stats.errors += len(seqs)
+            for seq in seqs:
+                self.outstanding.pop(seq, None)
+            return
+        else:
+            return
+
+        for seq in seqs:
+            sent_at = self.outstanding.pop(seq, None)
+            if sent_at is not None:
+                self.stats.record_ack(sent_at)
+
+
+class MQTTLoadClient(BaseLoadClient):
+    """MQTT模拟设备：QoS 1时以PUBACK作为确认"""
+
+    def __init__(self, *args, qos=1, topic=None, keepalive=60, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.qos = qos
+        self.topic = topic
+        self.keepalive = keepalive
+
+    async def handshake(self, reader, writer):
+        writer.write(packets.encode_connect(
+            f"loadtest_{self.device.device_id}_{uuid.uuid4().hex[:6]}",
+            username=self.device.device_id,
+            password=self.device.device_key,
+            keepalive=self.keepalive,
+        ))
+        await writer.drain()
+
+        packet_type, _, body = await packets.read_packet(reader)
+        if packet_type != packets.CONNACK:
+            raise ConnectionError(f"期望CONNACK，收到报文类型 {packet_type}")
+        _, return_code = packets.parse_connack(body)
+        if return_code != packets.CONNACK_ACCEPTED:
+            raise ConnectionError(f"MQTT连接被拒绝，返回码 {return_code}")
+
+    async def send_message(self, writer, seq, message):
+        packet_id = None
+        if self.qos:
+            # 报文标识符取值1~65535
+            packet_id = (seq - 1) % 65535 + 1
+            self.outstanding[packet_id] = time.perf_counter()
+        writer.write(packets.encode_publish(self.topic, codec.dumps(message), self.qos, packet_id))
+        await writer.drain()
+        if not self.qos:
+            self.stats.acked += 1
+
+    async def receive(self, reader):
+        while True:
+            try:
+                packet_type, _, body = await packets.read_packet(reader)
+            except asyncio.IncompleteReadError:
+                return
+            if packet_type == packets.PUBACK:
+                sent_at = self.outstanding.pop(packets.parse_packet_id(body), None)
+                if sent_at is not None:
+                    self.stats.record_ack(sent_at)
+
+
+class LoadTest:
+    """
+    压测运行器
+
+    在ramp秒内逐步建立全部连接，每台设备按rate条/秒发送消息，持续duration秒；
+    每interval秒输出一次吞吐量、确认延迟和数据库写入速度，结束后返回汇总结果。
+    """
+
+    def __init__(self, devices, transport, host, port, rate=1.0, duration=60, ramp=10,
+                 payloads=None, interval=5, client_options=None, write=print):
+        if transport not in ('tcp', 'mqtt'):
+            raise ValueError(f"不支持的传输协议: {transport}")
+        self.devices = devices
+        self.transport = transport
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.duration = duration
+        self.ramp = ramp
+        self.payloads = payloads or PayloadFactory()
+        self.interval = interval
+        self.client_options = client_options or {}
+        self.write = write
+        self.stats = LoadStats()
+
+    def make_client(self, device):
+        if self.transport == 'tcp':
+            client_class = TCPLoadClient
+            options = dict(self.client_options)
+        else:
+            client_class = MQTTLoadClient
+            mqtt_config = settings.MQTT_CONFIG
+            topic_template = mqtt_config.get('DEVICE_DATA_TOPIC', 'devices/{device_id}/data')
+            options = dict(self.client_options)
+            options['topic'] = f"{mqtt_config.get('TOPIC_PREFIX', '')}{topic_template.format(device_id=device.device_id)}"
+        return client_class(device, self.host, self.port, self.rate, self.payloads, self.stats, **options)
+
+    @sync_to_async
+    def max_row_id(self):
+        return SensorData.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+
+    @sync_to_async
+    def rows_since(self, baseline):
+        return SensorData.objects.filter(id__gt=baseline).count()
+
+    async def run(self):
+        """运行压测并返回汇总结果"""
+        baseline = await self.max_row_id()
+        started = time.perf_counter()
+        stop_at = started + self.ramp + self.duration
+
+        count = len(self.devices)
+        tasks = [
+            asyncio.create_task(self.make_client(device).run(self.ramp * index / count, stop_at))
+            for index, device in enumerate(self.devices)
+        ]
+        reporter = asyncio.create_task(self.report(started, baseline))
+
+        await asyncio.gather(*tasks)
+        reporter.cancel()
+
+        # 等待服务端写完批次中剩余的数据
+        await asyncio.sleep(1)
+        elapsed = time.perf_counter() - started
+        rows = await self.rows_since(baseline)
+
+        latencies = sorted(self.stats.latencies)
+        return {
+            'devices': count,
+            'connect_failures': self.stats.connect_failures,
+            'disconnects': self.stats.disconnects,
+            'elapsed': elapsed,
+            'sent': self.stats.sent,
+            'acked': self.stats.acked,
+            'errors': self.stats.errors,
+            'rows': rows,
+            'sent_per_second': self.stats.sent / elapsed,
+            'acked_per_second': self.stats.acked / elapsed,
+            'rows_per_second': rows / elapsed,
+            'latency': {
+                'p50': percentile(latencies, 50),
+                'p90': percentile(latencies, 90),
+                'p99': percentile(latencies, 99),
+                'max': latencies[-1] if latencies else None,
+            },
+        }
+
+    async def report(self, started, baseline):
+        """定期输出本周期的统计"""
+        last_sent = last_acked = last_rows = 0
+        last_time = started
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            rows = await self.rows_since(baseline)
+            elapsed = now - last_time
+            latencies = self.stats.interval_latencies()
+
+            self.write(
+                f"[{now - started:6.1f}s] 连接 {self.stats.connected}/{len(self.devices)}  "
+                f"发送 {(self.stats.sent - last_sent) / elapsed:9.1f}/s  "
+                f"确认 {(self.stats.acked - last_acked) / elapsed:9.1f}/s  "
+                f"写入 {(rows - last_rows) / elapsed:9.1f} 行/s  "
+                f"延迟 p50 {format_ms(percentile(latencies, 50))} "
+                f"p99 {format_ms(percentile(latencies, 99))}"
+            )
+            last_sent, last_acked, last_rows, last_time = self.stats.sent, self.stats.acked, rows, now
+
+
+def format_ms(seconds):
+    """秒转换为毫秒字符串"""
+    return '-' if seconds is None else f"{seconds * 1000:.1f}ms"
@@ -0,0 +1,102 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from iot_devices.retention import RetentionEngine, vacuum
+
+
+def format_bytes(value):
+    """字节数转换为易读的字符串"""
+    if value is None:
+        return '未知'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if value < 1024:
+            return f"{value:.1f}{unit}" if unit != 'B' else f"{value}B"
+        value /= 1024
+    return f"{value:.1f}TB"
+
+
+class Command(BaseCommand):
+    help = '按数据保留策略分块删除过期的传感器数据、汇总数据和执行器数据'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='只统计将被删除的行数和预计回收的空间，不删除数据')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='每个事务删除的最大行数（默认使用DATA_RETENTION_CONFIG配置）')
+        parser.add_argument('--vacuum', action='store_true',
+                            help='清理完成后回收磁盘空间（SQLite会重写整个数据库文件）')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='每隔指定秒数重复执行，直到收到终止信号（默认只执行一次）')
+
+    def handle(self, *args, **options):
+        engine = RetentionEngine.from_settings()
+        if options['chunk_size'] is not None:
+            if options['chunk_size'] <= 0:
+                raise CommandError('--chunk-size 必须大于0')
+            engine.chunk_size = options['chunk_size']
+
+        interval = options['interval']
+        if interval < 0:
+            raise CommandError('--interval 不能小于0')
+        if not interval:
+            self.apply(engine, options)
+            return
+
+        if options['dry_run']:
+            raise CommandError('--dry-run 不能与 --interval 一起使用')
+
+        stop_event = threading.Event()
+
+        def handle_signal(signum, frame):
+            self.stdout.write("接收到终止信号，正在停止...")
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, handle_signal)
+        signal.signal(signal.SIGINT, handle_signal)
+
+        self.stdout.write(self.style.SUCCESS(f"数据保留清理已启动，间隔 {interval}s"))
+        while True:
+            try:
+                self.apply(engine, options)
+            except Exception as e:
+                self.stderr.write(f"执行数据保留清理时出错: {str(e)}")
+            finally:
+                close_old_connections()
+            if stop_event.wait(interval):
+                break
+        self.stdout.write("数据保留清理已停止")
+
+    def apply(self, engine, options):
+        """执行一次清理并输出结果"""
+        dry_run = options['dry_run']
+        results = engine.run(dry_run=dry_run)
+        if not results:
+            self.stdout.write("没有配置保留天数的数据，无需清理")
+            return
+
+        for result in results:
+            line = f"{result.label} ({result.table}，保留 {result.days} 天): {result.rows} 行"
+            if dry_run:
+                line += f"，预计回收 {format_bytes(result.bytes)}"
+            for model_label, count in result.cascaded.items():
+                line += f"，级联删除 {model_label} {count} 行"
+            self.stdout.write(line)
+
+        total_rows = sum(result.rows for result in results)
+        if dry_run:
+            known = [result.bytes for result in results if result.bytes is not None]
+            self.stdout.write(self.style.SUCCESS(
+                f"预计删除 {total_rows} 行，预计回收 {format_bytes(sum(known)) if known else '未知'}（未删除任何数据）"
+            ))
+            return
+
+        self.stdout.write(self.style.SUCCESS(f"已删除 {total_rows} 行"))
+
+        if options['vacuum']:
+            if vacuum():
+                self.stdout.write(self.style.SUCCESS("已回收磁盘空间"))
+            else:
+                self.stdout.write(self.style.WARNING("当前数据库不支持自动回收空间"))
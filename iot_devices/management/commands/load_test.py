@@ -0,0 +1,134 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from iot_devices.loadtest import PAYLOAD_SHAPES, LoadTest, PayloadFactory, format_ms, prepare_devices
+from iot_devices.models import Device, Project
+from tcp_server.framing import FRAMERS
+
+
+class Command(BaseCommand):
+    help = '模拟大量设备通过TCP或MQTT上报数据，统计接入吞吐量、确认延迟和数据库写入速度'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transport', choices=('tcp', 'mqtt'), default='tcp',
+                            help='接入协议：tcp连接run_tcp_server.py，mqtt连接本地MQTT Broker')
+        parser.add_argument('--project', required=True,
+                            help='使用该项目（项目号）中的设备进行压测')
+        parser.add_argument('--devices', type=int, default=100,
+                            help='模拟设备数')
+        parser.add_argument('--create', action='store_true',
+                            help='项目中设备不足时创建压测设备（设备号以LT-开头）')
+        parser.add_argument('--cleanup', action='store_true',
+                            help='压测结束后删除本次创建的压测设备及其数据')
+        parser.add_argument('--fields', default='temperature,humidity',
+                            help='新建设备的传感器值键名（逗号分隔），已有设备使用其传感器配置')
+        parser.add_argument('--rate', type=float, default=1.0,
+                            help='每台设备每秒发送的消息数，可以小于1')
+        parser.add_argument('--duration', type=float, default=60,
+                            help='全部设备连接后持续发送的秒数')
+        parser.add_argument('--ramp', type=float, default=10,
+                            help='在多少秒内逐步建立全部连接')
+        parser.add_argument('--shape', choices=PAYLOAD_SHAPES, default='numeric',
+                            help='消息格式：numeric全部为数值，mixed混合数值、布尔值和字符串')
+        parser.add_argument('--padding-bytes', type=int, default=0,
+                            help='每条消息附加的填充字节数')
+        parser.add_argument('--host', default='127.0.0.1', help='服务器地址')
+        parser.add_argument('--port', type=int, default=None,
+                            help='服务器端口（默认TCP_SERVER_CONFIG的端口或MQTT的1883）')
+        parser.add_argument('--ack', choices=('each', 'batch'), default='each',
+                            help='TCP确认方式：each每条一个确认，batch每批一个合并确认')
+        parser.add_argument('--framing', choices=sorted(FRAMERS), default='newline',
+                            help='TCP分帧方式')
+        parser.add_argument('--qos', type=int, choices=(0, 1), default=1,
+                            help='MQTT发布QoS，0时没有确认延迟')
+        parser.add_argument('--embedded-broker', action='store_true',
+                            help='MQTT压测时在本进程中启动Broker并连接MQTT客户端，'
+                                 '接入、写入和策略处理全部在本进程中完成，无需网络')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='统计输出间隔（秒）')
+
+    def handle(self, *args, **options):
+        if options['rate'] <= 0 or options['devices'] <= 0:
+            raise CommandError('--rate和--devices必须大于0')
+
+        try:
+            project = Project.objects.get(project_id=options['project'])
+        except Project.DoesNotExist:
+            raise CommandError(f"项目 {options['project']} 不存在")
+
+        fields = [field.strip() for field in options['fields'].split(',') if field.strip()]
+        devices, created_ids = prepare_devices(project, options['devices'], fields, create=options['create'])
+        if not devices:
+            raise CommandError('项目中没有设备，可使用--create创建压测设备')
+        if len(devices) < options['devices']:
+            self.stdout.write(self.style.WARNING(f"项目中只有 {len(devices)} 台设备"))
+        if created_ids:
+            self.stdout.write(f"已创建 {len(created_ids)} 台压测设备")
+
+        transport = options['transport']
+        if transport == 'tcp':
+            port = options['port'] or settings.TCP_SERVER_CONFIG.get('PORT', 9000)
+            client_options = {'ack_mode': options['ack'], 'framing': options['framing']}
+        else:
+            port = options['port'] or 1883
+            client_options = {'qos': options['qos']}
+            if options['embedded_broker']:
+                self.start_embedded_pipeline(options['host'], port)
+
+        load_test = LoadTest(
+            devices, transport, options['host'], port,
+            rate=options['rate'],
+            duration=options['duration'],
+            ramp=options['ramp'],
+            payloads=PayloadFactory(options['shape'], options['padding_bytes']),
+            interval=options['interval'],
+            client_options=client_options,
+            write=self.stdout.write,
+        )
+
+        self.stdout.write(
+            f"压测开始: {transport}://{options['host']}:{port}，{len(devices)} 台设备，"
+            f"每台 {options['rate']} 条/秒，持续 {options['duration']}s（建立连接 {options['ramp']}s）"
+        )
+        try:
+            result = asyncio.run(load_test.run())
+        finally:
+            if transport == 'mqtt' and options['embedded_broker']:
+                # 写入MQTT客户端队列中剩余的数据
+                from mqtt_client.mqtt import mqtt_client
+                mqtt_client.disconnect()
+            if options['cleanup'] and created_ids:
+                Device.objects.filter(pk__in=created_ids).delete()
+                self.stdout.write(f"已删除 {len(created_ids)} 台压测设备")
+
+        latency = result['latency']
+        self.stdout.write(self.style.SUCCESS(
+            f"压测完成，耗时 {result['elapsed']:.1f}s\n"
+            f"  连接失败 {result['connect_failures']}，异常断开 {result['disconnects']}\n"
+            f"  发送 {result['sent']} 条（{result['sent_per_second']:.1f}/s），"
+            f"确认 {result['acked']} 条（{result['acked_per_second']:.1f}/s），错误 {result['errors']} 条\n"
+            f"  数据库写入 {result['rows']} 行（{result['rows_per_second']:.1f} 行/s）\n"
+            f"  确认延迟 p50 {format_ms(latency['p50'])}  p90 {format_ms(latency['p90'])}  "
+            f"p99 {format_ms(latency['p99'])}  最大 {format_ms(latency['max'])}"
+        ))
+
+    def start_embedded_pipeline(self, host, port):
+        """启动进程内Broker，并让MQTT客户端连接它（订阅设备主题，批量写入数据库）"""
+        from mqtt_client.broker import start_embedded_broker
+        from mqtt_client.mqtt import mqtt_client
+
+        start_embedded_broker(host, port)
+        if mqtt_client.connected:
+            mqtt_client.disconnect()
+        mqtt_client.host, mqtt_client.port = host, port
+        if not mqtt_client.connect(ingest=True):
+            raise CommandError('MQTT客户端连接进程内Broker失败')
+
+        # 等待订阅完成
+        deadline = time.monotonic() + 5
+        while not mqtt_client.connected and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.stdout.write(f"已在本进程启动MQTT Broker {host}:{port}")
@@ -0,0 +1,33 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot_devices', '0007_rename_response_actuatorcommand_response_message_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('1m', '1分钟'), ('1h', '1小时'), ('1d', '1天')], max_length=2, verbose_name='时间粒度')),
+                ('bucket_start', models.DateTimeField(verbose_name='时间桶起点')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='数据条数')),
+                ('value_sum', models.FloatField(default=0, verbose_name='数值总和')),
+                ('value_min', models.FloatField(blank=True, null=True, verbose_name='最小值')),
+                ('value_max', models.FloatField(blank=True, null=True, verbose_name='最大值')),
+                ('last_value', models.FloatField(blank=True, null=True, verbose_name='最新值')),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True, verbose_name='最新数据时间')),
+                ('sensor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='iot_devices.sensor', verbose_name='传感器')),
+            ],
+            options={
+                'verbose_name': '传感器数据汇总',
+                'verbose_name_plural': '传感器数据汇总',
+                'ordering': ['sensor', 'resolution', 'bucket_start'],
+                'constraints': [models.UniqueConstraint(fields=('sensor', 'resolution', 'bucket_start'), name='unique_sensor_rollup_bucket')],
+            },
+        ),
+    ]
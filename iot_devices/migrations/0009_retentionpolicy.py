@@ -0,0 +1,33 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot_devices', '0008_sensorrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensor_data_days', models.PositiveIntegerField(blank=True, help_text='留空表示沿用上级策略，0表示永久保留', null=True, verbose_name='原始数据保留天数')),
+                ('rollup_minute_days', models.PositiveIntegerField(blank=True, help_text='留空表示沿用上级策略，0表示永久保留', null=True, verbose_name='分钟汇总保留天数')),
+                ('rollup_hour_days', models.PositiveIntegerField(blank=True, help_text='留空表示沿用上级策略，0表示永久保留', null=True, verbose_name='小时汇总保留天数')),
+                ('rollup_day_days', models.PositiveIntegerField(blank=True, help_text='留空表示沿用上级策略，0表示永久保留', null=True, verbose_name='天汇总保留天数')),
+                ('actuator_data_days', models.PositiveIntegerField(blank=True, help_text='仅项目策略有效。留空表示沿用全局配置，0表示永久保留', null=True, verbose_name='执行器数据保留天数')),
+                ('actuator_command_days', models.PositiveIntegerField(blank=True, help_text='仅项目策略有效。留空表示沿用全局配置，0表示永久保留', null=True, verbose_name='执行器命令保留天数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('project', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='retention_policy', to='iot_devices.project', verbose_name='项目')),
+                ('sensor', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='retention_policy', to='iot_devices.sensor', verbose_name='传感器')),
+            ],
+            options={
+                'verbose_name': '数据保留策略',
+                'verbose_name_plural': '数据保留策略',
+                'constraints': [models.CheckConstraint(condition=models.Q(models.Q(('project__isnull', False), ('sensor__isnull', True)), models.Q(('project__isnull', True), ('sensor__isnull', False)), _connector='OR'), name='retention_policy_single_scope')],
+            },
+        ),
+    ]
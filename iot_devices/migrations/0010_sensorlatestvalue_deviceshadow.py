@@ -0,0 +1,73 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_latest_values(apps, schema_editor):
+    """用已有的传感器数据生成最新值（每个传感器取时间最新的一条）"""
+    Sensor = apps.get_model('iot_devices', 'Sensor')
+    SensorData = apps.get_model('iot_devices', 'SensorData')
+    SensorLatestValue = apps.get_model('iot_devices', 'SensorLatestValue')
+
+    latest_ids = [
+        pk for pk in Sensor.objects.annotate(
+            latest_id=Subquery(
+                SensorData.objects.filter(sensor=OuterRef('pk')).order_by('-timestamp', '-id').values('pk')[:1]
+            )
+        ).values_list('latest_id', flat=True).iterator()
+        if pk is not None
+    ]
+
+    for start in range(0, len(latest_ids), 500):
+        SensorLatestValue.objects.bulk_create([
+            SensorLatestValue(
+                sensor_id=data.sensor_id,
+                sensor_data_id=data.pk,
+                timestamp=data.timestamp,
+                value_float=data.value_float,
+                value_string=data.value_string,
+                value_boolean=data.value_boolean,
+            )
+            for data in SensorData.objects.filter(pk__in=latest_ids[start:start + 500])
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot_devices', '0009_retentionpolicy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorLatestValue',
+            fields=[
+                ('sensor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='latest_value', serialize=False, to='iot_devices.sensor', verbose_name='传感器')),
+                ('sensor_data_id', models.BigIntegerField(blank=True, help_text='对应的传感器数据记录', null=True, verbose_name='数据ID')),
+                ('timestamp', models.DateTimeField(verbose_name='记录时间')),
+                ('value_float', models.FloatField(blank=True, null=True, verbose_name='浮点数值')),
+                ('value_string', models.CharField(blank=True, max_length=100, null=True, verbose_name='字符串值')),
+                ('value_boolean', models.BooleanField(blank=True, null=True, verbose_name='布尔值')),
+            ],
+            options={
+                'verbose_name': '传感器最新值',
+                'verbose_name_plural': '传感器最新值',
+            },
+        ),
+        migrations.CreateModel(
+            name='DeviceShadow',
+            fields=[
+                ('device', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='shadow', serialize=False, to='iot_devices.device', verbose_name='设备')),
+                ('reported', models.JSONField(blank=True, default=dict, help_text='设备命令响应中回报的状态', verbose_name='上报状态')),
+                ('desired', models.JSONField(blank=True, default=dict, help_text='平台最近下发的执行器命令值', verbose_name='期望状态')),
+                ('reported_at', models.DateTimeField(blank=True, null=True, verbose_name='上报时间')),
+                ('desired_at', models.DateTimeField(blank=True, null=True, verbose_name='期望更新时间')),
+                ('version', models.PositiveIntegerField(default=0, help_text='每次更新递增', verbose_name='版本')),
+            ],
+            options={
+                'verbose_name': '设备影子',
+                'verbose_name_plural': '设备影子',
+            },
+        ),
+        migrations.RunPython(backfill_latest_values, migrations.RunPython.noop),
+    ]
@@ -124,6 +124,140 @@ class SensorData(models.Model):
         return f"{self.sensor.name}: {value} ({self.timestamp.strftime('%Y-%m-%d %H:%M:%S')})"
 
 
+class SensorLatestValue(models.Model):
+    """传感器最新值模型 - 每个传感器一行，数据接入写入每批数据时在同一事务中更新"""
+    sensor = models.OneToOneField(Sensor, on_delete=models.CASCADE, primary_key=True,
+                                  related_name='latest_value', verbose_name='传感器')
+    sensor_data_id = models.BigIntegerField('数据ID', null=True, blank=True, help_text="对应的传感器数据记录")
+    timestamp = models.DateTimeField('记录时间')
+    value_float = models.FloatField('浮点数值', null=True, blank=True)
+    value_string = models.CharField('字符串值', max_length=100, null=True, blank=True)
+    value_boolean = models.BooleanField('布尔值', null=True, blank=True)
+
+    class Meta:
+        verbose_name = '传感器最新值'
+        verbose_name_plural = '传感器最新值'
+
+    def __str__(self):
+        return f"{self.sensor_id}: {self.value} ({self.timestamp.strftime('%Y-%m-%d %H:%M:%S')})"
+
+    @property
+    def value(self):
+        """返回正确类型的值"""
+        if self.value_float is not None:
+            return self.value_float
+        elif self.value_string is not None:
+            return self.value_string
+        return self.value_boolean
+
+
+class DeviceShadow(models.Model):
+    """设备影子模型 - 设备最近上报的执行器状态（reported）和平台期望的执行器状态（desired），按command_key保存"""
+    device = models.OneToOneField(Device, on_delete=models.CASCADE, primary_key=True,
+                                  related_name='shadow', verbose_name='设备')
+    reported = models.JSONField('上报状态', default=dict, blank=True, help_text="设备命令响应中回报的状态")
+    desired = models.JSONField('期望状态', default=dict, blank=True, help_text="平台最近下发的执行器命令值")
+    reported_at = models.DateTimeField('上报时间', null=True, blank=True)
+    desired_at = models.DateTimeField('期望更新时间', null=True, blank=True)
+    version = models.PositiveIntegerField('版本', default=0, help_text="每次更新递增")
+
+    class Meta:
+        verbose_name = '设备影子'
+        verbose_name_plural = '设备影子'
+
+    def __str__(self):
+        return f"{self.device_id} v{self.version}"
+
+    @property
+    def delta(self):
+        """期望状态中与上报状态不一致的键（按字符串比较，与Actuator.current_state一致）"""
+        return {
+            key: value for key, value in self.desired.items()
+            if key not in self.reported or str(self.reported[key]) != str(value)
+        }
+
+
+class SensorRollup(models.Model):
+    """传感器数据汇总模型 - 按固定时间粒度预聚合的数值数据"""
+    RESOLUTION_CHOICES = (
+        ('1m', '1分钟'),
+        ('1h', '1小时'),
+        ('1d', '1天'),
+    )
+
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, related_name='rollups', verbose_name='传感器')
+    resolution = models.CharField('时间粒度', max_length=2, choices=RESOLUTION_CHOICES)
+    bucket_start = models.DateTimeField('时间桶起点')
+    count = models.PositiveIntegerField('数据条数', default=0)
+    value_sum = models.FloatField('数值总和', default=0)
+    value_min = models.FloatField('最小值', null=True, blank=True)
+    value_max = models.FloatField('最大值', null=True, blank=True)
+    last_value = models.FloatField('最新值', null=True, blank=True)
+    last_timestamp = models.DateTimeField('最新数据时间', null=True, blank=True)
+
+    class Meta:
+        verbose_name = '传感器数据汇总'
+        verbose_name_plural = '传感器数据汇总'
+        ordering = ['sensor', 'resolution', 'bucket_start']
+        constraints = [
+            models.UniqueConstraint(fields=['sensor', 'resolution', 'bucket_start'], name='unique_sensor_rollup_bucket')
+        ]
+
+    def __str__(self):
+        return f"{self.sensor.name} [{self.resolution}] {self.bucket_start.strftime('%Y-%m-%d %H:%M')}: {self.count}条"
+
+    @property
+    def value_avg(self):
+        """时间桶内的平均值"""
+        return self.value_sum / self.count if self.count else None
+
+
+class RetentionPolicy(models.Model):
+    """数据保留策略模型 - 按项目或传感器配置历史数据保留天数"""
+    project = models.OneToOneField(Project, on_delete=models.CASCADE, null=True, blank=True,
+                                   related_name='retention_policy', verbose_name='项目')
+    sensor = models.OneToOneField(Sensor, on_delete=models.CASCADE, null=True, blank=True,
+                                  related_name='retention_policy', verbose_name='传感器')
+    sensor_data_days = models.PositiveIntegerField('原始数据保留天数', null=True, blank=True,
+                                                   help_text="留空表示沿用上级策略，0表示永久保留")
+    rollup_minute_days = models.PositiveIntegerField('分钟汇总保留天数', null=True, blank=True,
+                                                     help_text="留空表示沿用上级策略，0表示永久保留")
+    rollup_hour_days = models.PositiveIntegerField('小时汇总保留天数', null=True, blank=True,
+                                                   help_text="留空表示沿用上级策略，0表示永久保留")
+    rollup_day_days = models.PositiveIntegerField('天汇总保留天数', null=True, blank=True,
+                                                  help_text="留空表示沿用上级策略，0表示永久保留")
+    actuator_data_days = models.PositiveIntegerField('执行器数据保留天数', null=True, blank=True,
+                                                     help_text="仅项目策略有效。留空表示沿用全局配置，0表示永久保留")
+    actuator_command_days = models.PositiveIntegerField('执行器命令保留天数', null=True, blank=True,
+                                                        help_text="仅项目策略有效。留空表示沿用全局配置，0表示永久保留")
+    created_at = models.DateTimeField('创建时间', auto_now_add=True)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '数据保留策略'
+        verbose_name_plural = '数据保留策略'
+        constraints = [
+            models.CheckConstraint(
+                condition=(
+                    models.Q(project__isnull=False, sensor__isnull=True)
+                    | models.Q(project__isnull=True, sensor__isnull=False)
+                ),
+                name='retention_policy_single_scope',
+            )
+        ]
+
+    def __str__(self):
+        if self.sensor_id:
+            return f"传感器策略: {self.sensor}"
+        return f"项目策略: {self.project}"
+
+    def clean(self):
+        """项目和传感器必须且只能指定一个"""
+        from django.core.exceptions import ValidationError
+        if bool(self.project_id) == bool(self.sensor_id):
+            raise ValidationError("请选择项目或传感器中的一个作为策略范围")
+
+
 class ActuatorData(models.Model):
     """执行器数据模型 - 记录执行器上报的数据"""
     actuator = models.ForeignKey(Actuator, on_delete=models.CASCADE, related_name='data_points', verbose_name='执行器')
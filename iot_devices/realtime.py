@@ -0,0 +1,133 @@
+import logging
+import threading
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def sensor_group(sensor_id):
+    """传感器的实时数据组名（Channels组名只允许ASCII字母、数字、连字符、下划线和点）"""
+    return f"sensor.{sensor_id}"
+
+
+def reading_value(sensor_data):
+    """返回正确类型的值（与SensorDataSerializer一致）"""
+    if sensor_data.value_float is not None:
+        return sensor_data.value_float
+    elif sensor_data.value_string is not None:
+        return sensor_data.value_string
+    elif sensor_data.value_boolean is not None:
+        return sensor_data.value_boolean
+    return None
+
+
+class RealtimePublisher:
+    """
+    实时数据发布器
+
+    数据接入写入传感器数据后调用publish()，每个传感器在一个tick内只保留最新读数，
+    后台线程每tick把合并后的消息发送到对应传感器的组（消息中的count为本tick内的读数条数），
+    高频上报的传感器不会刷屏浏览器，也不会给通道层带来逐条消息的压力。
+    数据接入和Web进程之间需要共享的通道层（如Redis）才能送达浏览器。
+    """
+
+    def __init__(self, tick=0.5, enabled=True):
+        """
+        初始化发布器
+        :param tick: 合并发送间隔（秒）
+        :param enabled: 是否发布
+        """
+        self.tick = tick
+        self.enabled = enabled
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @classmethod
+    def from_settings(cls):
+        """根据settings.REALTIME_CONFIG创建发布器"""
+        config = getattr(settings, 'REALTIME_CONFIG', {})
+        return cls(tick=config.get('TICK', 0.5), enabled=config.get('ENABLED', True))
+
+    def publish(self, readings):
+        """
+        提交一批新写入的传感器数据（需已有timestamp），在下一个tick合并发送
+        :param readings: SensorData列表
+        """
+        if not self.enabled or not readings:
+            return
+
+        with self._lock:
+            for reading in readings:
+                pending = self._pending.get(reading.sensor_id)
+                count = pending[1] + 1 if pending is not None else 1
+                self._pending[reading.sensor_id] = (reading, count)
+
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+
+    def start(self):
+        """启动发送线程"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='realtime-publisher', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """停止发送线程（发送剩余消息）"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            stopping = self._stop_event.wait(self.tick)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"发送实时数据时出错: {str(e)}")
+            if stopping:
+                break
+
+    def flush(self):
+        """
+        发送本tick合并后的消息
+        :return: 发送的消息数
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        from channels.layers import get_channel_layer
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return 0
+
+        messages = [
+            (sensor_group(sensor_id), {
+                'type': 'sensor.reading',
+                'sensor_id': sensor_id,
+                'timestamp': reading.timestamp.isoformat(),
+                'value': reading_value(reading),
+                'count': count,
+            })
+            for sensor_id, (reading, count) in pending.items()
+        ]
+        async_to_sync(self._send_all)(channel_layer, messages)
+        return len(messages)
+
+    @staticmethod
+    async def _send_all(channel_layer, messages):
+        for group, message in messages:
+            await channel_layer.group_send(group, message)
+
+
+# 全局实时数据发布器
+realtime_publisher = RealtimePublisher.from_settings()
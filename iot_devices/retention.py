@@ -0,0 +1,364 @@
+import datetime
+import logging
+import threading
+import time
+from collections import Counter, namedtuple
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.db.models import CASCADE
+from django.utils import timezone
+
+from .models import (
+    Actuator, ActuatorCommand, ActuatorData, RetentionPolicy, Sensor, SensorData, SensorRollup,
+)
+from .rollups import RESOLUTIONS, floor_time
+
+logger = logging.getLogger(__name__)
+
+
+# 一类待清理数据：同一张表、同一保留天数的所有数据
+# querysets按对象id分块，避免IN列表超过数据库的参数上限
+RetentionTarget = namedtuple('RetentionTarget', ['label', 'model', 'days', 'cutoff', 'querysets'])
+
+# 清理结果（dry-run时rows/bytes为预计值）
+RetentionResult = namedtuple('RetentionResult', ['label', 'table', 'days', 'rows', 'bytes', 'cascaded'])
+
+# 按传感器保留的数据：(标签, 模型, 策略字段, 全局配置键, 时间字段, 汇总粒度)
+SENSOR_TIERS = (
+    ('传感器数据', SensorData, 'sensor_data_days', 'SENSOR_DATA_DAYS', 'timestamp', None),
+    ('分钟汇总', SensorRollup, 'rollup_minute_days', 'ROLLUP_MINUTE_DAYS', 'bucket_start', '1m'),
+    ('小时汇总', SensorRollup, 'rollup_hour_days', 'ROLLUP_HOUR_DAYS', 'bucket_start', '1h'),
+    ('天汇总', SensorRollup, 'rollup_day_days', 'ROLLUP_DAY_DAYS', 'bucket_start', '1d'),
+)
+
+# 按执行器保留的数据：(标签, 模型, 策略字段, 全局配置键)
+ACTUATOR_TIERS = (
+    ('执行器数据', ActuatorData, 'actuator_data_days', 'ACTUATOR_DATA_DAYS'),
+    ('执行器命令', ActuatorCommand, 'actuator_command_days', 'ACTUATOR_COMMAND_DAYS'),
+)
+
+# 每个IN列表中的最大对象数
+ID_CHUNK_SIZE = 500
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def table_size(model):
+    """
+    查询表（含索引）占用的字节数
+    :return: 字节数，数据库不支持时返回None
+    """
+    table = model._meta.db_table
+    queries = {
+        # 需要SQLite编译时启用dbstat虚拟表
+        'sqlite': ("SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+                   "(SELECT name FROM sqlite_master WHERE tbl_name = %s)", [table]),
+        'postgresql': ("SELECT pg_total_relation_size(%s)", [table]),
+        'mysql': ("SELECT data_length + index_length FROM information_schema.tables "
+                  "WHERE table_schema = DATABASE() AND table_name = %s", [table]),
+    }
+    if connection.vendor not in queries:
+        return None
+
+    sql, params = queries[connection.vendor]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    return int(row[0]) if row and row[0] is not None else None
+
+
+class RetentionEngine:
+    """
+    数据保留引擎
+
+    按保留策略分块删除过期的传感器数据、汇总数据、执行器数据和执行器命令。
+    - 保留天数按 传感器策略 -> 项目策略 -> settings.DATA_RETENTION_CONFIG 的顺序取第一个非空值，0表示永久保留
+    - 原始数据和各粒度汇总数据分别设置保留天数，例如原始数据保留7天、天汇总永久保留
+    - 每次只删除chunk_size行并在独立的短事务中提交，块之间休眠chunk_sleep秒，避免长时间锁表
+    """
+
+    def __init__(self, defaults=None, chunk_size=1000, chunk_sleep=0.05):
+        """初始化引擎"""
+        self.defaults = defaults or {}
+        self.chunk_size = chunk_size
+        self.chunk_sleep = chunk_sleep
+
+    @classmethod
+    def from_settings(cls):
+        """根据settings.DATA_RETENTION_CONFIG创建引擎"""
+        config = getattr(settings, 'DATA_RETENTION_CONFIG', {})
+        return cls(
+            defaults=config,
+            chunk_size=config.get('CHUNK_SIZE', 1000),
+            chunk_sleep=config.get('CHUNK_SLEEP', 0.05),
+        )
+
+    def _effective_days(self, field, default_key, *policies):
+        """按顺序取第一个非空的保留天数；0或未配置表示永久保留"""
+        for policy in policies:
+            value = getattr(policy, field) if policy is not None else None
+            if value is not None:
+                return value or None
+        return self.defaults.get(default_key) or None
+
+    def plan(self, now=None):
+        """
+        计算本次需要清理的数据
+        :return: RetentionTarget列表
+        """
+        now = now or timezone.now()
+        project_policies = {p.project_id: p for p in RetentionPolicy.objects.filter(project__isnull=False)}
+        sensor_policies = {p.sensor_id: p for p in RetentionPolicy.objects.filter(sensor__isnull=False)}
+
+        targets = []
+
+        sensors = list(Sensor.objects.values_list('id', 'device__project_id'))
+        for label, model, field, default_key, time_field, resolution in SENSOR_TIERS:
+            groups = {}
+            for sensor_id, project_id in sensors:
+                days = self._effective_days(
+                    field, default_key, sensor_policies.get(sensor_id), project_policies.get(project_id)
+                )
+                if days:
+                    groups.setdefault(days, []).append(sensor_id)
+
+            for days, sensor_ids in sorted(groups.items()):
+                cutoff = now - datetime.timedelta(days=days)
+                filters = {f'{time_field}__lt': cutoff}
+                if resolution is not None:
+                    # 只删除完全早于截止时间的时间桶
+                    filters = {
+                        'resolution': resolution,
+                        f'{time_field}__lt': floor_time(cutoff, RESOLUTIONS[resolution]),
+                    }
+                querysets = [
+                    model.objects.filter(sensor_id__in=chunk, **filters)
+                    for chunk in _chunks(sensor_ids, ID_CHUNK_SIZE)
+                ]
+                targets.append(RetentionTarget(label, model, days, cutoff, querysets))
+
+        actuators = list(Actuator.objects.values_list('id', 'device__project_id'))
+        for label, model, field, default_key in ACTUATOR_TIERS:
+            groups = {}
+            for actuator_id, project_id in actuators:
+                days = self._effective_days(field, default_key, project_policies.get(project_id))
+                if days:
+                    groups.setdefault(days, []).append(actuator_id)
+
+            for days, actuator_ids in sorted(groups.items()):
+                cutoff = now - datetime.timedelta(days=days)
+                querysets = [
+                    model.objects.filter(actuator_id__in=chunk, timestamp__lt=cutoff)
+                    for chunk in _chunks(actuator_ids, ID_CHUNK_SIZE)
+                ]
+                targets.append(RetentionTarget(label, model, days, cutoff, querysets))
+
+        return targets
+
+    def run(self, dry_run=False, now=None):
+        """
+        执行清理
+        :param dry_run: 只统计将被删除的行数和预计回收的字节数，不删除数据
+        :return: RetentionResult列表
+        """
+        started = time.monotonic()
+        targets = self.plan(now)
+        results = self.estimate(targets) if dry_run else [self._apply(target) for target in targets]
+
+        total_rows = sum(result.rows for result in results)
+        logger.info(f"数据保留{'预估' if dry_run else '清理'}完成: {total_rows} 行，"
+                    f"耗时 {time.monotonic() - started:.1f}s")
+        return results
+
+    def estimate(self, targets):
+        """
+        统计每类数据将被删除的行数（包括级联删除的关联数据，如关联到传感器数据的策略日志），
+        并按各表的平均行大小估算回收字节数
+        """
+        sizes = {}
+
+        def estimate_bytes(model, rows):
+            if model not in sizes:
+                table_bytes = table_size(model)
+                table_rows = model._base_manager.count() if table_bytes is not None else 0
+                sizes[model] = (table_bytes, table_rows)
+            table_bytes, table_rows = sizes[model]
+            if table_bytes is None or not table_rows:
+                return None
+            return int(table_bytes * rows / table_rows)
+
+        results = []
+        for target in targets:
+            rows = 0
+            cascaded = Counter()
+            for queryset in target.querysets:
+                rows += queryset.count()
+                cascaded.update(count_cascaded(queryset))
+
+            estimated = estimate_bytes(target.model, rows)
+            if estimated is not None:
+                for model_label, count in cascaded.items():
+                    cascaded_bytes = estimate_bytes(apps.get_model(model_label), count)
+                    if cascaded_bytes is None:
+                        estimated = None
+                        break
+                    estimated += cascaded_bytes
+
+            results.append(RetentionResult(
+                target.label, target.model._meta.db_table, target.days, rows, estimated, dict(cascaded)
+            ))
+        return results
+
+    def _apply(self, target):
+        """分块删除一类数据"""
+        rows = 0
+        cascaded = Counter()
+        for queryset in target.querysets:
+            deleted, related = self._delete_in_chunks(queryset)
+            rows += deleted
+            cascaded.update(related)
+
+        if rows:
+            logger.info(f"已删除{target.label} {rows} 行（保留 {target.days} 天）")
+        return RetentionResult(target.label, target.model._meta.db_table, target.days, rows, None, dict(cascaded))
+
+    def _delete_in_chunks(self, queryset):
+        """
+        每次按主键删除chunk_size行，每块在独立事务中提交
+        :return: (删除的行数, {级联删除的模型: 行数})
+        """
+        model = queryset.model
+        label = model._meta.label
+        rows = 0
+        cascaded = Counter()
+
+        while True:
+            ids = list(queryset.order_by().values_list('pk', flat=True)[:self.chunk_size])
+            if not ids:
+                break
+
+            with transaction.atomic():
+                _, per_model = model.objects.filter(pk__in=ids).delete()
+
+            rows += per_model.pop(label, 0)
+            cascaded.update(per_model)
+
+            if len(ids) < self.chunk_size:
+                break
+            if self.chunk_sleep:
+                time.sleep(self.chunk_sleep)
+
+        return rows, cascaded
+
+
+def count_cascaded(queryset):
+    """
+    统计删除queryset时会被级联删除的关联行数（与QuerySet.delete()的返回值一致，不含queryset本身）
+    :return: {模型label: 行数}
+    """
+    counts = Counter()
+    for relation in queryset.model._meta.related_objects:
+        if relation.many_to_many or relation.on_delete is not CASCADE:
+            continue
+        related = relation.related_model._base_manager.filter(
+            **{f'{relation.field.name}__in': queryset.order_by().values('pk')}
+        )
+        count = related.count()
+        if count:
+            counts[relation.related_model._meta.label] += count
+            counts.update(count_cascaded(related))
+    return counts
+
+
+def vacuum():
+    """
+    回收已删除数据占用的磁盘空间（SQLite执行VACUUM，PostgreSQL执行VACUUM ANALYZE）
+    :return: 是否执行
+    """
+    statements = {
+        'sqlite': 'VACUUM',
+        'postgresql': 'VACUUM ANALYZE',
+    }
+    if connection.vendor not in statements:
+        return False
+
+    # VACUUM不能在事务中执行，Django默认处于autocommit模式
+    with connection.cursor() as cursor:
+        cursor.execute(statements[connection.vendor])
+    return True
+
+
+class RetentionScheduler:
+    """进程内定期执行数据保留清理的后台线程"""
+
+    def __init__(self, interval, engine=None):
+        """
+        初始化调度器
+        :param interval: 执行间隔（秒）
+        """
+        self.interval = interval
+        self.engine = engine or RetentionEngine.from_settings()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """启动后台线程（首次清理在一个间隔之后执行，不拖慢进程启动）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='data-retention', daemon=True)
+        self._thread.start()
+        logger.info(f"数据保留定时任务已启动，间隔 {self.interval}s")
+
+    def stop(self, timeout=5):
+        """停止后台线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.engine.run()
+            except Exception as e:
+                logger.exception(f"执行数据保留清理时出错: {str(e)}")
+            finally:
+                close_old_connections()
+
+
+_scheduler = None
+
+
+def start_retention_scheduler():
+    """
+    按settings.DATA_RETENTION_CONFIG['SCHEDULE_INTERVAL']启动进程内定时清理
+    :return: RetentionScheduler，未启用时返回None
+    """
+    global _scheduler
+
+    interval = getattr(settings, 'DATA_RETENTION_CONFIG', {}).get('SCHEDULE_INTERVAL', 0)
+    if not interval:
+        return None
+
+    if _scheduler is None:
+        _scheduler = RetentionScheduler(interval)
+        _scheduler.start()
+    return _scheduler
+
+
+def stop_retention_scheduler():
+    """停止进程内定时清理（例如只允许领导者进程执行清理时）"""
+    global _scheduler
+
+    if _scheduler is not None:
+        _scheduler.stop()
+        _scheduler = None
@@ -0,0 +1,284 @@
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Max, Min, Q, Sum
+from django.utils import timezone
+
+from .models import SensorRollup
+from .timeseries import EpochBucket, bucket_start
+
+logger = logging.getLogger(__name__)
+
+
+# 汇总粒度 -> 时间桶长度（秒）
+RESOLUTIONS = {
+    '1m': 60,
+    '1h': 3600,
+    '1d': 86400,
+}
+
+# 从粗到细，查询时优先使用最粗的粒度
+RESOLUTION_ORDER = ('1d', '1h', '1m')
+
+# 汇总表只保存数值读数，可由汇总表计算的聚合方式
+ROLLUP_AGGREGATES = ('avg', 'min', 'max')
+
+# 详情页统计摘要的时间范围
+SUMMARY_WINDOWS = (
+    ('最近1小时', datetime.timedelta(hours=1)),
+    ('最近24小时', datetime.timedelta(hours=24)),
+    ('最近30天', datetime.timedelta(days=30)),
+)
+
+# 统计摘要至少覆盖的时间桶数，保证范围边缘的误差不超过约1/24
+SUMMARY_MIN_BUCKETS = 24
+
+# 合并增量时单条查询的规模上限：OR条件数（SQLite表达式树深度上限为1000）和传感器ID参数个数
+APPLY_MAX_CONDITIONS = 100
+APPLY_MAX_SENSORS = 500
+
+
+def _config():
+    return getattr(settings, 'SENSOR_ROLLUP_CONFIG', {})
+
+
+def floor_time(value, seconds):
+    """把时间向下对齐到时间桶起点"""
+    return bucket_start(int(value.timestamp()) // seconds * seconds)
+
+
+def choose_resolution(interval):
+    """
+    选择能整除时间间隔的最粗汇总粒度
+    :param interval: 时间桶间隔（秒）
+    :return: 粒度，没有合适粒度时返回None
+    """
+    for resolution in RESOLUTION_ORDER:
+        if interval % RESOLUTIONS[resolution] == 0:
+            return resolution
+    return None
+
+
+def summary_resolution(span):
+    """选择统计摘要使用的最粗粒度（时间范围内至少有SUMMARY_MIN_BUCKETS个时间桶）"""
+    for resolution in RESOLUTION_ORDER:
+        if RESOLUTIONS[resolution] * SUMMARY_MIN_BUCKETS <= span.total_seconds():
+            return resolution
+    return RESOLUTION_ORDER[-1]
+
+
+class _Delta:
+    """单个时间桶的增量"""
+
+    __slots__ = ('count', 'value_sum', 'value_min', 'value_max', 'last_value', 'last_timestamp')
+
+    def __init__(self):
+        self.count = 0
+        self.value_sum = 0.0
+        self.value_min = None
+        self.value_max = None
+        self.last_value = None
+        self.last_timestamp = None
+
+    def add(self, value, timestamp):
+        self.count += 1
+        self.value_sum += value
+        self.value_min = value if self.value_min is None else min(self.value_min, value)
+        self.value_max = value if self.value_max is None else max(self.value_max, value)
+        if self.last_timestamp is None or timestamp >= self.last_timestamp:
+            self.last_value = value
+            self.last_timestamp = timestamp
+
+    def merge_into(self, rollup):
+        """把增量合并到已有的汇总行"""
+        rollup.count += self.count
+        rollup.value_sum += self.value_sum
+        rollup.value_min = self.value_min if rollup.value_min is None else min(rollup.value_min, self.value_min)
+        rollup.value_max = self.value_max if rollup.value_max is None else max(rollup.value_max, self.value_max)
+        if rollup.last_timestamp is None or self.last_timestamp >= rollup.last_timestamp:
+            rollup.last_value = self.last_value
+            rollup.last_timestamp = self.last_timestamp
+
+    def to_rollup(self, sensor_id, resolution, start):
+        return SensorRollup(
+            sensor_id=sensor_id,
+            resolution=resolution,
+            bucket_start=start,
+            count=self.count,
+            value_sum=self.value_sum,
+            value_min=self.value_min,
+            value_max=self.value_max,
+            last_value=self.last_value,
+            last_timestamp=self.last_timestamp,
+        )
+
+
+def record_readings(readings):
+    """
+    把新写入的传感器数据增量合并到各粒度的汇总表
+    只统计数值读数；应在写入数据的同一事务中调用，汇总失败时记录日志并返回0，不影响原始数据的写入
+    :param readings: 已保存的SensorData（需已有timestamp）
+    :return: 更新或创建的汇总行数
+    """
+    if not _config().get('ENABLED', True):
+        return 0
+
+    deltas = {}
+    for reading in readings:
+        if reading.value_float is None or reading.timestamp is None:
+            continue
+        for resolution, seconds in RESOLUTIONS.items():
+            key = (reading.sensor_id, resolution, floor_time(reading.timestamp, seconds))
+            if key not in deltas:
+                deltas[key] = _Delta()
+            deltas[key].add(reading.value_float, reading.timestamp)
+
+    if not deltas:
+        return 0
+
+    # 并发写入同一个新时间桶时唯一约束冲突，回滚保存点后重试一次即可合并到对方创建的行；
+    # 汇总失败只回滚保存点，不影响同一事务中的原始数据，缺失的汇总由backfill_rollups补齐
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                _apply(deltas)
+            return len(deltas)
+        except IntegrityError:
+            if attempt:
+                logger.exception("汇总时间桶重试后仍然冲突，跳过本批汇总（可执行backfill_rollups补齐）")
+                return 0
+            logger.debug("汇总时间桶写入冲突，重试合并")
+        except DatabaseError:
+            logger.exception("更新汇总表失败，跳过本批汇总（可执行backfill_rollups补齐）")
+            return 0
+
+
+def _lock_conditions(keys):
+    """
+    把(传感器, 粒度, 时间桶)分组为查询条件，每组生成一条查询
+    同一粒度和时间桶的传感器合并为一个sensor_id__in条件，避免三个IN条件的笛卡尔积锁住无关的行；
+    每条查询的OR条件数和传感器ID数有上限，一批数据涉及大量传感器或时间桶时拆分为多条查询
+    :return: Q迭代器
+    """
+    buckets = {}
+    for sensor_id, resolution, start in keys:
+        buckets.setdefault((resolution, start), []).append(sensor_id)
+
+    condition, conditions, sensors = Q(), 0, 0
+    # 排序保证并发写入按相同顺序加锁，不会死锁
+    for (resolution, start), sensor_ids in sorted(buckets.items()):
+        sensor_ids.sort()
+        for offset in range(0, len(sensor_ids), APPLY_MAX_SENSORS):
+            chunk = sensor_ids[offset:offset + APPLY_MAX_SENSORS]
+            if conditions >= APPLY_MAX_CONDITIONS or sensors + len(chunk) > APPLY_MAX_SENSORS:
+                yield condition
+                condition, conditions, sensors = Q(), 0, 0
+            condition |= Q(resolution=resolution, bucket_start=start, sensor_id__in=chunk)
+            conditions += 1
+            sensors += len(chunk)
+    if conditions:
+        yield condition
+
+
+def _apply(deltas):
+    """锁定已有汇总行并合并增量，不存在的时间桶批量创建"""
+    to_update = []
+    pending = dict(deltas)
+    existing = (
+        rollup
+        for condition in _lock_conditions(deltas)
+        for rollup in SensorRollup.objects.select_for_update().filter(condition).order_by('pk')
+    )
+    for rollup in existing:
+        delta = pending.pop((rollup.sensor_id, rollup.resolution, rollup.bucket_start), None)
+        if delta is None:
+            continue
+        delta.merge_into(rollup)
+        to_update.append(rollup)
+
+    if to_update:
+        SensorRollup.objects.bulk_update(
+            to_update, ['count', 'value_sum', 'value_min', 'value_max', 'last_value', 'last_timestamp']
+        )
+    if pending:
+        SensorRollup.objects.bulk_create([
+            delta.to_rollup(sensor_id, resolution, start)
+            for (sensor_id, resolution, start), delta in pending.items()
+        ])
+
+
+def downsample(sensor, start_time, end_time, interval, agg):
+    """
+    使用能满足查询的最粗汇总粒度按时间桶聚合
+    :return: 与timeseries.downsample相同的列式数据；
+             无法由汇总表计算或汇总表中没有数据时返回None，由调用方查询原始数据
+    """
+    if agg not in ROLLUP_AGGREGATES or not _config().get('READ_FROM_ROLLUPS', True):
+        return None
+
+    resolution = choose_resolution(interval)
+    if resolution is None:
+        return None
+
+    rows = list(SensorRollup.objects.filter(
+        sensor=sensor,
+        resolution=resolution,
+        bucket_start__gte=floor_time(start_time, RESOLUTIONS[resolution]),
+        bucket_start__lte=end_time,
+    ).annotate(
+        bucket=EpochBucket('bucket_start', interval=interval)
+    ).values('bucket').order_by('bucket').annotate(
+        total=Sum('count'),
+        value_sum=Sum('value_sum'),
+        value_min=Min('value_min'),
+        value_max=Max('value_max'),
+    ))
+    if not rows:
+        return None
+
+    if agg == 'avg':
+        values = [row['value_sum'] / row['total'] if row['total'] else None for row in rows]
+    else:
+        values = [row['value_min' if agg == 'min' else 'value_max'] for row in rows]
+
+    return {
+        'timestamp': [bucket_start(row['bucket']).isoformat() for row in rows],
+        'value': values,
+        'count': [row['total'] for row in rows],
+    }
+
+
+def summarize(sensor, span, now=None):
+    """
+    统计最近一段时间的数值摘要（条数/平均值/最小值/最大值/最新值）
+    :return: dict，没有数据时返回None
+    """
+    now = now or timezone.now()
+    resolution = summary_resolution(span)
+    queryset = SensorRollup.objects.filter(
+        sensor=sensor,
+        resolution=resolution,
+        bucket_start__gte=floor_time(now - span, RESOLUTIONS[resolution]),
+    )
+
+    totals = queryset.aggregate(
+        total=Sum('count'),
+        value_sum=Sum('value_sum'),
+        value_min=Min('value_min'),
+        value_max=Max('value_max'),
+    )
+    if not totals['total']:
+        return None
+
+    last = queryset.order_by('-bucket_start').values('last_value', 'last_timestamp').first()
+    return {
+        'resolution': resolution,
+        'count': totals['total'],
+        'avg': totals['value_sum'] / totals['total'],
+        'min': totals['value_min'],
+        'max': totals['value_max'],
+        'last_value': last['last_value'],
+        'last_timestamp': last['last_timestamp'],
+    }
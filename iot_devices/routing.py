@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .consumers import SensorStreamConsumer
+
+# WebSocket路由：传感器实时数据
+websocket_urlpatterns = [
+    path('ws/sensors/', SensorStreamConsumer.as_asgi()),
+]
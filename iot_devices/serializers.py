@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Sensor, SensorData, Actuator
+from .models import Sensor, SensorData, Actuator, ActuatorData, ActuatorCommand
 
 
 class SensorDataSerializer(serializers.ModelSerializer):
@@ -32,4 +32,19 @@ class ActuatorSerializer(serializers.ModelSerializer):
     """执行器序列化器"""
     class Meta:
         model = Actuator
-        fields = ['id', 'name', 'actuator_type', 'command_key', 'current_state'] 
\ No newline at end of file
+        fields = ['id', 'name', 'actuator_type', 'command_key', 'current_state'] 
+
+
+class ActuatorDataSerializer(serializers.ModelSerializer):
+    """执行器数据序列化器"""
+    class Meta:
+        model = ActuatorData
+        fields = ['id', 'timestamp', 'value', 'source']
+
+
+class ActuatorCommandSerializer(serializers.ModelSerializer):
+    """执行器命令序列化器"""
+    class Meta:
+        model = ActuatorCommand
+        fields = ['id', 'timestamp', 'command_value', 'status', 'source', 'source_detail',
+                  'response_time', 'response_message']
@@ -0,0 +1,171 @@
+"""
+传感器最新值和设备影子
+
+- 传感器最新值：数据接入在写入每批数据的事务中一次upsert（每个传感器取本批时间最新的一条，不覆盖更新的值），
+  页面和API读取当前值不再需要对每个传感器查询SensorData
+- 设备影子：desired为平台最近下发的执行器命令值，reported为设备命令响应中回报的状态，
+  均按执行器command_key保存，两者不一致的键即为设备尚未执行的命令
+"""
+import logging
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import DeviceShadow, SensorLatestValue
+
+logger = logging.getLogger(__name__)
+
+# 每条upsert语句的最大行数（每行6个参数，低于SQLite的参数个数限制）
+UPSERT_BATCH_SIZE = 500
+
+# upsert时更新的字段（顺序与update_latest_values中每行的值一致）
+LATEST_VALUE_FIELDS = ('sensor_data_id', 'timestamp', 'value_float', 'value_string', 'value_boolean')
+
+
+def update_latest_values(created):
+    """
+    更新一批新写入数据的传感器最新值（需在写入数据的事务中调用）
+    每个传感器取本批时间最新的一条；已保存的最新值时间更晚时不覆盖，
+    多个写入线程并发或设备补传历史数据时最新值不会倒退
+    :param created: 已写入的SensorData列表
+    :return: 本批涉及的传感器数
+    """
+    latest = {}
+    for sensor_data in created:
+        current = latest.get(sensor_data.sensor_id)
+        if current is None or sensor_data.timestamp >= current.timestamp:
+            latest[sensor_data.sensor_id] = sensor_data
+    if not latest:
+        return 0
+
+    rows = [
+        (sensor_id, sensor_data.pk, sensor_data.timestamp,
+         sensor_data.value_float, sensor_data.value_string, sensor_data.value_boolean)
+        for sensor_id, sensor_data in latest.items()
+    ]
+    if connection.vendor in ('postgresql', 'sqlite'):
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            _upsert(rows[start:start + UPSERT_BATCH_SIZE])
+    else:
+        # 其他数据库没有带条件的ON CONFLICT，退回到无条件覆盖
+        SensorLatestValue.objects.bulk_create(
+            [SensorLatestValue(sensor_id=row[0], sensor_data_id=row[1], timestamp=row[2],
+                               value_float=row[3], value_string=row[4], value_boolean=row[5]) for row in rows],
+            update_conflicts=True,
+            unique_fields=['sensor'],
+            update_fields=list(LATEST_VALUE_FIELDS),
+        )
+    return len(latest)
+
+
+def _upsert(rows):
+    """INSERT ... ON CONFLICT DO UPDATE ... WHERE：只有时间不早于已保存值的行才覆盖（PostgreSQL和SQLite）"""
+    opts = SensorLatestValue._meta
+    quote = connection.ops.quote_name
+    table = quote(opts.db_table)
+    key = quote(opts.get_field('sensor').column)
+    timestamp = quote(opts.get_field('timestamp').column)
+    fields = [opts.get_field(name) for name in LATEST_VALUE_FIELDS]
+    columns = [quote(field.column) for field in fields]
+
+    params = []
+    for sensor_id, *values in rows:
+        params.append(sensor_id)
+        params.extend(field.get_db_prep_save(value, connection) for field, value in zip(fields, values))
+
+    row_placeholders = '(' + ', '.join(['%s'] * (len(fields) + 1)) + ')'
+    sql = (
+        f"INSERT INTO {table} ({key}, {', '.join(columns)}) VALUES {', '.join([row_placeholders] * len(rows))} "
+        f"ON CONFLICT ({key}) DO UPDATE SET {', '.join(f'{column} = EXCLUDED.{column}' for column in columns)} "
+        f"WHERE EXCLUDED.{timestamp} >= {table}.{timestamp}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _update_shadow(device_pk, field, state):
+    """合并设备影子的reported或desired（锁定影子行，不存在时创建）"""
+    now = timezone.now()
+    with transaction.atomic():
+        shadow, _ = DeviceShadow.objects.select_for_update().get_or_create(device_id=device_pk)
+        getattr(shadow, field).update(state)
+        setattr(shadow, f"{field}_at", now)
+        shadow.version += 1
+        shadow.save(update_fields=[field, f"{field}_at", 'version'])
+    return shadow
+
+
+def set_desired(device_pk, state):
+    """
+    记录平台下发的执行器命令值
+    :param device_pk: 设备主键
+    :param state: {command_key: 值}
+    :return: DeviceShadow
+    """
+    return _update_shadow(device_pk, 'desired', state)
+
+
+def set_reported(device_pk, state):
+    """
+    记录设备回报的执行器状态
+    :param device_pk: 设备主键
+    :param state: {command_key: 值}
+    :return: DeviceShadow
+    """
+    return _update_shadow(device_pk, 'reported', state)
+
+
+def project_current_values(project):
+    """
+    项目下所有设备的当前状态：设备状态、传感器最新值、设备影子
+    设备、传感器、最新值和影子通过LEFT JOIN一次查询取出
+    :return: 设备列表，每个设备包含sensors、reported、desired、delta
+    """
+    rows = project.devices.order_by('device_id', 'sensors__id').values_list(
+        'pk', 'device_id', 'name', 'status', 'last_seen',
+        'shadow__reported', 'shadow__desired', 'shadow__reported_at', 'shadow__desired_at', 'shadow__version',
+        'sensors__id', 'sensors__name', 'sensors__value_key', 'sensors__unit',
+        'sensors__latest_value__timestamp', 'sensors__latest_value__value_float',
+        'sensors__latest_value__value_string', 'sensors__latest_value__value_boolean',
+    )
+
+    devices = {}
+    for (pk, device_id, name, status, last_seen,
+         reported, desired, reported_at, desired_at, version,
+         sensor_id, sensor_name, value_key, unit,
+         timestamp, value_float, value_string, value_boolean) in rows:
+        device = devices.get(pk)
+        if device is None:
+            shadow = DeviceShadow(reported=reported or {}, desired=desired or {})
+            device = devices[pk] = {
+                'device_id': device_id,
+                'name': name,
+                'status': status,
+                'last_seen': last_seen.isoformat() if last_seen else None,
+                'sensors': [],
+                'reported': shadow.reported,
+                'desired': shadow.desired,
+                'delta': shadow.delta,
+                'reported_at': reported_at.isoformat() if reported_at else None,
+                'desired_at': desired_at.isoformat() if desired_at else None,
+                'version': version or 0,
+            }
+        if sensor_id is None:
+            continue
+
+        if value_float is not None:
+            value = value_float
+        elif value_string is not None:
+            value = value_string
+        else:
+            value = value_boolean
+        device['sensors'].append({
+            'id': sensor_id,
+            'name': sensor_name,
+            'value_key': value_key,
+            'unit': unit,
+            'value': value,
+            'timestamp': timestamp.isoformat() if timestamp else None,
+        })
+
+    return list(devices.values())
@@ -0,0 +1,69 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from . import view_cache
+from .cache import device_metadata_cache
+from .models import Actuator, Device, Project, Sensor
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def invalidate_device_metadata(sender, instance, **kwargs):
+    """设备变更时失效元数据缓存（device_id可能被修改，按主键和新device_id各失效一次）"""
+    device_metadata_cache.invalidate(device_id=instance.device_id, device_pk=instance.pk)
+
+
+@receiver(post_save, sender=Sensor)
+@receiver(post_delete, sender=Sensor)
+def invalidate_sensor_metadata(sender, instance, **kwargs):
+    """传感器变更时失效所属设备的元数据缓存"""
+    device_metadata_cache.invalidate(device_pk=instance.device_id)
+
+
+@receiver(post_init, sender=Device)
+def remember_device_project(sender, instance, **kwargs):
+    """记录加载时的所属项目，保存时据此判断设备是否移动到了其他项目"""
+    instance._loaded_project_id = instance.project_id
+
+
+@receiver(post_save, sender=Device)
+def invalidate_project_device_count(sender, instance, created, **kwargs):
+    """新建设备或设备移动到其他项目时失效项目设备数（状态等字段的更新不影响设备数）"""
+    previous = instance._loaded_project_id
+    if created or previous != instance.project_id:
+        view_cache.delete_keys(
+            view_cache.project_device_count_key(pk) for pk in {previous, instance.project_id} if pk is not None
+        )
+    instance._loaded_project_id = instance.project_id
+
+
+@receiver(post_delete, sender=Device)
+def invalidate_deleted_device_counts(sender, instance, **kwargs):
+    """删除设备时失效所属项目的设备数和设备自身的计数"""
+    view_cache.delete_keys([
+        view_cache.project_device_count_key(instance.project_id),
+        view_cache.device_counts_key(instance.pk),
+    ])
+
+
+@receiver(post_delete, sender=Project)
+def invalidate_deleted_project_counts(sender, instance, **kwargs):
+    view_cache.delete_keys([view_cache.project_device_count_key(instance.pk)])
+
+
+@receiver(post_save, sender=Sensor)
+@receiver(post_save, sender=Actuator)
+def invalidate_created_component_counts(sender, instance, created, **kwargs):
+    """新建传感器或执行器时失效设备的计数"""
+    if created:
+        view_cache.delete_keys([view_cache.device_counts_key(instance.device_id)])
+
+
+@receiver(post_delete, sender=Sensor)
+@receiver(post_delete, sender=Actuator)
+def invalidate_deleted_component_counts(sender, instance, **kwargs):
+    """删除传感器或执行器时失效设备的计数，传感器还要失效最新值"""
+    keys = [view_cache.device_counts_key(instance.device_id)]
+    if sender is Sensor:
+        keys.append(view_cache.sensor_latest_key(instance.pk))
+    view_cache.delete_keys(keys)
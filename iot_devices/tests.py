@@ -1,3 +1,708 @@
-from django.test import TestCase
+import base64
+import gzip
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from core import codec, events
+from core.events import LocalEventBus
+from core.pagination import InvalidCursor, KeysetPaginator, decode_cursor, encode_cursor
+
+from strategy_engine.models import Action, Strategy, StrategyLog
+
+from . import export, rollups, shadow, timeseries, view_cache
+from .cache import DeviceMetadataCache, device_metadata_cache
+from .commands import acknowledge_command, is_command_response
+from .ingest import PendingReading, build_sensor_data, write_readings
+from .models import (
+    Actuator, ActuatorCommand, Device, DeviceShadow, Project, Sensor, SensorData, SensorLatestValue, SensorRollup,
+)
+from .realtime import realtime_publisher
+from .retention import RetentionEngine
+
+BASE_TIME = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class IoTTestMixin:
+    """创建测试用的项目、设备和传感器"""
+
+    @classmethod
+    def create_project(cls, project_id='PRJ-000001', owner=None):
+        if owner is None:
+            owner = get_user_model().objects.create_user(username=f"owner-{project_id}", password='x')
+        return Project.objects.create(project_id=project_id, name=project_id, owner=owner)
+
+    @classmethod
+    def create_device(cls, project, device_id='DEV-000001', **kwargs):
+        return Device.objects.create(
+            device_id=device_id, device_identifier=device_id, device_key='key', name=device_id,
+            project=project, **kwargs
+        )
+
+    @classmethod
+    def create_sensor(cls, device, value_key='temperature'):
+        return Sensor.objects.create(name=value_key, sensor_type=value_key, device=device, value_key=value_key)
+
+    @staticmethod
+    def create_data(sensor, timestamp, value):
+        """写入一条指定时间的数据（timestamp为auto_now_add，创建后再更新）"""
+        data = SensorData.objects.create(sensor=sensor, value_float=value)
+        SensorData.objects.filter(pk=data.pk).update(timestamp=timestamp)
+        data.timestamp = timestamp
+        return data
+
+
+class CursorTests(SimpleTestCase):
+    """分页游标编码"""
+
+    def test_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor(BASE_TIME, 42)), (BASE_TIME, 42))
+
+    def test_invalid_cursor(self):
+        for cursor in ('', '!!!', 'bm90LWEtY3Vyc29y', encode_cursor(BASE_TIME, 1)[:-4] + 'AAAA'):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidCursor):
+                    decode_cursor(cursor)
+
+    def test_tampered_pk(self):
+        cursor = base64.urlsafe_b64encode(f"{BASE_TIME.isoformat()}|1 OR 1=1".encode()).decode()
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(cursor)
+
+
+class KeysetPaginatorTests(IoTTestMixin, TestCase):
+    """游标分页"""
+
+    @classmethod
+    def setUpTestData(cls):
+        device = cls.create_device(cls.create_project())
+        sensor = cls.create_sensor(device)
+        # 每个时间点两条数据，测试(时间, 主键)相同时间的排序
+        cls.rows = []
+        for minute in range(4):
+            for value in range(2):
+                cls.rows.append(cls.create_data(sensor, BASE_TIME + timedelta(minutes=minute), minute * 10 + value))
+        # 按时间、主键倒序
+        cls.expected = [row.pk for row in sorted(cls.rows, key=lambda row: (row.timestamp, row.pk), reverse=True)]
+
+    def paginator(self, per_page=3):
+        return KeysetPaginator(SensorData.objects.all(), per_page)
+
+    def test_first_page(self):
+        page = self.paginator().page()
+        self.assertEqual([row.pk for row in page], self.expected[:3])
+        self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+
+    def test_walk_forward_across_equal_timestamps(self):
+        paginator = self.paginator()
+        page = paginator.page()
+        seen = [row.pk for row in page]
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            seen.extend(row.pk for row in page)
+        self.assertEqual(seen, self.expected)
+
+    def test_last_page(self):
+        paginator = self.paginator()
+        page = paginator.page(encode_cursor(self.rows[3].timestamp, self.rows[3].pk))
+        self.assertEqual([row.pk for row in page], self.expected[-3:])
+        self.assertFalse(page.has_next())
+        self.assertIsNone(page.next_cursor)
+        self.assertTrue(page.has_previous())
+
+    def test_walk_backward_from_last_page(self):
+        paginator = self.paginator()
+        last = paginator.page(encode_cursor(self.rows[3].timestamp, self.rows[3].pk))
+        page = paginator.page(last.previous_cursor, 'previous')
+        self.assertEqual([row.pk for row in page], self.expected[2:5])
+        page = paginator.page(page.previous_cursor, 'previous')
+        self.assertEqual([row.pk for row in page], self.expected[:2])
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+
+    def test_exact_multiple_has_no_empty_last_page(self):
+        paginator = self.paginator(per_page=4)
+        page = paginator.page(paginator.page().next_cursor)
+        self.assertEqual([row.pk for row in page], self.expected[4:])
+        self.assertFalse(page.has_next())
+
+    def test_tampered_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            self.paginator().page('not-a-cursor')
+
+    def test_count(self):
+        self.assertEqual(self.paginator().count, len(self.rows))
+
+
+class RollupTests(IoTTestMixin, TestCase):
+    """汇总表增量更新"""
+
+    @classmethod
+    def setUpTestData(cls):
+        device = cls.create_device(cls.create_project())
+        cls.sensor = cls.create_sensor(device)
+
+    def reading(self, seconds, value):
+        return self.create_data(self.sensor, BASE_TIME + timedelta(seconds=seconds), value)
+
+    def test_merge_into_existing_bucket(self):
+        rollups.record_readings([self.reading(0, 1.0), self.reading(10, 5.0)])
+        rollups.record_readings([self.reading(20, -2.0), self.reading(5, 9.0)])
+
+        minute = SensorRollup.objects.get(sensor=self.sensor, resolution='1m', bucket_start=BASE_TIME)
+        self.assertEqual(minute.count, 4)
+        self.assertEqual(minute.value_sum, 13.0)
+        self.assertEqual((minute.value_min, minute.value_max), (-2.0, 9.0))
+        # 最新值按数据时间而不是写入顺序
+        self.assertEqual((minute.last_value, minute.last_timestamp), (-2.0, BASE_TIME + timedelta(seconds=20)))
+        self.assertEqual(SensorRollup.objects.filter(sensor=self.sensor).count(), 3)
+
+    def test_only_matching_buckets_are_updated(self):
+        other = self.create_sensor(self.sensor.device, 'humidity')
+        rollups.record_readings([self.reading(0, 1.0), self.create_data(other, BASE_TIME + timedelta(minutes=1), 2.0)])
+        rollups.record_readings([self.reading(70, 3.0)])
+
+        # 传感器1的第二分钟和传感器2的第二分钟不能互相合并
+        self.assertEqual(SensorRollup.objects.get(sensor=other, resolution='1m').count, 1)
+        second_minute = BASE_TIME + timedelta(minutes=1)
+        self.assertEqual(
+            SensorRollup.objects.get(sensor=self.sensor, resolution='1m', bucket_start=second_minute).count, 1
+        )
+
+    def test_integrity_error_retries_once(self):
+        apply = rollups._apply
+        calls = []
+
+        def conflict_once(deltas):
+            calls.append(deltas)
+            if len(calls) == 1:
+                # 模拟并发写入先创建了同一个时间桶
+                apply({key: delta for key, delta in deltas.items() if key[1] == '1d'})
+                raise IntegrityError('duplicate key')
+            return apply(deltas)
+
+        with mock.patch.object(rollups, '_apply', side_effect=conflict_once):
+            self.assertEqual(rollups.record_readings([self.reading(0, 4.0)]), 3)
+
+        self.assertEqual(len(calls), 2)
+        # 第一次的写入随保存点回滚，重试后每个粒度各一行
+        self.assertEqual(
+            list(SensorRollup.objects.filter(sensor=self.sensor).order_by('resolution').values_list('resolution', 'count')),
+            [('1d', 1), ('1h', 1), ('1m', 1)],
+        )
+
+    def test_many_sensors_in_one_batch(self):
+        device = self.sensor.device
+        sensors = Sensor.objects.bulk_create([
+            Sensor(name=f's{i}', sensor_type='t', device=device, value_key=f's{i}') for i in range(400)
+        ])
+        timestamp = BASE_TIME + timedelta(seconds=30)
+        readings = SensorData.objects.bulk_create([
+            SensorData(sensor=sensor, value_float=float(i)) for i, sensor in enumerate(sensors)
+        ])
+        for reading in readings:
+            reading.timestamp = timestamp
+
+        # 1200个时间桶的条件拆分为多条查询，第二次写入合并到已有的行
+        self.assertEqual(rollups.record_readings(readings), 1200)
+        self.assertEqual(rollups.record_readings(readings), 1200)
+
+        self.assertEqual(SensorRollup.objects.filter(sensor__in=sensors).count(), 1200)
+        minute = SensorRollup.objects.get(sensor=sensors[399], resolution='1m')
+        self.assertEqual((minute.count, minute.value_sum), (2, 798.0))
+
+    def test_failure_keeps_raw_data(self):
+        with mock.patch.object(rollups, '_apply', side_effect=IntegrityError('duplicate key')):
+            with transaction.atomic():
+                reading = self.reading(0, 4.0)
+                with self.assertLogs('iot_devices.rollups', 'ERROR'):
+                    self.assertEqual(rollups.record_readings([reading]), 0)
+                # 外层事务仍然可用
+                self.assertTrue(SensorData.objects.filter(pk=reading.pk).exists())
+
+        self.assertTrue(SensorData.objects.filter(pk=reading.pk).exists())
+        self.assertFalse(SensorRollup.objects.filter(sensor=self.sensor).exists())
+
+
+class RetentionTests(IoTTestMixin, TestCase):
+    """数据保留清理"""
+
+    @classmethod
+    def setUpTestData(cls):
+        project = cls.create_project()
+        device = cls.create_device(project)
+        cls.sensor = cls.create_sensor(device)
+        strategy = Strategy.objects.create(name='高温', project=project, trigger_source_device=device)
+        action = Action.objects.create(strategy=strategy, action_type='notification')
+        cls.old = [cls.create_data(cls.sensor, BASE_TIME + timedelta(minutes=i), float(i)) for i in range(3)]
+        cls.create_data(cls.sensor, BASE_TIME + timedelta(days=10), 10.0)
+        StrategyLog.objects.bulk_create([
+            StrategyLog(strategy=strategy, sensor_data=data, action=action) for data in cls.old[:2]
+        ])
+
+    def setUp(self):
+        self.engine = RetentionEngine(defaults={'SENSOR_DATA_DAYS': 5}, chunk_sleep=0)
+        self.now = BASE_TIME + timedelta(days=10)
+
+    def test_dry_run_matches_delete_including_cascade(self):
+        (estimate,) = self.engine.run(dry_run=True, now=self.now)
+        self.assertEqual(estimate.rows, 3)
+        self.assertEqual(estimate.cascaded, {'strategy_engine.StrategyLog': 2})
+        self.assertEqual(SensorData.objects.filter(sensor=self.sensor).count(), 4)
+
+        (result,) = self.engine.run(now=self.now)
+        self.assertEqual((result.rows, result.cascaded), (estimate.rows, estimate.cascaded))
+        self.assertFalse(StrategyLog.objects.exists())
+
+    def test_dry_run_bytes_include_cascaded_tables(self):
+        sizes = {SensorData: 4000, StrategyLog: 200}
+        with mock.patch('iot_devices.retention.table_size', side_effect=sizes.get):
+            (estimate,) = self.engine.run(dry_run=True, now=self.now)
+        # 3/4的传感器数据 + 全部2条策略日志
+        self.assertEqual(estimate.bytes, 3000 + 200)
+
+
+class DownsampleAPITests(IoTTestMixin, TestCase):
+    """传感器数据降采样接口"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = cls.create_project()
+        cls.sensor = cls.create_sensor(cls.create_device(cls.project))
+
+    def setUp(self):
+        self.client.force_login(self.project.owner)
+        self.url = reverse('iot_devices:sensor_data_api', args=[self.sensor.pk])
+
+    def test_interval_too_small_for_period(self):
+        response = self.client.get(self.url, {'interval': '1s', 'period': '30d'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(timeseries.MAX_POINTS), response.json()['error'])
+
+    def test_interval_within_limit(self):
+        response = self.client.get(self.url, {'interval': '1h', 'period': '30d'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['interval'], 3600)
+
+    def test_auto_interval(self):
+        response = self.client.get(self.url, {'agg': 'max', 'period': '30d'})
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(30 * 86400 / response.json()['interval'], timeseries.MAX_POINTS)
+
+
+class ExportTests(IoTTestMixin, TestCase):
+    """设备数据流式导出"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = cls.create_project()
+        cls.device = cls.create_device(cls.project)
+        cls.sensor = cls.create_sensor(cls.device)
+        cls.other = cls.create_sensor(cls.device, 'humidity')
+        # 同一时间点的两条数据测试批次边界按(时间, 主键)续读
+        for index in range(7):
+            timestamp = BASE_TIME + timedelta(seconds=index // 2)
+            cls.create_data(cls.sensor if index % 2 else cls.other, timestamp, float(index))
+
+    def sensors(self):
+        return {sensor.id: sensor for sensor in self.device.sensors.all()}
+
+    def test_batches_cover_all_rows_in_order(self):
+        with mock.patch.object(export, 'ITERATOR_CHUNK_SIZE', 2):
+            rows = list(export.iter_rows([self.sensor.id, self.other.id], BASE_TIME))
+        self.assertEqual([value for _, _, value in rows], [float(index) for index in range(7)])
+
+    def test_async_export_matches_sync(self):
+        sensor_ids = [self.sensor.id, self.other.id]
+        for file_format, compress in (('csv', False), ('ndjson', False), ('csv', True)):
+            with self.subTest(file_format=file_format, compress=compress), \
+                    mock.patch.object(export, 'ITERATOR_CHUNK_SIZE', 3):
+                expected = b''.join(export.iter_export(
+                    export.iter_rows(sensor_ids), export.ExportWriter(file_format, self.sensors(), compress)
+                ))
+                writer = export.ExportWriter(file_format, self.sensors(), compress)
+
+                async def collect():
+                    return [chunk async for chunk in export.aiter_export(export.aiter_rows(sensor_ids), writer)]
+
+                self.assertEqual(b''.join(async_to_sync(collect)()), expected)
+
+        lines = gzip.decompress(expected).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], '\ufefftimestamp,sensor_id,sensor,value_key,value,unit')
+        self.assertEqual(len(lines), 8)
+
+    def test_export_view(self):
+        self.client.force_login(self.project.owner)
+        response = self.client.get(reverse('iot_devices:device_data_export_api', args=[self.device.device_id]),
+                                   {'sensors': str(self.sensor.id), 'start': BASE_TIME.isoformat(),
+                                    'file_format': 'ndjson'})
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['value'] for line in lines], [1.0, 3.0, 5.0])
+
+
+class AcknowledgeCommandTests(IoTTestMixin, TestCase):
+    """设备命令响应"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.device = cls.create_device(cls.create_project())
+        cls.relay = Actuator.objects.create(name='继电器', actuator_type='switch', device=cls.device,
+                                            command_key='relay')
+        cls.fan = Actuator.objects.create(name='风扇', actuator_type='switch', device=cls.device, command_key='fan')
+
+    def setUp(self):
+        device_metadata_cache.clear()
+        self.bus = LocalEventBus(record=True)
+        patcher = mock.patch.object(events, 'event_bus', self.bus)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def command(self, actuator, value, status='pending'):
+        return ActuatorCommand.objects.create(actuator=actuator, command_value=value, status=status)
+
+    def test_is_command_response(self):
+        self.assertTrue(is_command_response({'response': 'ok'}))
+        self.assertFalse(is_command_response({'temperature': 1}))
+        self.assertFalse(is_command_response(['response']))
+
+    def test_acknowledges_newest_unanswered_command(self):
+        older = self.command(self.relay, 'OFF')
+        ActuatorCommand.objects.filter(pk=older.pk).update(timestamp=BASE_TIME)
+        newest = self.command(self.relay, 'ON')
+        answered = self.command(self.fan, 'ON', status='success')
+        ActuatorCommand.objects.filter(pk=answered.pk).update(response_time=BASE_TIME)
+
+        count = acknowledge_command('DEV-000001', {
+            'response': 'ok', 'command': 'set', 'success': True, 'data': {'relay': 'ON', 'fan': 'OFF'},
+        })
+
+        self.assertEqual(count, 1)
+        newest.refresh_from_db()
+        older.refresh_from_db()
+        self.assertEqual(newest.status, 'success')
+        self.assertIsNotNone(newest.response_time)
+        self.assertEqual(older.status, 'pending')
+        # 执行器状态和设备影子按回报值更新，即使没有匹配的命令记录
+        self.relay.refresh_from_db()
+        self.fan.refresh_from_db()
+        self.assertEqual((self.relay.current_state, self.fan.current_state), ('ON', 'OFF'))
+        self.assertEqual(DeviceShadow.objects.get(device=self.device).reported, {'relay': 'ON', 'fan': 'OFF'})
+
+        [(event_type, payload)] = self.bus.published
+        self.assertEqual(event_type, events.COMMAND_ACKED)
+        self.assertEqual(payload, {
+            'device_id': 'DEV-000001',
+            'command': 'set',
+            'response': 'ok',
+            'success': True,
+            'command_ids': [newest.pk],
+            'actuator_ids': [self.relay.pk],
+            'timestamp': newest.response_time.isoformat(),
+        })
+
+    def test_failed_response(self):
+        command = self.command(self.relay, 'ON')
+        self.relay.current_state = 'OFF'
+        self.relay.save()
+
+        self.assertEqual(acknowledge_command('DEV-000001', {
+            'response': 'error', 'success': False, 'data': {'relay': 'ON'},
+        }), 1)
+
+        command.refresh_from_db()
+        self.relay.refresh_from_db()
+        self.assertEqual(command.status, 'failed')
+        self.assertEqual(self.relay.current_state, 'OFF')
+        self.assertFalse(DeviceShadow.objects.filter(device=self.device).exists())
+        self.assertEqual(self.bus.published[0][1]['success'], False)
+
+    def test_response_without_data(self):
+        self.command(self.relay, 'ON')
+        self.assertEqual(acknowledge_command('DEV-000001', {'response': 'ok'}), 0)
+        self.assertEqual(self.bus.published[0][1]['command_ids'], [])
+
+    def test_unknown_device(self):
+        self.assertEqual(acknowledge_command('DEV-999999', {'response': 'ok'}), 0)
+        self.assertEqual(self.bus.published, [])
+
+
+class LatestValueTests(IoTTestMixin, TestCase):
+    """传感器最新值upsert和项目当前值"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = cls.create_project()
+        cls.device = cls.create_device(cls.project, status='online')
+        cls.sensor = cls.create_sensor(cls.device)
+        cls.other = cls.create_sensor(cls.device, 'humidity')
+
+    def reading(self, sensor, seconds, value):
+        return self.create_data(sensor, BASE_TIME + timedelta(seconds=seconds), value)
+
+    def latest(self, sensor):
+        return SensorLatestValue.objects.get(sensor=sensor)
+
+    def test_insert_and_newer_overwrites(self):
+        first = self.reading(self.sensor, 0, 1.0)
+        self.assertEqual(shadow.update_latest_values([first]), 1)
+        self.assertEqual((self.latest(self.sensor).sensor_data_id, self.latest(self.sensor).value_float),
+                         (first.pk, 1.0))
+
+        second = self.reading(self.sensor, 10, 2.0)
+        shadow.update_latest_values([second])
+        latest = self.latest(self.sensor)
+        self.assertEqual((latest.sensor_data_id, latest.value_float, latest.timestamp),
+                         (second.pk, 2.0, second.timestamp))
+
+    def test_older_batch_does_not_overwrite(self):
+        newer = self.reading(self.sensor, 10, 2.0)
+        shadow.update_latest_values([newer])
+        # 较早的批次后提交（并发写入或补传历史数据）
+        shadow.update_latest_values([self.reading(self.sensor, 5, 1.0), self.reading(self.other, 5, 50.0)])
+
+        self.assertEqual(self.latest(self.sensor).sensor_data_id, newer.pk)
+        self.assertEqual(self.latest(self.other).value_float, 50.0)
+
+    def test_batch_uses_newest_timestamp(self):
+        newest = self.reading(self.sensor, 20, 3.0)
+        shadow.update_latest_values([newest, self.reading(self.sensor, 10, 2.0)])
+        self.assertEqual(self.latest(self.sensor).sensor_data_id, newest.pk)
+
+    def test_value_types(self):
+        data = SensorData.objects.create(sensor=self.sensor, value_string='关')
+        shadow.update_latest_values([data])
+        latest = self.latest(self.sensor)
+        self.assertEqual((latest.value_float, latest.value_string, latest.value_boolean), (None, '关', None))
+
+    def test_project_current_values(self):
+        shadow.update_latest_values([self.reading(self.sensor, 0, 21.5)])
+        shadow.set_desired(self.device.pk, {'relay': 'ON'})
+        shadow.set_reported(self.device.pk, {'relay': 'OFF'})
+        self.create_device(self.project, 'DEV-000002')
+
+        devices = shadow.project_current_values(self.project)
+
+        self.assertEqual([device['device_id'] for device in devices], ['DEV-000001', 'DEV-000002'])
+        first, empty = devices
+        self.assertEqual(first['status'], 'online')
+        self.assertEqual([(sensor['id'], sensor['value']) for sensor in first['sensors']],
+                         [(self.sensor.pk, 21.5), (self.other.pk, None)])
+        self.assertEqual(first['sensors'][0]['timestamp'], BASE_TIME.isoformat())
+        self.assertIsNone(first['sensors'][1]['timestamp'])
+        self.assertEqual((first['desired'], first['reported'], first['delta']),
+                         ({'relay': 'ON'}, {'relay': 'OFF'}, {'relay': 'ON'}))
+        self.assertEqual(first['version'], 2)
+
+        # 没有传感器和设备影子的设备
+        self.assertEqual(empty['sensors'], [])
+        self.assertEqual((empty['reported'], empty['desired'], empty['delta']), ({}, {}, {}))
+        self.assertEqual((empty['reported_at'], empty['desired_at'], empty['version']), (None, None, 0))
+
+    def test_project_current_values_api(self):
+        self.client.force_login(self.project.owner)
+        response = self.client.get(reverse('iot_devices:project_current_values_api', args=[self.project.project_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['devices'][0]['device_id'], 'DEV-000001')
+
+        other_owner = get_user_model().objects.create_user(username='other', password='x')
+        self.client.force_login(other_owner)
+        response = self.client.get(reverse('iot_devices:project_current_values_api', args=[self.project.project_id]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ViewCacheTests(IoTTestMixin, TestCase):
+    """页面数据缓存及其信号失效"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = cls.create_project()
+        cls.other_project = cls.create_project('PRJ-000002', owner=cls.project.owner)
+        cls.device = cls.create_device(cls.project)
+        cls.sensor = cls.create_sensor(cls.device)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_project_device_counts_cached(self):
+        self.assertEqual(view_cache.project_device_counts([self.project.pk, self.other_project.pk]),
+                         {self.project.pk: 1, self.other_project.pk: 0})
+        with self.assertNumQueries(0):
+            view_cache.project_device_counts([self.project.pk, self.other_project.pk])
+
+    def test_device_moved_between_projects(self):
+        view_cache.project_device_counts([self.project.pk, self.other_project.pk])
+
+        device = Device.objects.get(pk=self.device.pk)
+        device.project = self.other_project
+        device.save()
+
+        self.assertEqual(view_cache.project_device_counts([self.project.pk, self.other_project.pk]),
+                         {self.project.pk: 0, self.other_project.pk: 1})
+
+    def test_status_update_keeps_device_count(self):
+        view_cache.project_device_counts([self.project.pk])
+        device = Device.objects.get(pk=self.device.pk)
+        device.status = 'online'
+        device.save()
+        self.assertIn(view_cache.project_device_count_key(self.project.pk), cache)
+
+    def test_component_counts(self):
+        self.assertEqual(view_cache.device_component_counts([self.device.pk]),
+                         {self.device.pk: {'sensors': 1, 'actuators': 0}})
+        Actuator.objects.create(name='继电器', actuator_type='switch', device=self.device, command_key='relay')
+        self.create_sensor(self.device, 'humidity').delete()
+        self.assertEqual(view_cache.device_component_counts([self.device.pk]),
+                         {self.device.pk: {'sensors': 1, 'actuators': 1}})
+
+    def test_sensor_delete_invalidates_latest_value(self):
+        view_cache.latest_sensor_values([self.sensor.pk])
+        self.assertIn(view_cache.sensor_latest_key(self.sensor.pk), cache)
+        pk = self.sensor.pk
+        Sensor.objects.get(pk=pk).delete()
+        self.assertNotIn(view_cache.sensor_latest_key(pk), cache)
+
+    def test_ingest_invalidates_latest_value(self):
+        self.assertEqual(view_cache.latest_sensor_values([self.sensor.pk]), {self.sensor.pk: {}})
+        newer = self.create_data(self.sensor, BASE_TIME + timedelta(minutes=1), 2.0)
+        older = self.create_data(self.sensor, BASE_TIME, 1.0)
+        shadow.update_latest_values([newer])
+        view_cache.invalidate_latest_values([newer])
+        # 较旧的批次后完成时也不会覆盖缓存中的新值
+        shadow.update_latest_values([older])
+        view_cache.invalidate_latest_values([older])
+
+        latest = view_cache.latest_sensor_values([self.sensor.pk])[self.sensor.pk]
+        self.assertEqual((latest['timestamp'], latest['value_float']), (newer.timestamp, 2.0))
+
+
+class DeviceMetadataCacheTests(IoTTestMixin, TestCase):
+    """数据接入使用的进程内设备元数据缓存"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.device = cls.create_device(cls.create_project())
+        cls.sensor = cls.create_sensor(cls.device)
+
+    def test_hit(self):
+        metadata = DeviceMetadataCache()
+        meta = metadata.get('DEV-000001')
+        self.assertEqual((meta.pk, [sensor.value_key for sensor in meta.sensors]), (self.device.pk, ['temperature']))
+        with self.assertNumQueries(0):
+            self.assertEqual(metadata.get('DEV-000001'), meta)
+
+    def test_missing_device_cached_briefly(self):
+        metadata = DeviceMetadataCache(ttl=300, missing_ttl=5)
+        with mock.patch('iot_devices.cache.time.monotonic', return_value=100.0):
+            self.assertIsNone(metadata.get('DEV-000002'))
+            with self.assertNumQueries(0):
+                self.assertIsNone(metadata.get('DEV-000002'))
+
+        # 其他进程新建的设备在missing_ttl之后即可接入
+        self.create_device(self.device.project, 'DEV-000002')
+        with mock.patch('iot_devices.cache.time.monotonic', return_value=106.0):
+            self.assertEqual(metadata.get('DEV-000002').device_id, 'DEV-000002')
+
+    def test_missing_device_not_cached(self):
+        metadata = DeviceMetadataCache(missing_ttl=0)
+        self.assertIsNone(metadata.get('DEV-000002'))
+        with self.assertNumQueries(1):
+            self.assertIsNone(metadata.get('DEV-000002'))
+
+    def test_invalidate_during_load_is_not_overwritten(self):
+        metadata = DeviceMetadataCache()
+        load = metadata._load
+
+        def load_then_invalidate(device_ids):
+            loaded = load(device_ids)
+            # 加载返回后、写回缓存前，另一个线程处理了传感器变更信号
+            metadata.invalidate(device_pk=self.device.pk)
+            return loaded
+
+        with mock.patch.object(metadata, '_load', side_effect=load_then_invalidate):
+            self.assertEqual(len(metadata.get('DEV-000001').sensors), 1)
+
+        self.create_sensor(self.device, 'humidity')
+        self.assertEqual(len(metadata.get('DEV-000001').sensors), 2)
+
+    def test_signals_invalidate_global_cache(self):
+        device_metadata_cache.clear()
+        self.assertEqual(len(device_metadata_cache.get('DEV-000001').sensors), 1)
+        self.create_sensor(self.device, 'humidity')
+        self.assertEqual(len(device_metadata_cache.get('DEV-000001').sensors), 2)
+
+        device = Device.objects.get(pk=self.device.pk)
+        device.device_id = 'DEV-000009'
+        device.save()
+        self.assertIsNone(device_metadata_cache.get('DEV-000001'))
+        self.assertEqual(device_metadata_cache.get('DEV-000009').pk, self.device.pk)
+
+
+class BuildSensorDataTests(SimpleTestCase):
+    """按值的类型构造SensorData"""
+
+    def fields(self, value):
+        sensor_data = build_sensor_data(1, value)
+        return sensor_data.value_float, sensor_data.value_string, sensor_data.value_boolean
+
+    def test_types(self):
+        self.assertEqual(self.fields(True), (None, None, True))
+        self.assertEqual(self.fields(False), (None, None, False))
+        self.assertEqual(self.fields(3), (3.0, None, None))
+        self.assertEqual(self.fields(2.5), (2.5, None, None))
+        self.assertEqual(self.fields('ON'), (None, 'ON', None))
+        self.assertIsInstance(self.fields(3)[0], float)
+
+
+class WriteReadingsTests(IoTTestMixin, TestCase):
+    """与协议无关的数据写入路径"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.device = cls.create_device(cls.create_project())
+        cls.temperature = cls.create_sensor(cls.device)
+        cls.switch = cls.create_sensor(cls.device, 'on')
+
+    def setUp(self):
+        device_metadata_cache.clear()
+        self.bus = LocalEventBus(record=True)
+        patcher = mock.patch.object(events, 'event_bus', self.bus)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(realtime_publisher, 'enabled', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reading_ingested(self):
+        now = timezone.now()
+        created, devices, _ = write_readings([
+            PendingReading('DEV-000001', {'temperature': 21.5, 'on': True, 'unknown': 1}, now),
+            PendingReading('DEV-999999', {'temperature': 1}, now),
+        ])
+        self.assertEqual((len(created), devices), (2, 1))
+
+        [(event_type, payload)] = self.bus.published
+        self.assertEqual(event_type, events.READING_INGESTED)
+        self.assertEqual(payload['device_ids'], ['DEV-000001'])
+        self.assertEqual(
+            [(reading['id'], reading['timestamp']) for reading in payload['readings']],
+            [(sensor_data.pk, sensor_data.timestamp.isoformat()) for sensor_data in created],
+        )
+        self.assertEqual(
+            sorted((reading['sensor_id'], reading['device_id'], reading['value']) for reading in payload['readings']),
+            [(self.temperature.pk, 'DEV-000001', 21.5), (self.switch.pk, 'DEV-000001', True)],
+        )
+        codec.dumps(payload)
+
+    def test_no_event_without_readings(self):
+        write_readings([PendingReading('DEV-000001', {'unknown': 1}, timezone.now())])
+        self.assertEqual(self.bus.published, [])
@@ -0,0 +1,187 @@
+import datetime
+import math
+
+from django.db.models import Avg, Count, Func, IntegerField, Max, Min
+from django.utils import timezone
+
+from .models import SensorData
+
+
+# 支持的时间范围
+PERIODS = {
+    '1h': datetime.timedelta(hours=1),
+    '12h': datetime.timedelta(hours=12),
+    '24h': datetime.timedelta(hours=24),
+    '7d': datetime.timedelta(days=7),
+    '30d': datetime.timedelta(days=30),
+}
+DEFAULT_PERIOD = '24h'
+
+# 支持的聚合方式
+AGGREGATES = ('avg', 'min', 'max', 'last')
+
+# 自动选择时间桶时的默认目标点数和上限
+DEFAULT_POINTS = 300
+MAX_POINTS = 2000
+
+# 自动选择时间桶时使用的"整齐"间隔（秒）
+NICE_INTERVALS = (
+    1, 5, 10, 15, 30,
+    60, 2 * 60, 5 * 60, 10 * 60, 15 * 60, 30 * 60,
+    3600, 2 * 3600, 3 * 3600, 6 * 3600, 12 * 3600,
+    86400, 2 * 86400, 7 * 86400,
+)
+
+_INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_period(period):
+    """
+    解析时间范围参数，无效值回退到默认的24小时
+    :return: (规范化后的period, timedelta)
+    """
+    if period not in PERIODS:
+        period = DEFAULT_PERIOD
+    return period, PERIODS[period]
+
+
+def parse_interval(value):
+    """
+    解析时间桶间隔，例如"30s"、"5m"、"1h"、"1d"或纯秒数
+    :return: 间隔秒数；格式无效时抛出ValueError
+    """
+    value = str(value).strip().lower()
+    if value.isdigit():
+        seconds = int(value)
+    elif len(value) > 1 and value[-1] in _INTERVAL_UNITS and value[:-1].isdigit():
+        seconds = int(value[:-1]) * _INTERVAL_UNITS[value[-1]]
+    else:
+        raise ValueError(f"无效的时间间隔: {value}")
+
+    if seconds <= 0:
+        raise ValueError(f"无效的时间间隔: {value}")
+    return seconds
+
+
+def check_interval(span, interval):
+    """
+    检查指定的时间桶间隔在时间跨度内产生的桶数不超过MAX_POINTS
+    :param span: timedelta时间跨度
+    :param interval: 间隔秒数
+    :raises ValueError: 时间桶过多
+    """
+    buckets = math.ceil(span.total_seconds() / interval)
+    if buckets > MAX_POINTS:
+        raise ValueError(f"时间间隔 {interval}s 过小，时间范围内将产生 {buckets} 个时间桶（上限 {MAX_POINTS}）")
+
+
+def auto_interval(span, points=DEFAULT_POINTS):
+    """
+    根据时间跨度和目标点数选择时间桶间隔
+    :param span: timedelta时间跨度
+    :param points: 目标点数
+    :return: 间隔秒数（取不小于理想值的整齐间隔）
+    """
+    points = max(1, min(int(points), MAX_POINTS))
+    ideal = math.ceil(span.total_seconds() / points)
+    for interval in NICE_INTERVALS:
+        if interval >= ideal:
+            return interval
+    return NICE_INTERVALS[-1]
+
+
+class EpochBucket(Func):
+    """
+    将时间字段按固定秒数对齐到时间桶起点（Unix时间戳，秒）
+    用法: EpochBucket('timestamp', interval=300)
+    """
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='(CAST((julianday(%(expressions)s) - 2440587.5) * 86400.0 AS INTEGER) '
+                     '/ %(interval)d * %(interval)d)',
+            **extra_context
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='(FLOOR(EXTRACT(EPOCH FROM %(expressions)s) / %(interval)d) * %(interval)d)::bigint',
+            **extra_context
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='(FLOOR(UNIX_TIMESTAMP(%(expressions)s) / %(interval)d) * %(interval)d)',
+            **extra_context
+        )
+
+
+def bucket_start(epoch_seconds):
+    """时间桶起点（Unix时间戳）转换为带时区的datetime"""
+    return datetime.datetime.fromtimestamp(epoch_seconds, tz=datetime.timezone.utc)
+
+
+def sensor_value(value_float, value_string, value_boolean):
+    """返回正确类型的传感器值（与SensorDataSerializer一致）"""
+    if value_float is not None:
+        return value_float
+    elif value_string is not None:
+        return value_string
+    elif value_boolean is not None:
+        return value_boolean
+    return None
+
+
+def downsample(sensor, start_time, end_time, interval, agg):
+    """
+    在数据库中按时间桶聚合传感器数据
+    :param interval: 时间桶间隔（秒）
+    :param agg: 聚合方式（avg/min/max/last），avg/min/max只对数值生效
+    :return: 列式数据 {'timestamp': [...], 'value': [...], 'count': [...]}
+    """
+    from . import rollups
+
+    # 数值聚合优先读取汇总表，汇总表无数据时回退到原始数据
+    result = rollups.downsample(sensor, start_time, end_time, interval, agg)
+    if result is not None:
+        return result
+
+    queryset = SensorData.objects.filter(
+        sensor=sensor,
+        timestamp__gte=start_time,
+        timestamp__lte=end_time,
+    ).annotate(
+        bucket=EpochBucket('timestamp', interval=interval)
+    ).values('bucket').order_by('bucket')
+
+    if agg == 'last':
+        # 数据按时间顺序写入，桶内最大id即为最后一条
+        rows = list(queryset.annotate(count=Count('id'), last_id=Max('id')))
+        last_values = {
+            pk: sensor_value(value_float, value_string, value_boolean)
+            for pk, value_float, value_string, value_boolean in SensorData.objects.filter(
+                id__in=[row['last_id'] for row in rows]
+            ).values_list('id', 'value_float', 'value_string', 'value_boolean')
+        }
+        values = [last_values.get(row['last_id']) for row in rows]
+    else:
+        aggregate = {'avg': Avg, 'min': Min, 'max': Max}[agg]
+        rows = list(queryset.annotate(count=Count('id'), value=aggregate('value_float')))
+        values = [row['value'] for row in rows]
+
+    return {
+        'timestamp': [bucket_start(row['bucket']).isoformat() for row in rows],
+        'value': values,
+        'count': [row['count'] for row in rows],
+    }
+
+
+def time_range(period):
+    """根据时间范围参数计算起止时间"""
+    period, span = parse_period(period)
+    now = timezone.now()
+    return period, now - span, now
@@ -36,6 +36,10 @@ urlpatterns = [
     
     # API URLs
     path('api/sensors/<int:sensor_id>/data/', api_views.SensorDataAPIView.as_view(), name='sensor_data_api'),
+    path('api/sensors/<int:sensor_id>/records/', api_views.SensorDataRecordsAPIView.as_view(), name='sensor_data_records_api'),
+    path('api/devices/<str:device_id>/export/', api_views.DeviceDataExportAPIView.as_view(), name='device_data_export_api'),
+    path('api/projects/<str:project_id>/current/', api_views.ProjectCurrentValuesAPIView.as_view(), name='project_current_values_api'),
     path('api/actuators/<int:actuator_id>/', api_views.ActuatorDetailAPIView.as_view(), name='actuator_detail_api'),
+    path('api/actuators/<int:actuator_id>/records/', api_views.ActuatorRecordsAPIView.as_view(), name='actuator_records_api'),
     path('api/actuators/<int:pk>/control/', views.control_actuator, name='control_actuator'),
 ] 
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""
+页面数据缓存（Django缓存框架，生产环境为Redis，各进程共享）
+
+- 项目的设备数、设备的传感器/执行器数：模型保存和删除时由信号失效
+- 传感器最新值：未命中时读取SensorLatestValue表，数据接入写入每批数据后和传感器删除时失效
+缓存不可用时回退到数据库查询，不影响页面和数据接入。
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import Actuator, Device, Sensor, SensorLatestValue
+
+logger = logging.getLogger(__name__)
+
+
+def _ttl(name, default=300):
+    return getattr(settings, 'VIEW_CACHE_CONFIG', {}).get(name, default)
+
+
+def project_device_count_key(project_pk):
+    return f"iot:project:{project_pk}:device_count"
+
+
+def device_counts_key(device_pk):
+    return f"iot:device:{device_pk}:counts"
+
+
+def sensor_latest_key(sensor_pk):
+    return f"iot:sensor:{sensor_pk}:latest"
+
+
+def _get_many(keys):
+    """批量读取缓存，缓存不可用时视为全部未命中"""
+    try:
+        return cache.get_many(keys)
+    except Exception as e:
+        logger.warning(f"读取缓存失败: {str(e)}")
+        return {}
+
+
+def _set_many(values, timeout):
+    try:
+        cache.set_many(values, timeout)
+    except Exception as e:
+        logger.warning(f"写入缓存失败: {str(e)}")
+
+
+def delete_keys(keys):
+    """删除缓存键（信号接收者和数据接入使用）"""
+    keys = list(keys)
+    if not keys:
+        return
+    try:
+        cache.delete_many(keys)
+    except Exception as e:
+        logger.warning(f"删除缓存失败: {str(e)}")
+
+
+def _cached_many(pks, key_func, load, timeout):
+    """
+    按主键批量读取缓存，未命中的主键用load(missing_pks)一次加载并写回
+    :return: {主键: 值}
+    """
+    pks = list(dict.fromkeys(pks))
+    if not pks:
+        return {}
+
+    keys = {key_func(pk): pk for pk in pks}
+    cached = _get_many(list(keys))
+    result = {keys[key]: value for key, value in cached.items()}
+
+    missing = [pk for pk in pks if pk not in result]
+    if missing:
+        loaded = load(missing)
+        result.update(loaded)
+        _set_many({key_func(pk): loaded[pk] for pk in missing}, timeout)
+    return result
+
+
+def project_device_counts(project_pks):
+    """
+    项目的设备数
+    :return: {项目主键: 设备数}
+    """
+    def load(missing):
+        counts = dict(
+            Device.objects.filter(project_id__in=missing)
+            .values('project_id').annotate(count=Count('id')).values_list('project_id', 'count')
+        )
+        return {pk: counts.get(pk, 0) for pk in missing}
+
+    return _cached_many(project_pks, project_device_count_key, load, _ttl('COUNTS_TTL'))
+
+
+def device_component_counts(device_pks):
+    """
+    设备的传感器数和执行器数
+    :return: {设备主键: {'sensors': 数量, 'actuators': 数量}}
+    """
+    def load(missing):
+        result = {pk: {'sensors': 0, 'actuators': 0} for pk in missing}
+        for field, model in (('sensors', Sensor), ('actuators', Actuator)):
+            rows = model.objects.filter(device_id__in=missing).values('device_id').annotate(count=Count('id'))
+            for row in rows.values_list('device_id', 'count'):
+                result[row[0]][field] = row[1]
+        return result
+
+    return _cached_many(device_pks, device_counts_key, load, _ttl('COUNTS_TTL'))
+
+
+def _latest_entry(sensor_data):
+    """缓存的最新值：时间和原始值字段（没有数据的传感器缓存为空字典），参数为SensorLatestValue"""
+    return {
+        'timestamp': sensor_data.timestamp,
+        'value_float': sensor_data.value_float,
+        'value_string': sensor_data.value_string,
+        'value_boolean': sensor_data.value_boolean,
+    }
+
+
+def latest_sensor_values(sensor_pks):
+    """
+    传感器的最新读数
+    :return: {传感器主键: {'timestamp', 'value_float', 'value_string', 'value_boolean'}}，没有数据时为空字典
+    """
+    def load(missing):
+        result = {pk: {} for pk in missing}
+        for latest in SensorLatestValue.objects.filter(sensor_id__in=missing):
+            result[latest.sensor_id] = _latest_entry(latest)
+        return result
+
+    return _cached_many(sensor_pks, sensor_latest_key, load, _ttl('LATEST_VALUE_TTL'))
+
+
+def invalidate_latest_values(created):
+    """
+    数据接入写入一批数据后失效这些传感器的最新值缓存（一次delete_many）
+    不直接写入新值：多个写入进程并发时后写入缓存的不一定是更新的数据，
+    下次读取时从SensorLatestValue表加载（该表的upsert不会让最新值倒退）
+    :param created: 已写入的SensorData列表
+    """
+    if not created:
+        return
+    delete_keys({sensor_latest_key(sensor_data.sensor_id) for sensor_data in created})
@@ -10,13 +10,15 @@ from django.utils import timezone
 
 from .models import Project, Device, Sensor, Actuator, SensorData, ActuatorData, ActuatorCommand
 from .forms import ProjectForm, DeviceForm, SensorForm, ActuatorForm
+from . import rollups, shadow, view_cache
 
 import uuid
 import json
 import logging
 
-# 导入获取下级用户ID列表的工具函数
-from admin_panel.utils import get_subordinate_user_ids
+# 导入获取下级用户ID列表、角色权限判断的工具函数
+from admin_panel.utils import get_subordinate_user_ids, is_role_admin
+from core.pagination import KeysetPaginationMixin
 
 logger = logging.getLogger(__name__)
 
@@ -39,18 +41,28 @@ class ProjectListView(LoginRequiredMixin, ListView):
         
         # 超级管理员可查看所有项目
         if user.is_superuser:
-            return Project.objects.all()
+            return Project.objects.select_related('owner')
         
         # 检查用户是否为管理员（有某种管理角色）
-        is_admin = hasattr(user, 'profile') and user.profile.role and user.profile.role.permissions.exists()
+        is_admin = is_role_admin(user)
         
         # 如果是管理员，可以查看自己和下级用户的项目
         if is_admin:
             user_ids = get_subordinate_user_ids(user)
-            return Project.objects.filter(owner__id__in=user_ids)
+            return Project.objects.filter(owner__id__in=user_ids).select_related('owner')
         
         # 普通用户只能查看自己的项目
-        return Project.objects.filter(owner=user)
+        return Project.objects.filter(owner=user).select_related('owner')
+    
+    def get_context_data(self, **kwargs):
+        """添加各项目的设备数（来自缓存）"""
+        context = super().get_context_data(**kwargs)
+        projects = list(context['projects'])
+        device_counts = view_cache.project_device_counts(project.pk for project in projects)
+        for project in projects:
+            project.device_count = device_counts[project.pk]
+        context['projects'] = context['object_list'] = projects
+        return context
 
 
 class ProjectDetailView(LoginRequiredMixin, DetailView):
@@ -61,7 +73,7 @@ class ProjectDetailView(LoginRequiredMixin, DetailView):
     
     def get_object(self):
         """获取项目，确保用户有权限"""
-        project = get_object_or_404(Project, project_id=self.kwargs['project_id'])
+        project = get_object_or_404(Project.objects.select_related('owner'), project_id=self.kwargs['project_id'])
         user = self.request.user
         
         # 超级管理员可以查看任何项目
@@ -69,11 +81,11 @@ class ProjectDetailView(LoginRequiredMixin, DetailView):
             return project
             
         # 如果用户是项目所有者，可以查看
-        if project.owner == user:
+        if project.owner_id == user.pk:
             return project
             
         # 检查用户是否为管理员
-        is_admin = hasattr(user, 'profile') and user.profile.role and user.profile.role.permissions.exists()
+        is_admin = is_role_admin(user)
         
         # 如果是管理员，检查项目所有者是否为该管理员的下级用户
         if is_admin:
@@ -84,9 +96,14 @@ class ProjectDetailView(LoginRequiredMixin, DetailView):
         raise HttpResponseForbidden("您没有权限访问此项目")
     
     def get_context_data(self, **kwargs):
-        """添加项目设备列表到上下文"""
+        """添加项目设备列表和各设备的传感器/执行器数（来自缓存）到上下文"""
         context = super().get_context_data(**kwargs)
-        context['devices'] = Device.objects.filter(project=self.object)
+        devices = list(Device.objects.filter(project=self.object))
+        counts = view_cache.device_component_counts(device.pk for device in devices)
+        for device in devices:
+            device.sensor_count = counts[device.pk]['sensors']
+            device.actuator_count = counts[device.pk]['actuators']
+        context['devices'] = devices
         return context
 
 
@@ -170,7 +187,7 @@ class DeviceDetailView(LoginRequiredMixin, DetailView):
     
     def get_object(self):
         """获取设备，确保用户有权限"""
-        device = get_object_or_404(Device, device_id=self.kwargs['device_id'])
+        device = get_object_or_404(Device.objects.select_related('project'), device_id=self.kwargs['device_id'])
         user = self.request.user
         
         # 超级管理员可以查看任何设备
@@ -178,16 +195,16 @@ class DeviceDetailView(LoginRequiredMixin, DetailView):
             return device
             
         # 如果用户是设备所属项目的所有者，可以查看
-        if device.project.owner == user:
+        if device.project.owner_id == user.pk:
             return device
             
         # 检查用户是否为管理员
-        is_admin = hasattr(user, 'profile') and user.profile.role and user.profile.role.permissions.exists()
+        is_admin = is_role_admin(user)
         
         # 如果是管理员，检查设备所属项目的所有者是否为该管理员的下级用户
         if is_admin:
             user_ids = get_subordinate_user_ids(user)
-            if device.project.owner.id in user_ids:
+            if device.project.owner_id in user_ids:
                 return device
         
         raise HttpResponseForbidden("您没有权限访问此设备")
@@ -195,7 +212,11 @@ class DeviceDetailView(LoginRequiredMixin, DetailView):
     def get_context_data(self, **kwargs):
         """添加设备的传感器和执行器到上下文"""
         context = super().get_context_data(**kwargs)
-        context['sensors'] = Sensor.objects.filter(device=self.object)
+        sensors = list(Sensor.objects.filter(device=self.object))
+        latest_values = view_cache.latest_sensor_values(sensor.pk for sensor in sensors)
+        for sensor in sensors:
+            sensor.latest_data = latest_values[sensor.pk]
+        context['sensors'] = sensors
         context['actuators'] = Actuator.objects.filter(device=self.object)
         return context
 
@@ -419,6 +440,12 @@ class SensorDetailView(LoginRequiredMixin, DetailView):
         # 添加最近的传感器数据（最多10条）
         context['recent_data'] = SensorData.objects.filter(sensor=self.object).order_by('-timestamp')[:10]
         
+        # 添加数值统计摘要（来自汇总表）
+        context['rollup_summary'] = [
+            {'label': label, 'stats': rollups.summarize(self.object, span)}
+            for label, span in rollups.SUMMARY_WINDOWS
+        ]
+        
         return context
 
 
@@ -569,6 +596,7 @@ def control_actuator(request, pk):
                 # 更新执行器状态
                 actuator.current_state = str(value)
                 actuator.save()
+                shadow.set_desired(actuator.device_id, {actuator.command_key: value})
                 
                 # 更新命令状态
                 command_record.status = 'success'
@@ -627,7 +655,7 @@ def control_actuator(request, pk):
 
 
 # 传感器数据视图
-class SensorDataListView(LoginRequiredMixin, ListView):
+class SensorDataListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """传感器数据列表视图"""
     model = SensorData
     template_name = 'iot_devices/sensor_data_list.html'
@@ -681,7 +709,7 @@ class ActuatorDetailView(LoginRequiredMixin, DetailView):
 
 
 # 执行器数据视图
-class ActuatorDataListView(LoginRequiredMixin, ListView):
+class ActuatorDataListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """执行器数据列表视图"""
     model = ActuatorData
     template_name = 'iot_devices/actuator_data_list.html'
@@ -1,3 +1,9 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import LeaderLease
+
+
+@admin.register(LeaderLease)
+class LeaderLeaseAdmin(admin.ModelAdmin):
+    list_display = ('name', 'holder', 'expires_at', 'updated_at')
+    readonly_fields = ('name', 'holder', 'expires_at', 'updated_at')
@@ -0,0 +1,371 @@
+"""
+进程内MQTT 3.1.1 Broker
+
+用于离线开发、集成测试和压测，替代公共Broker：
+- 支持QoS 0/1（QoS 2的发布按协议完成握手，转发时降级为QoS 1）
+- 支持+/#通配符订阅、保留消息、遗嘱消息和心跳超时
+- 支持共享订阅（$share/<分组>/<过滤器>）：同一分组的订阅者轮流接收消息
+- 不保存会话：所有连接都按clean session处理，离线期间的消息不会保留
+不适合作为生产环境的Broker。
+"""
+import asyncio
+import logging
+import threading
+
+from . import packets
+
+logger = logging.getLogger(__name__)
+
+
+def topic_matches(topic_filter, topic):
+    """判断主题是否匹配订阅过滤器（支持+和#通配符）"""
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+
+    # $开头的系统主题不匹配以通配符开头的过滤器
+    if topic.startswith('$') and filter_levels[0] in ('+', '#'):
+        return False
+
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != '+' and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+SHARED_PREFIX = '$share/'
+
+
+def split_shared(topic_filter):
+    """
+    拆分共享订阅
+    :return: (分组, 主题过滤器)，普通订阅的分组为None
+    """
+    if not topic_filter.startswith(SHARED_PREFIX):
+        return None, topic_filter
+    group, _, inner = topic_filter[len(SHARED_PREFIX):].partition('/')
+    return group, inner
+
+
+def valid_topic_filter(topic_filter):
+    """检查订阅过滤器格式：#只能作为最后一级，通配符必须占据整级"""
+    group, topic_filter = split_shared(topic_filter)
+    if group is not None and (not group or '+' in group or '#' in group):
+        return False
+    if not topic_filter:
+        return False
+    levels = topic_filter.split('/')
+    for index, level in enumerate(levels):
+        if '#' in level and (level != '#' or index != len(levels) - 1):
+            return False
+        if '+' in level and level != '+':
+            return False
+    return True
+
+
+class BrokerSession:
+    """一个客户端连接"""
+
+    def __init__(self, client_id, writer, keepalive, will):
+        self.client_id = client_id
+        self.writer = writer
+        self.keepalive = keepalive
+        self.will = will
+        self.subscriptions = {}   # 主题过滤器 -> QoS
+        self._next_packet_id = 0
+
+    def next_packet_id(self):
+        self._next_packet_id = self._next_packet_id % 65535 + 1
+        return self._next_packet_id
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+
+class MQTTBroker:
+    """
+    asyncio实现的轻量MQTT Broker
+
+    authenticate为可选的认证函数 authenticate(client_id, username, password) -> bool，
+    在事件循环线程中调用，不能执行阻塞操作；为空时接受所有连接。
+    """
+
+    def __init__(self, host='127.0.0.1', port=1883, authenticate=None, max_packet_size=1024 * 1024):
+        """初始化Broker"""
+        self.host = host
+        self.port = port
+        self.authenticate = authenticate
+        self.max_packet_size = max_packet_size
+        self.server = None
+        self.sessions = {}   # client_id -> BrokerSession
+        self.retained = {}   # 主题 -> (载荷, QoS)
+        self._tasks = set()
+        self._subscribers = set()     # 有订阅的会话，转发消息时只遍历这些会话
+        self._share_counters = {}     # (分组, 过滤器) -> 轮询计数
+        self.stats = {
+            'connections_total': 0,
+            'connections_rejected': 0,
+            'messages_received': 0,
+            'messages_delivered': 0,
+        }
+
+    async def start(self):
+        """开始监听，port为0时由系统分配端口（启动后可从self.port读取）"""
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"MQTT Broker开始运行在 {self.host}:{self.port}")
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        """停止监听并断开所有客户端"""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for session in list(self.sessions.values()):
+            session.writer.close()
+        # 等待连接处理任务结束
+        tasks = [task for task in self._tasks if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info("MQTT Broker已停止")
+
+    async def handle_client(self, reader, writer):
+        """处理一个客户端连接：CONNECT握手后循环处理报文"""
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        session = None
+        clean_disconnect = False
+        try:
+            session = await self.handshake(reader, writer)
+            if session is None:
+                return
+
+            while True:
+                # 超过1.5倍心跳间隔没有收到任何报文时断开
+                timeout = session.keepalive * 1.5 if session.keepalive else None
+                packet_type, flags, body = await asyncio.wait_for(
+                    packets.read_packet(reader, self.max_packet_size), timeout
+                )
+                if packet_type == packets.DISCONNECT:
+                    clean_disconnect = True
+                    break
+                self.handle_packet(session, packet_type, flags, body)
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # Broker停止
+            pass
+        except asyncio.TimeoutError:
+            logger.info(f"MQTT客户端 {session.client_id if session else ''} 连接超时")
+        except packets.MQTTProtocolError as e:
+            logger.warning(f"MQTT报文格式错误，断开连接: {str(e)}")
+        except Exception as e:
+            logger.exception(f"处理MQTT客户端时出错: {str(e)}")
+        finally:
+            if session is not None and self.sessions.get(session.client_id) is session:
+                del self.sessions[session.client_id]
+                self._subscribers.discard(session)
+                # 非正常断开时发布遗嘱消息
+                if session.will and not clean_disconnect:
+                    will = session.will
+                    self.publish(will['topic'], will['payload'], will['qos'], will['retain'])
+            writer.close()
+            self._tasks.discard(task)
+
+    async def handshake(self, reader, writer):
+        """
+        处理CONNECT报文
+        :return: BrokerSession，连接被拒绝时返回None
+        """
+        packet_type, _, body = await asyncio.wait_for(packets.read_packet(reader, self.max_packet_size), 10)
+        if packet_type != packets.CONNECT:
+            raise packets.MQTTProtocolError("第一个报文必须是CONNECT")
+
+        connect = packets.parse_connect(body)
+        return_code = packets.CONNACK_ACCEPTED
+        if connect['protocol_level'] != packets.PROTOCOL_LEVEL:
+            return_code = packets.CONNACK_BAD_PROTOCOL
+        elif not connect['client_id'] and not connect['clean_session']:
+            return_code = packets.CONNACK_IDENTIFIER_REJECTED
+        elif self.authenticate is not None and not self.authenticate(
+                connect['client_id'], connect['username'], connect['password']):
+            return_code = packets.CONNACK_BAD_CREDENTIALS
+
+        writer.write(packets.encode_connack(return_code))
+        await writer.drain()
+        if return_code != packets.CONNACK_ACCEPTED:
+            self.stats['connections_rejected'] += 1
+            writer.close()
+            return None
+
+        client_id = connect['client_id'] or f"auto-{id(writer):x}"
+        # 同一client_id的旧连接被新连接接管
+        previous = self.sessions.get(client_id)
+        if previous is not None:
+            previous.writer.close()
+            self._subscribers.discard(previous)
+
+        session = BrokerSession(client_id, writer, connect['keepalive'], connect['will'])
+        self.sessions[client_id] = session
+        self.stats['connections_total'] += 1
+        logger.debug(f"MQTT客户端已连接: {client_id}")
+        return session
+
+    def handle_packet(self, session, packet_type, flags, body):
+        """处理CONNECT之后的控制报文"""
+        if packet_type == packets.PUBLISH:
+            topic, payload, qos, packet_id, retain, _ = packets.parse_publish(flags, body)
+            if qos == 1:
+                session.send(packets.encode_ack(packets.PUBACK, packet_id))
+            elif qos == 2:
+                session.send(packets.encode_ack(packets.PUBREC, packet_id))
+            self.stats['messages_received'] += 1
+            self.publish(topic, payload, qos, retain)
+
+        elif packet_type == packets.PUBREL:
+            session.send(packets.encode_ack(packets.PUBCOMP, packets.parse_packet_id(body)))
+
+        elif packet_type == packets.SUBSCRIBE:
+            packet_id, topics = packets.parse_subscribe(body)
+            return_codes = []
+            for topic_filter, qos in topics:
+                if not valid_topic_filter(topic_filter):
+                    return_codes.append(packets.SUBACK_FAILURE)
+                    continue
+                granted = min(qos, 1)
+                session.subscriptions[topic_filter] = granted
+                return_codes.append(granted)
+            if session.subscriptions:
+                self._subscribers.add(session)
+            session.send(packets.encode_suback(packet_id, return_codes))
+
+            # 发送匹配的保留消息（共享订阅不发送保留消息）
+            for topic_filter, qos in topics:
+                if topic_filter not in session.subscriptions or split_shared(topic_filter)[0] is not None:
+                    continue
+                for topic, (payload, retained_qos) in self.retained.items():
+                    if topic_matches(topic_filter, topic):
+                        self.deliver(session, topic, payload, min(retained_qos, qos, 1), retain=True)
+
+        elif packet_type == packets.UNSUBSCRIBE:
+            packet_id, topics = packets.parse_unsubscribe(body)
+            for topic_filter in topics:
+                session.subscriptions.pop(topic_filter, None)
+            if not session.subscriptions:
+                self._subscribers.discard(session)
+            session.send(packets.encode_ack(packets.UNSUBACK, packet_id))
+
+        elif packet_type == packets.PINGREQ:
+            session.send(packets.PINGRESP_PACKET)
+
+        elif packet_type in (packets.PUBACK, packets.PUBREC, packets.PUBCOMP):
+            # 转发给订阅者的消息不重发，确认无需处理
+            if packet_type == packets.PUBREC:
+                session.send(packets.encode_ack(packets.PUBREL, packets.parse_packet_id(body)))
+
+        else:
+            raise packets.MQTTProtocolError(f"不支持的报文类型: {packet_type}")
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """把消息转发给所有匹配的订阅者"""
+        if retain:
+            # 空载荷的保留消息表示删除该主题的保留消息
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None)
+
+        shared = {}
+        for session in list(self._subscribers):
+            granted = None
+            for topic_filter, sub_qos in session.subscriptions.items():
+                group, inner = split_shared(topic_filter)
+                if not topic_matches(inner, topic):
+                    continue
+                if group is None:
+                    # 多个过滤器匹配同一主题时只转发一次，使用最高的QoS
+                    granted = sub_qos if granted is None else max(granted, sub_qos)
+                else:
+                    shared.setdefault(topic_filter, []).append((session, sub_qos))
+            if granted is not None:
+                self.deliver(session, topic, payload, min(qos, granted, 1))
+
+        # 共享订阅的每个分组只转发给其中一个订阅者
+        for topic_filter, members in shared.items():
+            index = self._share_counters.get(topic_filter, -1) + 1
+            self._share_counters[topic_filter] = index
+            session, sub_qos = members[index % len(members)]
+            self.deliver(session, topic, payload, min(qos, sub_qos, 1))
+
+    def deliver(self, session, topic, payload, qos, retain=False):
+        packet_id = session.next_packet_id() if qos else None
+        session.send(packets.encode_publish(topic, payload, qos, packet_id, retain=retain))
+        self.stats['messages_delivered'] += 1
+
+
+class BrokerThread:
+    """在后台线程的事件循环中运行MQTTBroker，供同步代码（paho客户端、测试）使用"""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.loop = None
+        self._thread = None
+        self._started = threading.Event()
+        self._error = None
+
+    def start(self, timeout=5):
+        """启动并等待开始监听；端口被占用等错误会直接抛出"""
+        self._thread = threading.Thread(target=self._run, name='mqtt-broker', daemon=True)
+        self._thread.start()
+        self._started.wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.broker.start())
+        except Exception as e:
+            self._error = e
+            self._started.set()
+            return
+        self._started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self.broker.stop())
+            self.loop.close()
+
+    def stop(self, timeout=5):
+        if self.loop is not None and self._thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout)
+            self._thread = None
+
+
+_embedded_broker = None
+
+
+def start_embedded_broker(host='127.0.0.1', port=1883):
+    """
+    在当前进程中启动Broker（同一进程只启动一次）
+    :return: BrokerThread
+    """
+    global _embedded_broker
+    if _embedded_broker is None:
+        _embedded_broker = BrokerThread(MQTTBroker(host, port)).start()
+    return _embedded_broker
@@ -0,0 +1,287 @@
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from core.metrics import MESSAGES_DROPPED, WRITE_ERRORS
+from core.profiling import profiled
+from iot_devices.ingest import PendingReading, send_post_save_signals, write_readings
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+class SensorIngestWriter:
+    """
+    传感器数据批量写入器
+
+    解码线程只负责把解码后的读数放入队列，后台写入线程在达到批量大小
+    或时间阈值时统一落库：
+    - 所有SensorData通过一次bulk_create写入
+    - 本批涉及设备的last_seen/status合并为一条UPDATE
+    workers大于1时多个写入线程从同一队列取批次并发写入（各自使用独立的数据库连接）。
+    """
+
+    def __init__(self, batch_size=500, flush_interval=0.5, max_queue_size=10000, stats_interval=60,
+                 workers=1):
+        """初始化写入器"""
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats_interval = stats_interval
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=max_queue_size)
+
+        self._threads = []
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    @classmethod
+    def from_settings(cls):
+        """根据settings.MQTT_INGEST_CONFIG创建写入器"""
+        config = getattr(settings, 'MQTT_INGEST_CONFIG', {})
+        return cls(
+            batch_size=config.get('BATCH_SIZE', 500),
+            flush_interval=config.get('FLUSH_INTERVAL', 0.5),
+            max_queue_size=config.get('MAX_QUEUE_SIZE', 10000),
+            stats_interval=config.get('STATS_INTERVAL', 60),
+            workers=config.get('WRITER_THREADS', 1),
+        )
+
+    def _reset_stats(self):
+        """重置统计计数器"""
+        self.stats = {
+            'messages_received': 0,    # 进入队列的消息数
+            'messages_dropped': 0,     # 队列已满被丢弃的消息数
+            'readings_written': 0,     # 写入的SensorData行数
+            'devices_updated': 0,      # 更新状态的设备行数
+            'flush_count': 0,          # 成功的批量写入次数
+            'flush_errors': 0,         # 失败的批量写入次数
+            'flush_time_total': 0.0,   # 批量写入累计耗时（秒）
+            'flush_time_max': 0.0,     # 单次批量写入最大耗时（秒）
+            'last_flush_latency': 0.0, # 最近一批中最早消息从入队到落库的延迟（秒）
+        }
+        self._stats_started_at = time.monotonic()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        """启动后台写入线程"""
+        if self.running:
+            return
+        self._stop_event.clear()
+        self._threads = [
+            threading.Thread(target=self._run, args=(index == 0,), name=f'sensor-ingest-writer-{index}', daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(
+            f"传感器数据写入线程已启动，线程数: {self.workers}，批量大小: {self.batch_size}，"
+            f"刷新间隔: {self.flush_interval}s"
+        )
+
+    def stop(self, timeout=10):
+        """停止写入线程，并写入队列中剩余的数据（所有线程共用timeout秒）"""
+        if not self.running:
+            return
+        self._stop_event.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+
+        if self.running:
+            logger.warning(f"传感器数据写入线程未能在 {timeout}s 内写完，队列中还有 {self.queue.qsize()} 条消息")
+        else:
+            logger.info("传感器数据写入线程已停止")
+        self._threads = []
+
+    def submit(self, device_id, data):
+        """
+        提交一条已解码的设备数据消息
+        :return: 是否成功入队（队列已满时返回False）
+        """
+        try:
+            self.queue.put_nowait(PendingReading(device_id, data, time.monotonic()))
+        except queue.Full:
+            MESSAGES_DROPPED.inc(queue='mqtt_write')
+            with self._stats_lock:
+                self.stats['messages_dropped'] += 1
+            logger.warning(f"写入队列已满，丢弃设备 {device_id} 的数据")
+            return False
+
+        with self._stats_lock:
+            self.stats['messages_received'] += 1
+        return True
+
+    def get_stats(self):
+        """获取吞吐量和写入延迟统计"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+            elapsed = max(time.monotonic() - self._stats_started_at, 1e-9)
+
+        flush_count = stats['flush_count']
+        stats['queue_size'] = self.queue.qsize()
+        stats['readings_per_second'] = stats['readings_written'] / elapsed
+        stats['messages_per_second'] = stats['messages_received'] / elapsed
+        stats['flush_time_avg'] = stats['flush_time_total'] / flush_count if flush_count else 0.0
+        return stats
+
+    def _run(self, log_stats=True):
+        """写入线程主循环（只由第一个线程输出统计）"""
+        last_stats_log = time.monotonic()
+
+        while True:
+            batch = self._collect_batch()
+            if batch:
+                self.flush(batch)
+
+            if log_stats and self.stats_interval and time.monotonic() - last_stats_log >= self.stats_interval:
+                self._log_stats()
+                last_stats_log = time.monotonic()
+
+            if self._stop_event.is_set() and self.queue.empty():
+                break
+
+        close_old_connections()
+
+    def _collect_batch(self):
+        """从队列收集一批数据，直到达到批量大小或时间阈值"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    @profiled('ingest.flush')
+    def flush(self, batch):
+        """将一批读数写入数据库"""
+        started = time.monotonic()
+        close_old_connections()
+
+        try:
+            created, device_count, signals_sent = write_readings(batch)
+        except Exception as e:
+            WRITE_ERRORS.inc()
+            with self._stats_lock:
+                self.stats['flush_errors'] += 1
+            logger.exception(f"批量写入传感器数据时出错: {str(e)}")
+            return
+
+        finished = time.monotonic()
+        duration = finished - started
+        with self._stats_lock:
+            self.stats['readings_written'] += len(created)
+            self.stats['devices_updated'] += device_count
+            self.stats['flush_count'] += 1
+            self.stats['flush_time_total'] += duration
+            self.stats['flush_time_max'] = max(self.stats['flush_time_max'], duration)
+            self.stats['last_flush_latency'] = finished - min(item.received_at for item in batch)
+
+        logger.debug(f"批量写入 {len(created)} 条传感器数据，涉及 {device_count} 台设备，耗时 {duration * 1000:.1f}ms")
+
+        if not signals_sent:
+            send_post_save_signals(created)
+
+    def _log_stats(self):
+        """输出并重置统计信息"""
+        stats = self.get_stats()
+        if stats['messages_received'] or stats['messages_dropped']:
+            logger.info(
+                f"传感器数据写入统计: 消息 {stats['messages_received']} 条 "
+                f"({stats['messages_per_second']:.1f}/s)，写入 {stats['readings_written']} 条 "
+                f"({stats['readings_per_second']:.1f}/s)，丢弃 {stats['messages_dropped']} 条，"
+                f"批次 {stats['flush_count']} 次，平均耗时 {stats['flush_time_avg'] * 1000:.1f}ms，"
+                f"最大耗时 {stats['flush_time_max'] * 1000:.1f}ms，队列长度 {stats['queue_size']}"
+            )
+        with self._stats_lock:
+            self._reset_stats()
+
+
+class MessageDecoder:
+    """
+    MQTT消息解码线程
+
+    paho网络线程的on_message只把原始消息放入队列后立即返回，JSON解码、主题解析
+    和状态更新都在本线程中完成，避免解码耗时阻塞网络收发和心跳。
+    队列已满时丢弃新消息（QoS 1的消息此时已确认，不会重发）。
+    """
+
+    def __init__(self, handler, max_queue_size=10000):
+        """
+        初始化解码线程
+        :param handler: 处理一条原始消息的函数 handler(topic, payload)
+        :param max_queue_size: 原始消息队列上限
+        """
+        self.handler = handler
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动解码线程"""
+        if self.running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='mqtt-message-decoder', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """停止解码线程，并处理完队列中剩余的消息"""
+        if not self.running:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning(f"MQTT消息解码线程未能在 {timeout}s 内处理完，队列中还有 {self.queue.qsize()} 条消息")
+        self._thread = None
+
+    def submit(self, topic, payload):
+        """
+        提交一条原始消息（在paho网络线程中调用）
+        :return: 是否成功入队
+        """
+        try:
+            self.queue.put_nowait((topic, payload))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            MESSAGES_DROPPED.inc(queue='mqtt_decode')
+            logger.warning(f"解码队列已满，丢弃消息: {topic}")
+            return False
+
+    def _run(self):
+        """解码线程主循环"""
+        while True:
+            try:
+                topic, payload = self.queue.get(timeout=0.2)
+            except queue.Empty:
+                if self._stop_event.is_set():
+                    break
+                continue
+
+            try:
+                self.handler(topic, payload)
+            except Exception as e:
+                logger.exception(f"处理MQTT消息时出错: {str(e)}")
+
+        close_old_connections()
@@ -0,0 +1,172 @@
+import datetime
+import logging
+import os
+import socket
+import threading
+import uuid
+
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from iot_devices.models import ActuatorCommand
+
+from .models import LeaderLease
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElector:
+    """
+    基于数据库租约的领导者选举
+
+    每个进程每renew_interval秒尝试获取或续期租约，同一时刻最多一个进程持有未过期的租约。
+    - 获取：租约不存在时插入；已过期或由自己持有时用一条条件UPDATE接管
+    - 续期失败（数据库异常或租约被接管）时立即放弃领导者身份
+    - ttl应明显大于renew_interval，各主机时钟需要同步
+    成为领导者时调用on_elected，失去领导者身份时调用on_revoked（都在选举线程中调用）。
+    """
+
+    def __init__(self, name, ttl=15, renew_interval=5, on_elected=None, on_revoked=None):
+        """初始化选举器"""
+        self.name = name
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.on_elected = on_elected
+        self.on_revoked = on_revoked
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.is_leader = False
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def try_acquire(self):
+        """
+        尝试获取或续期租约
+        :return: 是否持有租约
+        """
+        now = timezone.now()
+        expires_at = now + datetime.timedelta(seconds=self.ttl)
+
+        updated = LeaderLease.objects.filter(name=self.name).filter(
+            Q(holder=self.holder) | Q(expires_at__lt=now)
+        ).update(holder=self.holder, expires_at=expires_at)
+        if updated:
+            return True
+
+        if LeaderLease.objects.filter(name=self.name).exists():
+            return False
+        try:
+            with transaction.atomic():
+                LeaderLease.objects.create(name=self.name, holder=self.holder, expires_at=expires_at)
+            return True
+        except IntegrityError:
+            # 其他进程同时插入了租约
+            return False
+
+    def release(self):
+        """主动释放租约，其他进程下一次尝试时即可接管"""
+        LeaderLease.objects.filter(name=self.name, holder=self.holder).update(expires_at=timezone.now())
+
+    def start(self):
+        """启动选举线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=f'leader-{self.name}', daemon=True)
+        self._thread.start()
+        logger.info(f"领导者选举已启动: {self.name}，持有者标识 {self.holder}")
+
+    def stop(self, timeout=5):
+        """停止选举线程并释放租约"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                acquired = self.try_acquire()
+            except DatabaseError as e:
+                logger.error(f"续期领导者租约时出错: {str(e)}")
+                acquired = False
+            finally:
+                close_old_connections()
+
+            if acquired != self.is_leader:
+                self._set_leader(acquired)
+
+            if self._stop_event.wait(self.renew_interval):
+                break
+
+        if self.is_leader:
+            self._set_leader(False)
+            try:
+                self.release()
+            except DatabaseError as e:
+                logger.error(f"释放领导者租约时出错: {str(e)}")
+            finally:
+                close_old_connections()
+
+    def _set_leader(self, is_leader):
+        self.is_leader = is_leader
+        callback = self.on_elected if is_leader else self.on_revoked
+        logger.info(f"{'成为' if is_leader else '不再是'} {self.name} 的领导者")
+        if callback is not None:
+            try:
+                callback()
+            except Exception as e:
+                logger.exception(f"执行领导者切换回调时出错: {str(e)}")
+
+
+class CommandTimeoutScheduler:
+    """
+    定期把超过timeout秒仍未收到设备响应的执行器命令标记为超时
+    只应在领导者进程中运行，避免多个进程重复扫描
+    """
+
+    def __init__(self, timeout, interval=30):
+        """
+        初始化调度器
+        :param timeout: 命令超时时间（秒）
+        :param interval: 扫描间隔（秒）
+        """
+        self.timeout = timeout
+        self.interval = interval
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='command-timeout', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def expire_pending(self):
+        """
+        标记超时命令
+        :return: 标记的命令数
+        """
+        cutoff = timezone.now() - datetime.timedelta(seconds=self.timeout)
+        count = ActuatorCommand.objects.filter(status='pending', timestamp__lt=cutoff).update(
+            status='timeout', response_message='设备未在规定时间内响应'
+        )
+        if count:
+            logger.info(f"已将 {count} 条执行器命令标记为超时")
+        return count
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.expire_pending()
+            except Exception as e:
+                logger.exception(f"标记超时命令时出错: {str(e)}")
+            finally:
+                close_old_connections()
@@ -0,0 +1,42 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from mqtt_client.broker import MQTTBroker
+
+
+class Command(BaseCommand):
+    help = '运行进程内MQTT 3.1.1 Broker（用于离线开发、集成测试和压测，不适合生产环境）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+        parser.add_argument('--port', type=int, default=1883, help='监听端口')
+        parser.add_argument('--stats-interval', type=float, default=60,
+                            help='统计信息输出间隔（秒），0表示不输出')
+
+    def handle(self, *args, **options):
+        broker = MQTTBroker(options['host'], options['port'])
+        try:
+            asyncio.run(self.serve(broker, options['stats_interval']))
+        except KeyboardInterrupt:
+            self.stdout.write("MQTT Broker已停止")
+
+    async def serve(self, broker, stats_interval):
+        await broker.start()
+        self.stdout.write(self.style.SUCCESS(f"MQTT Broker开始运行在 {broker.host}:{broker.port}"))
+        if stats_interval:
+            # 保存任务引用，避免被垃圾回收
+            self.report_task = asyncio.create_task(self.report(broker, stats_interval))
+        await broker.serve_forever()
+
+    async def report(self, broker, interval):
+        last_received = last_delivered = 0
+        while True:
+            await asyncio.sleep(interval)
+            stats = broker.stats
+            self.stdout.write(
+                f"连接 {len(broker.sessions)}，接收 {(stats['messages_received'] - last_received) / interval:.1f} 条/秒，"
+                f"转发 {(stats['messages_delivered'] - last_delivered) / interval:.1f} 条/秒，"
+                f"拒绝连接 {stats['connections_rejected']}"
+            )
+            last_received, last_delivered = stats['messages_received'], stats['messages_delivered']
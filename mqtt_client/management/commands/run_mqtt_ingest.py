@@ -0,0 +1,88 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.events import event_bus
+from core.metrics import start_snapshot_writer, stop_snapshot_writer
+from core.profiling import install_signal_handler, profiler
+from iot_devices.realtime import realtime_publisher
+from iot_devices.retention import start_retention_scheduler, stop_retention_scheduler
+from mqtt_client.leader import CommandTimeoutScheduler, LeaderElector
+from mqtt_client.mqtt import mqtt_client
+
+
+class Command(BaseCommand):
+    help = ('运行MQTT数据接入进程：订阅设备主题，解码后由写入线程池批量落库，'
+            '通过共享订阅与其他接入进程分摊设备消息，并选举一个领导者执行数据保留清理、命令超时标记等单实例任务')
+
+    def add_arguments(self, parser):
+        config = getattr(settings, 'MQTT_INGEST_CONFIG', {})
+        parser.add_argument('--group', default=config.get('SHARED_GROUP', 'novacloud-ingest'),
+                            help='共享订阅分组，同一分组的进程分摊消息')
+        parser.add_argument('--no-shared', action='store_true',
+                            help='不使用共享订阅（只运行一个接入进程，或Broker不支持$share时）')
+        parser.add_argument('--no-leader', action='store_true',
+                            help='不参与领导者选举，只接入数据')
+
+    def handle(self, *args, **options):
+        config = getattr(settings, 'MQTT_INGEST_CONFIG', {})
+        stop_event = threading.Event()
+
+        def handle_signal(signum, frame):
+            self.stdout.write("接收到终止信号，正在停止...")
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, handle_signal)
+        signal.signal(signal.SIGINT, handle_signal)
+        # SIGUSR1开启/关闭性能剖析
+        install_signal_handler('mqtt-ingest')
+
+        mqtt_client.shared_group = None if options['no_shared'] else options['group']
+
+        # 数据保留清理和命令超时标记只在领导者进程中执行（由选举线程启动和停止）
+        elector = None
+        if not options['no_leader']:
+            command_timeout = config.get('COMMAND_TIMEOUT', 60)
+            command_scheduler = CommandTimeoutScheduler(command_timeout) if command_timeout else None
+
+            def on_elected():
+                start_retention_scheduler()
+                if command_scheduler is not None:
+                    command_scheduler.start()
+
+            def on_revoked():
+                stop_retention_scheduler()
+                if command_scheduler is not None:
+                    command_scheduler.stop()
+
+            elector = LeaderElector(
+                'mqtt-ingest',
+                ttl=config.get('LEADER_LEASE_TTL', 15),
+                renew_interval=config.get('LEADER_RENEW_INTERVAL', 5),
+                on_elected=on_elected,
+                on_revoked=on_revoked,
+            )
+
+        if not mqtt_client.connect(ingest=True):
+            raise CommandError('连接MQTT Broker失败')
+        if elector is not None:
+            elector.start()
+        start_snapshot_writer('mqtt-ingest')
+
+        topics = '，'.join(mqtt_client.subscription_topics())
+        self.stdout.write(self.style.SUCCESS(f"MQTT数据接入进程已启动，订阅: {topics}"))
+
+        stop_event.wait()
+
+        # 先停止选举（释放租约，让其他进程尽快接管），再停止接收并排空解码、写入队列
+        if elector is not None:
+            elector.stop()
+        self.stdout.write(f"正在写入剩余数据（最多等待 {mqtt_client.drain_timeout}s）...")
+        mqtt_client.disconnect()
+        realtime_publisher.stop()
+        event_bus.stop()
+        profiler.stop()
+        stop_snapshot_writer()
+        self.stdout.write("MQTT数据接入进程已停止")
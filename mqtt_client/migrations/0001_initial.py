@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='租约名称')),
+                ('holder', models.CharField(help_text='主机名:进程号:随机串', max_length=100, verbose_name='持有者')),
+                ('expires_at', models.DateTimeField(verbose_name='过期时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '领导者租约',
+                'verbose_name_plural': '领导者租约',
+            },
+        ),
+    ]
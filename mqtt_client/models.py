@@ -1,3 +1,19 @@
 from django.db import models
 
-# Create your models here.
+
+class LeaderLease(models.Model):
+    """
+    数据库租约，用于多个MQTT接入进程之间的领导者选举
+    持有者在过期前不断续期，过期后其他进程可以接管
+    """
+    name = models.CharField('租约名称', max_length=50, unique=True)
+    holder = models.CharField('持有者', max_length=100, help_text="主机名:进程号:随机串")
+    expires_at = models.DateTimeField('过期时间')
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '领导者租约'
+        verbose_name_plural = '领导者租约'
+
+    def __str__(self):
+        return f"{self.name} ({self.holder})"
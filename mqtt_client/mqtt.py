@@ -1,20 +1,32 @@
-import json
 import logging
+import threading
 import uuid
 import paho.mqtt.client as mqtt
 from django.conf import settings
 from django.utils import timezone
-from django.db import transaction
 
 # 设置日志
 logger = logging.getLogger(__name__)
 
 # 导入设备模型
-from iot_devices.models import Device, Sensor, SensorData
+from core import codec, events
+from core.metrics import DECODE_ERRORS, MESSAGES_RECEIVED, QUEUE_DEPTH, STAGE_LATENCY
+from core.profiling import profiled, span
+from iot_devices.cache import device_metadata_cache
+from iot_devices.commands import acknowledge_command, is_command_response
+from iot_devices.models import Device
+from .ingest import MessageDecoder, SensorIngestWriter
 
 
 class MQTTClient:
-    """NovaCloud MQTT客户端类，管理与MQTT Broker的连接和消息处理"""
+    """
+    NovaCloud MQTT客户端类，管理与MQTT Broker的连接和消息处理
+
+    两种运行模式：
+    - 只发布（默认）：Web进程在首次发布命令时连接，不订阅设备主题
+    - 数据接入：run_mqtt_ingest进程以connect(ingest=True)连接，订阅设备主题，
+      网络线程 -> 解码线程 -> 写入线程池，断开时依次排空各队列
+    """
     
     _instance = None
     
@@ -64,72 +76,152 @@ class MQTTClient:
         
         # 连接状态和主题前缀
         self.connected = False
+        self.ingest = False
+        self._started = False
+        self._connected_event = threading.Event()
+        self._connect_lock = threading.RLock()
         self.topic_prefix = self.config.get('TOPIC_PREFIX', 'novacloud/')
+        
+        # 共享订阅分组：设置后以$share/<分组>/订阅设备主题，同一分组的多个进程分摊消息
+        self.shared_group = self.config.get('SHARED_SUBSCRIPTION_GROUP')
+        
+        # 数据接入：解码线程和传感器数据批量写入器（只在接入模式下启动）
+        ingest_config = getattr(settings, 'MQTT_INGEST_CONFIG', {})
+        self.drain_timeout = ingest_config.get('DRAIN_TIMEOUT', 30)
+        self.decoder = MessageDecoder(self.dispatch_message, ingest_config.get('DECODE_QUEUE_SIZE', 10000))
+        self.ingest_writer = SensorIngestWriter.from_settings()
+        QUEUE_DEPTH.set_function(self.decoder.queue.qsize, queue='mqtt_decode')
+        QUEUE_DEPTH.set_function(self.ingest_writer.queue.qsize, queue='mqtt_write')
     
-    def connect(self):
-        """连接到MQTT Broker"""
-        try:
-            logger.info(f"正在连接到MQTT Broker {self.host}:{self.port}")
-            self.client.connect(self.host, self.port, self.keepalive)
-            
-            # 启动后台线程
-            self.client.loop_start()
+    def connect(self, ingest=False):
+        """
+        连接到MQTT Broker
+        :param ingest: 是否接入设备数据（订阅设备主题并启动解码、写入线程），否则只用于发布
+        """
+        with self._connect_lock:
+            try:
+                if self.config.get('EMBEDDED_BROKER', False):
+                    self.start_embedded_broker()
+                
+                logger.info(f"正在连接到MQTT Broker {self.host}:{self.port}（{'数据接入' if ingest else '只发布'}）")
+                self.ingest = ingest
+                if ingest:
+                    self.ingest_writer.start()
+                    self.decoder.start()
+                self.client.connect(self.host, self.port, self.keepalive)
+                
+                # 启动后台线程
+                self.client.loop_start()
+                self._started = True
+                return True
+            except Exception as e:
+                logger.error(f"MQTT连接失败: {str(e)}")
+                return False
+    
+    def ensure_connected(self, timeout=None):
+        """
+        发布前确保已连接：尚未连接且MQTT_AUTO_CONNECT开启时以只发布模式连接，
+        并等待Broker确认连接
+        :return: 是否已连接
+        """
+        if self.connected:
             return True
-        except Exception as e:
-            logger.error(f"MQTT连接失败: {str(e)}")
-            return False
+        if not self._started:
+            if not getattr(settings, 'MQTT_AUTO_CONNECT', False):
+                return False
+            with self._connect_lock:
+                # 多个请求线程同时发布时只连接一次
+                if not self._started and not self.connect():
+                    return False
+        if timeout is None:
+            timeout = self.config.get('CONNECT_TIMEOUT', 5)
+        return self._connected_event.wait(timeout)
+    
+    def start_embedded_broker(self):
+        """在当前进程中启动MQTT Broker（离线开发和压测使用）"""
+        from .broker import start_embedded_broker
+        try:
+            start_embedded_broker(self.host, self.port)
+        except OSError as e:
+            # 端口已被其他进程中的Broker占用时直接连接该Broker
+            logger.warning(f"启动进程内MQTT Broker失败，将连接已有Broker: {str(e)}")
     
     def disconnect(self):
-        """断开与MQTT Broker的连接"""
-        if self.connected:
-            logger.info("正在断开MQTT连接")
-            self.client.loop_stop()
-            self.client.disconnect()
+        """
+        断开与MQTT Broker的连接
+        接入模式下先停止接收新消息，再依次处理完解码队列和写入队列中的数据
+        """
+        with self._connect_lock:
+            if self._started:
+                logger.info("正在断开MQTT连接")
+                self.client.disconnect()
+                self.client.loop_stop()
+                self._started = False
+            
+            self.decoder.stop(self.drain_timeout)
+            self.ingest_writer.stop(self.drain_timeout)
     
     def on_connect(self, client, userdata, flags, rc):
         """连接回调函数"""
         if rc == 0:
             self.connected = True
+            self._connected_event.set()
             logger.info("成功连接到MQTT Broker")
             
-            # 订阅所有设备的数据主题
-            # 使用通配符订阅所有设备
-            all_devices_data_topic = f"{self.topic_prefix}devices/+/data"
-            all_devices_status_topic = f"{self.topic_prefix}devices/+/status"
-            
-            logger.info(f"订阅主题: {all_devices_data_topic}")
-            self.client.subscribe(all_devices_data_topic, qos=self.config.get('QOS', 1))
-            
-            logger.info(f"订阅主题: {all_devices_status_topic}")
-            self.client.subscribe(all_devices_status_topic, qos=self.config.get('QOS', 1))
+            # 只有数据接入进程订阅所有设备的数据主题和状态主题
+            if self.ingest:
+                for topic in self.subscription_topics():
+                    logger.info(f"订阅主题: {topic}")
+                    self.client.subscribe(topic, qos=self.config.get('QOS', 1))
         else:
             self.connected = False
             logger.error(f"MQTT连接失败，返回码: {rc}")
     
+    def subscription_topics(self):
+        """设备数据和状态的订阅主题（使用通配符订阅所有设备）"""
+        topics = [
+            f"{self.topic_prefix}devices/+/data",
+            f"{self.topic_prefix}devices/+/status",
+        ]
+        if self.shared_group:
+            # Broker把消息的原始主题发给订阅者，on_message的主题解析不受影响
+            topics = [f"$share/{self.shared_group}/{topic}" for topic in topics]
+        return topics
+    
     def on_disconnect(self, client, userdata, rc):
         """断开连接回调函数"""
         self.connected = False
+        self._connected_event.clear()
         if rc != 0:
             logger.warning(f"意外断开MQTT连接，返回码: {rc}")
         else:
             logger.info("已断开MQTT连接")
     
+    @profiled('mqtt.on_message')
     def on_message(self, client, userdata, msg):
-        """消息接收回调函数"""
+        """消息接收回调函数（网络线程），只把原始消息交给解码线程"""
+        if self.ingest:
+            MESSAGES_RECEIVED.inc(protocol='mqtt')
+            self.decoder.submit(msg.topic, msg.payload)
+    
+    @profiled('mqtt.dispatch_message')
+    def dispatch_message(self, topic, payload):
+        """解析主题并处理一条消息（解码线程）"""
         try:
-            logger.debug(f"收到MQTT消息: 主题={msg.topic}, 内容={msg.payload.decode()}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"收到MQTT消息: 主题={topic}, 内容={payload.decode(errors='replace')}")
             
             # 解析主题
-            topic_parts = msg.topic.split('/')
+            topic_parts = topic.split('/')
             
             # 验证主题格式
             if len(topic_parts) < 4:
-                logger.warning(f"无效的主题格式: {msg.topic}")
+                logger.warning(f"无效的主题格式: {topic}")
                 return
             
             # 确保主题前缀正确
-            if not msg.topic.startswith(self.topic_prefix):
-                logger.warning(f"未知主题前缀: {msg.topic}")
+            if not topic.startswith(self.topic_prefix):
+                logger.warning(f"未知主题前缀: {topic}")
                 return
             
             # 提取设备ID和消息类型
@@ -138,9 +230,9 @@ class MQTTClient:
             
             # 根据消息类型处理
             if message_type == "data":
-                self._handle_device_data(device_id, msg.payload)
+                self._handle_device_data(device_id, payload)
             elif message_type == "status":
-                self._handle_device_status(device_id, msg.payload)
+                self._handle_device_status(device_id, payload)
             else:
                 logger.warning(f"未知的消息类型: {message_type}")
         
@@ -156,47 +248,27 @@ class MQTTClient:
         logger.debug(f"已订阅主题，消息ID: {mid}, QoS: {granted_qos}")
     
     def _handle_device_data(self, device_id, payload):
-        """处理设备数据消息"""
+        """处理设备数据消息，解码后交给批量写入器"""
         try:
             # 解析JSON数据
-            data = json.loads(payload)
-            logger.info(f"设备 {device_id} 数据: {data}")
+            with STAGE_LATENCY.time(stage='decode'), span('mqtt.decode'):
+                data = codec.loads(payload)
+            logger.debug(f"设备 {device_id} 数据: {data}")
             
-            # 使用事务确保数据一致性
-            with transaction.atomic():
-                try:
-                    # 查找设备
-                    device = Device.objects.get(device_id=device_id)
-                    
-                    # 更新设备状态
-                    device.status = 'online'
-                    device.last_seen = timezone.now()
-                    device.save()
-                    
-                    # 处理传感器数据
-                    for sensor in Sensor.objects.filter(device=device):
-                        if sensor.value_key in data:
-                            sensor_value = data[sensor.value_key]
-                            logger.info(f"传感器 {sensor.name} 数据: {sensor_value} {sensor.unit}")
-                            
-                            # 根据数据类型保存到对应字段
-                            sensor_data = SensorData(sensor=sensor)
-                            
-                            if isinstance(sensor_value, (int, float)):
-                                sensor_data.value_float = float(sensor_value)
-                            elif isinstance(sensor_value, bool):
-                                sensor_data.value_boolean = sensor_value
-                            else:
-                                sensor_data.value_string = str(sensor_value)
-                            
-                            # 保存数据
-                            sensor_data.save()
-                            logger.debug(f"保存传感器数据: {sensor_data}")
-                
-                except Device.DoesNotExist:
-                    logger.warning(f"未知设备ID: {device_id}")
+            if not isinstance(data, dict):
+                logger.warning(f"设备数据不是JSON对象: {payload}")
+                return
+            
+            # 命令响应也通过数据主题上报
+            if is_command_response(data):
+                acknowledge_command(device_id, data)
+                return
+            
+            # 写入在后台线程中批量完成
+            self.ingest_writer.submit(device_id, data)
         
-        except json.JSONDecodeError:
+        except codec.DecodeError:
+            DECODE_ERRORS.inc(protocol='mqtt')
             logger.error(f"无效的JSON数据: {payload}")
         except Exception as e:
             logger.error(f"处理设备数据时出错: {str(e)}")
@@ -205,7 +277,7 @@ class MQTTClient:
         """处理设备状态消息"""
         try:
             # 解析JSON状态
-            status_data = json.loads(payload)
+            status_data = codec.loads(payload)
             logger.info(f"设备 {device_id} 状态: {status_data}")
             
             # 检查状态字段
@@ -215,30 +287,28 @@ class MQTTClient:
             
             status = status_data['status']
             
-            # 使用事务确保数据一致性
-            with transaction.atomic():
-                try:
-                    # 查找设备
-                    device = Device.objects.get(device_id=device_id)
-                    
-                    # 更新设备状态
-                    device.status = status
-                    device.last_seen = timezone.now()
-                    device.save()
-                    
-                    logger.info(f"设备 {device_id} 状态已更新为: {status}")
-                
-                except Device.DoesNotExist:
-                    logger.warning(f"未知设备ID: {device_id}")
+            # 通过元数据缓存查找设备
+            device = device_metadata_cache.get(device_id)
+            if device is None:
+                logger.warning(f"未知设备ID: {device_id}")
+                return
+            
+            # 直接更新状态字段，无需先读取设备
+            now = timezone.now()
+            Device.objects.filter(pk=device.pk).update(status=status, last_seen=now)
+            logger.info(f"设备 {device_id} 状态已更新为: {status}")
+            events.publish(events.DEVICE_STATUS_CHANGED, {
+                'device_id': device_id, 'status': status, 'timestamp': now.isoformat(),
+            })
         
-        except json.JSONDecodeError:
+        except codec.DecodeError:
             logger.error(f"无效的JSON数据: {payload}")
         except Exception as e:
             logger.error(f"处理设备状态时出错: {str(e)}")
     
     def publish_command(self, device_id, command, qos=None):
         """向设备发布命令"""
-        if not self.connected:
+        if not self.ensure_connected():
             logger.error("MQTT客户端未连接")
             return False
         
@@ -249,7 +319,7 @@ class MQTTClient:
             
             # 确保命令是JSON格式
             if not isinstance(command, str):
-                command = json.dumps(command)
+                command = codec.dumps(command)
             
             # 设置QoS
             if qos is None:
@@ -272,7 +342,7 @@ class MQTTClient:
     
     def publish_config(self, device_id, config, qos=None):
         """向设备发布配置信息"""
-        if not self.connected:
+        if not self.ensure_connected():
             logger.error("MQTT客户端未连接")
             return False
         
@@ -283,7 +353,7 @@ class MQTTClient:
             
             # 确保配置是JSON格式
             if not isinstance(config, str):
-                config = json.dumps(config)
+                config = codec.dumps(config)
             
             # 设置QoS
             if qos is None:
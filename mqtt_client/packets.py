@@ -0,0 +1,280 @@
+"""
+MQTT 3.1.1 报文编解码
+
+只依赖标准库，供压测工具中的asyncio客户端和进程内Broker使用。
+报文格式参见 MQTT Version 3.1.1 OASIS Standard 第2、3章。
+"""
+import struct
+
+# 控制报文类型
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+PROTOCOL_NAME = 'MQTT'
+PROTOCOL_LEVEL = 4
+
+# CONNACK返回码
+CONNACK_ACCEPTED = 0
+CONNACK_BAD_PROTOCOL = 1
+CONNACK_IDENTIFIER_REJECTED = 2
+CONNACK_SERVER_UNAVAILABLE = 3
+CONNACK_BAD_CREDENTIALS = 4
+CONNACK_NOT_AUTHORIZED = 5
+
+# SUBACK中表示订阅失败的返回码
+SUBACK_FAILURE = 0x80
+
+# 剩余长度字段最多4字节
+MAX_REMAINING_LENGTH = 268435455
+
+_UINT16 = struct.Struct('>H')
+
+
+class MQTTProtocolError(Exception):
+    """报文格式错误"""
+
+
+def encode_remaining_length(length):
+    """编码剩余长度（每字节7位，最高位表示后面还有字节）"""
+    if length > MAX_REMAINING_LENGTH:
+        raise MQTTProtocolError(f"报文长度 {length} 超过上限")
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(value):
+    """编码UTF-8字符串（2字节长度前缀）"""
+    data = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+    return _UINT16.pack(len(data)) + data
+
+
+def decode_string(body, offset):
+    """
+    解码UTF-8字符串
+    :return: (字符串, 新的偏移量)
+    """
+    data, offset = decode_binary(body, offset)
+    try:
+        return data.decode('utf-8'), offset
+    except UnicodeDecodeError as e:
+        raise MQTTProtocolError("字符串不是有效的UTF-8") from e
+
+
+def decode_binary(body, offset):
+    """
+    解码二进制数据（2字节长度前缀）
+    :return: (bytes, 新的偏移量)
+    """
+    if offset + 2 > len(body):
+        raise MQTTProtocolError("报文长度不足")
+    (length,) = _UINT16.unpack_from(body, offset)
+    offset += 2
+    if offset + length > len(body):
+        raise MQTTProtocolError("报文长度不足")
+    return bytes(body[offset:offset + length]), offset + length
+
+
+def encode_packet(packet_type, flags, body=b''):
+    """组装固定报头 + 可变报头和载荷"""
+    return bytes([(packet_type << 4) | flags]) + encode_remaining_length(len(body)) + body
+
+
+async def read_packet(reader, max_size=MAX_REMAINING_LENGTH):
+    """
+    从asyncio.StreamReader读取一个完整报文
+    :return: (报文类型, 标志位, 报文体bytes)
+    :raises asyncio.IncompleteReadError: 连接关闭
+    """
+    header = (await reader.readexactly(1))[0]
+
+    length = 0
+    multiplier = 1
+    for _ in range(4):
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    else:
+        raise MQTTProtocolError("剩余长度字段超过4字节")
+
+    if length > max_size:
+        raise MQTTProtocolError(f"报文长度 {length} 超过最大大小 {max_size} 字节")
+
+    body = await reader.readexactly(length) if length else b''
+    return header >> 4, header & 0x0F, body
+
+
+# ---- 编码 ----
+
+def encode_connect(client_id, username=None, password=None, keepalive=60, clean_session=True):
+    flags = 0x02 if clean_session else 0
+    payload = encode_string(client_id)
+    if username is not None:
+        flags |= 0x80
+        payload += encode_string(username)
+    if password is not None:
+        flags |= 0x40
+        payload += encode_string(password)
+    body = encode_string(PROTOCOL_NAME) + bytes([PROTOCOL_LEVEL, flags]) + _UINT16.pack(keepalive) + payload
+    return encode_packet(CONNECT, 0, body)
+
+
+def encode_connack(return_code, session_present=False):
+    return encode_packet(CONNACK, 0, bytes([1 if session_present else 0, return_code]))
+
+
+def encode_publish(topic, payload, qos=0, packet_id=None, retain=False, dup=False):
+    flags = (0x08 if dup else 0) | (qos << 1) | (0x01 if retain else 0)
+    body = encode_string(topic)
+    if qos:
+        body += _UINT16.pack(packet_id)
+    return encode_packet(PUBLISH, flags, body + payload)
+
+
+def encode_ack(packet_type, packet_id):
+    """PUBACK/PUBREC/PUBREL/PUBCOMP/UNSUBACK（只含报文标识符）"""
+    return encode_packet(packet_type, 0x02 if packet_type == PUBREL else 0, _UINT16.pack(packet_id))
+
+
+def encode_subscribe(packet_id, topics):
+    """
+    :param topics: [(主题过滤器, QoS)]
+    """
+    body = _UINT16.pack(packet_id) + b''.join(encode_string(topic) + bytes([qos]) for topic, qos in topics)
+    return encode_packet(SUBSCRIBE, 0x02, body)
+
+
+def encode_suback(packet_id, return_codes):
+    return encode_packet(SUBACK, 0, _UINT16.pack(packet_id) + bytes(return_codes))
+
+
+def encode_unsubscribe(packet_id, topics):
+    return encode_packet(UNSUBSCRIBE, 0x02, _UINT16.pack(packet_id) + b''.join(encode_string(t) for t in topics))
+
+
+PINGREQ_PACKET = encode_packet(PINGREQ, 0)
+PINGRESP_PACKET = encode_packet(PINGRESP, 0)
+DISCONNECT_PACKET = encode_packet(DISCONNECT, 0)
+
+
+# ---- 解码 ----
+
+def parse_connect(body):
+    """
+    解析CONNECT报文
+    :return: dict（client_id、username、password、keepalive、clean_session、will、protocol_level）
+    """
+    protocol, offset = decode_string(body, 0)
+    if protocol != PROTOCOL_NAME or offset + 4 > len(body):
+        raise MQTTProtocolError(f"不支持的协议: {protocol}")
+
+    level, flags = body[offset], body[offset + 1]
+    (keepalive,) = _UINT16.unpack_from(body, offset + 2)
+    offset += 4
+
+    client_id, offset = decode_string(body, offset)
+    will = None
+    if flags & 0x04:
+        will_topic, offset = decode_string(body, offset)
+        will_payload, offset = decode_binary(body, offset)
+        will = {
+            'topic': will_topic,
+            'payload': will_payload,
+            'qos': (flags >> 3) & 0x03,
+            'retain': bool(flags & 0x20),
+        }
+
+    username = password = None
+    if flags & 0x80:
+        username, offset = decode_string(body, offset)
+    if flags & 0x40:
+        password, offset = decode_binary(body, offset)
+        password = password.decode('utf-8', errors='replace')
+
+    return {
+        'protocol_level': level,
+        'client_id': client_id,
+        'username': username,
+        'password': password,
+        'keepalive': keepalive,
+        'clean_session': bool(flags & 0x02),
+        'will': will,
+    }
+
+
+def parse_connack(body):
+    """:return: (session_present, 返回码)"""
+    if len(body) != 2:
+        raise MQTTProtocolError("CONNACK长度错误")
+    return bool(body[0] & 0x01), body[1]
+
+
+def parse_publish(flags, body):
+    """
+    解析PUBLISH报文
+    :return: (主题, 载荷bytes, qos, 报文标识符, retain, dup)
+    """
+    qos = (flags >> 1) & 0x03
+    if qos == 3:
+        raise MQTTProtocolError("无效的QoS")
+    topic, offset = decode_string(body, 0)
+    packet_id = None
+    if qos:
+        if offset + 2 > len(body):
+            raise MQTTProtocolError("报文长度不足")
+        (packet_id,) = _UINT16.unpack_from(body, offset)
+        offset += 2
+    return topic, bytes(body[offset:]), qos, packet_id, bool(flags & 0x01), bool(flags & 0x08)
+
+
+def parse_packet_id(body):
+    """解析只含报文标识符的报文（PUBACK等），以及SUBACK/UNSUBACK的报文标识符"""
+    if len(body) < 2:
+        raise MQTTProtocolError("报文长度不足")
+    return _UINT16.unpack_from(body, 0)[0]
+
+
+def parse_subscribe(body):
+    """:return: (报文标识符, [(主题过滤器, QoS)])"""
+    packet_id = parse_packet_id(body)
+    offset = 2
+    topics = []
+    while offset < len(body):
+        topic, offset = decode_string(body, offset)
+        if offset >= len(body):
+            raise MQTTProtocolError("报文长度不足")
+        topics.append((topic, body[offset] & 0x03))
+        offset += 1
+    if not topics:
+        raise MQTTProtocolError("SUBSCRIBE中没有主题")
+    return packet_id, topics
+
+
+def parse_unsubscribe(body):
+    """:return: (报文标识符, [主题过滤器])"""
+    packet_id = parse_packet_id(body)
+    offset = 2
+    topics = []
+    while offset < len(body):
+        topic, offset = decode_string(body, offset)
+        topics.append(topic)
+    return packet_id, topics
@@ -1,3 +1,354 @@
-from django.test import TestCase
+import datetime
+import socket
+import struct
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db.models.query import QuerySet
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from core import events
+from core.events import LocalEventBus
+from iot_devices.cache import device_metadata_cache
+from iot_devices.models import Device, Project
+
+from . import packets
+from .broker import BrokerThread, MQTTBroker, topic_matches, valid_topic_filter
+from .leader import LeaderElector
+from .models import LeaderLease
+from .mqtt import mqtt_client
+
+
+class LeaderElectorTests(TestCase):
+    """数据库租约领导者选举"""
+
+    def lease(self, holder, seconds):
+        return LeaderLease.objects.create(
+            name='ingest', holder=holder, expires_at=timezone.now() + datetime.timedelta(seconds=seconds)
+        )
+
+    def test_acquire_when_no_lease(self):
+        elector = LeaderElector('ingest')
+        self.assertTrue(elector.try_acquire())
+        self.assertEqual(LeaderLease.objects.get(name='ingest').holder, elector.holder)
+
+    def test_renew_own_lease(self):
+        elector = LeaderElector('ingest', ttl=30)
+        self.lease(elector.holder, 5)
+        self.assertTrue(elector.try_acquire())
+        self.assertGreater(LeaderLease.objects.get(name='ingest').expires_at,
+                           timezone.now() + datetime.timedelta(seconds=20))
+
+    def test_cannot_take_unexpired_lease(self):
+        self.lease('other', 30)
+        self.assertFalse(LeaderElector('ingest').try_acquire())
+        self.assertEqual(LeaderLease.objects.get(name='ingest').holder, 'other')
+
+    def test_takeover_expired_lease(self):
+        self.lease('other', -1)
+        elector = LeaderElector('ingest')
+        self.assertTrue(elector.try_acquire())
+        self.assertEqual(LeaderLease.objects.get(name='ingest').holder, elector.holder)
+        # 原持有者续期失败
+        other = LeaderElector('ingest')
+        other.holder = 'other'
+        self.assertFalse(other.try_acquire())
+
+    def test_insert_race(self):
+        # 两个进程都没查到租约，另一个进程先插入成功
+        self.lease('other', 30)
+        elector = LeaderElector('ingest')
+        with mock.patch.object(QuerySet, 'exists', return_value=False):
+            self.assertFalse(elector.try_acquire())
+        self.assertEqual(LeaderLease.objects.get(name='ingest').holder, 'other')
+        # 唯一约束冲突只回滚保存点，连接仍可继续使用
+        self.assertEqual(LeaderLease.objects.count(), 1)
+
+    def test_release(self):
+        elector = LeaderElector('ingest')
+        elector.try_acquire()
+        elector.release()
+        self.assertTrue(LeaderElector('ingest').try_acquire())
+
+    def test_callbacks(self):
+        events = []
+        elector = LeaderElector('ingest', on_elected=lambda: events.append('elected'),
+                                on_revoked=lambda: events.append('revoked'))
+        elector._set_leader(True)
+        elector._set_leader(False)
+        self.assertEqual(events, ['elected', 'revoked'])
+
+
+class DeviceStatusEventTests(TestCase):
+    """MQTT设备状态消息发布的事件内容"""
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = get_user_model().objects.create_user(username='owner', password='x')
+        project = Project.objects.create(project_id='PRJ-000001', name='project', owner=owner)
+        cls.device = Device.objects.create(device_id='DEV-000001', device_identifier='DEV-000001',
+                                           device_key='key', name='device', project=project)
+
+    def setUp(self):
+        device_metadata_cache.clear()
+        self.bus = LocalEventBus(record=True)
+        patcher = mock.patch.object(events, 'event_bus', self.bus)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_mqtt_device_status_changed(self):
+        mqtt_client._handle_device_status('DEV-000001', b'{"status": "offline"}')
+
+        [(event_type, payload)] = self.bus.published
+        self.assertEqual(event_type, events.DEVICE_STATUS_CHANGED)
+        self.device.refresh_from_db()
+        self.assertEqual(payload, {
+            'device_id': 'DEV-000001', 'status': 'offline', 'timestamp': self.device.last_seen.isoformat(),
+        })
+        self.assertEqual(self.device.status, 'offline')
+
+    def test_mqtt_unknown_device_publishes_nothing(self):
+        mqtt_client._handle_device_status('DEV-999999', b'{"status": "offline"}')
+        self.assertEqual(self.bus.published, [])
+
+
+def recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('连接已关闭')
+        data += chunk
+    return data
+
+
+class RawClient:
+    """测试用的同步MQTT客户端，直接收发报文"""
+
+    def __init__(self, port, client_id, will=None):
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=5)
+        if will is None:
+            self.sock.sendall(packets.encode_connect(client_id))
+        else:
+            self.sock.sendall(self.encode_connect_with_will(client_id, *will))
+        self.expect(packets.CONNACK)
+
+    @staticmethod
+    def encode_connect_with_will(client_id, topic, payload, qos=0, retain=False):
+        flags = 0x02 | 0x04 | (qos << 3) | (0x20 if retain else 0)
+        body = (packets.encode_string(packets.PROTOCOL_NAME) + bytes([packets.PROTOCOL_LEVEL, flags])
+                + struct.pack('>H', 60) + packets.encode_string(client_id)
+                + packets.encode_string(topic) + packets.encode_string(payload))
+        return packets.encode_packet(packets.CONNECT, 0, body)
+
+    def read(self):
+        header = recv_exactly(self.sock, 1)[0]
+        length, multiplier = 0, 1
+        while True:
+            byte = recv_exactly(self.sock, 1)[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return header >> 4, header & 0x0F, recv_exactly(self.sock, length)
+
+    def expect(self, packet_type):
+        received, flags, body = self.read()
+        if received != packet_type:
+            raise AssertionError(f'期望报文类型 {packet_type}，实际 {received}')
+        return flags, body
+
+    def subscribe(self, topic_filter, qos=0, packet_id=1):
+        self.sock.sendall(packets.encode_subscribe(packet_id, [(topic_filter, qos)]))
+        _, body = self.expect(packets.SUBACK)
+        return body[2:]
+
+    def publish(self, topic, payload, qos=0, packet_id=None, retain=False):
+        self.sock.sendall(packets.encode_publish(topic, payload, qos, packet_id, retain=retain))
+        if qos == 1:
+            _, body = self.expect(packets.PUBACK)
+            return packets.parse_packet_id(body)
+
+    def receive_publish(self):
+        flags, body = self.expect(packets.PUBLISH)
+        return packets.parse_publish(flags, body)
+
+    def ping(self):
+        """PINGREQ的响应说明此前的报文都已处理"""
+        self.sock.sendall(packets.PINGREQ_PACKET)
+        self.expect(packets.PINGRESP)
+
+    def close(self, clean=True):
+        if clean:
+            self.sock.sendall(packets.DISCONNECT_PACKET)
+        self.sock.close()
+
+
+class PacketCodecTests(SimpleTestCase):
+    """MQTT报文编解码"""
+
+    def test_remaining_length(self):
+        self.assertEqual(packets.encode_remaining_length(0), b'\x00')
+        self.assertEqual(packets.encode_remaining_length(127), b'\x7f')
+        self.assertEqual(packets.encode_remaining_length(128), b'\x80\x01')
+        self.assertEqual(packets.encode_remaining_length(16383), b'\xff\x7f')
+        self.assertEqual(packets.encode_remaining_length(packets.MAX_REMAINING_LENGTH), b'\xff\xff\xff\x7f')
+        with self.assertRaises(packets.MQTTProtocolError):
+            packets.encode_remaining_length(packets.MAX_REMAINING_LENGTH + 1)
+
+    def test_connect_round_trip(self):
+        packet = packets.encode_connect('dev-1', username='user', password='密码', keepalive=30)
+        self.assertEqual(packet[0] >> 4, packets.CONNECT)
+        connect = packets.parse_connect(packet[2:])
+        self.assertEqual(connect, {
+            'protocol_level': packets.PROTOCOL_LEVEL,
+            'client_id': 'dev-1',
+            'username': 'user',
+            'password': '密码',
+            'keepalive': 30,
+            'clean_session': True,
+            'will': None,
+        })
+
+    def test_connect_with_will(self):
+        packet = RawClient.encode_connect_with_will('dev-1', 'status/dev-1', 'offline', qos=1, retain=True)
+        self.assertEqual(packets.parse_connect(packet[2:])['will'], {
+            'topic': 'status/dev-1', 'payload': b'offline', 'qos': 1, 'retain': True,
+        })
+
+    def test_publish_round_trip(self):
+        packet = packets.encode_publish('a/b', b'\x00\x01', qos=1, packet_id=7, retain=True)
+        flags = packet[0] & 0x0F
+        self.assertEqual(packets.parse_publish(flags, packet[2:]), ('a/b', b'\x00\x01', 1, 7, True, False))
+
+        packet = packets.encode_publish('主题', b'x')
+        self.assertEqual(packets.parse_publish(packet[0] & 0x0F, packet[2:]), ('主题', b'x', 0, None, False, False))
+
+    def test_subscribe_round_trip(self):
+        packet = packets.encode_subscribe(3, [('a/+', 1), ('b/#', 0)])
+        self.assertEqual(packet[0], (packets.SUBSCRIBE << 4) | 0x02)
+        self.assertEqual(packets.parse_subscribe(packet[2:]), (3, [('a/+', 1), ('b/#', 0)]))
+
+    def test_unsubscribe_round_trip(self):
+        packet = packets.encode_unsubscribe(4, ['a/+', 'b/#'])
+        self.assertEqual(packets.parse_unsubscribe(packet[2:]), (4, ['a/+', 'b/#']))
+
+    def test_ack(self):
+        self.assertEqual(packets.encode_ack(packets.PUBACK, 258), b'\x40\x02\x01\x02')
+        self.assertEqual(packets.encode_ack(packets.PUBREL, 1)[0], (packets.PUBREL << 4) | 0x02)
+        self.assertEqual(packets.parse_packet_id(b'\x01\x02'), 258)
+
+    def test_malformed(self):
+        with self.assertRaises(packets.MQTTProtocolError):
+            packets.parse_publish(0x06, packets.encode_string('a'))
+        with self.assertRaises(packets.MQTTProtocolError):
+            packets.parse_publish(0x02, packets.encode_string('a'))
+        with self.assertRaises(packets.MQTTProtocolError):
+            packets.decode_string(b'\x00\x05ab', 0)
+        with self.assertRaises(packets.MQTTProtocolError):
+            packets.decode_string(b'\x00\x01\xff', 0)
+        with self.assertRaises(packets.MQTTProtocolError):
+            packets.parse_subscribe(b'\x00\x01')
+
+    def test_topic_filters(self):
+        self.assertTrue(topic_matches('a/+/c', 'a/b/c'))
+        self.assertTrue(topic_matches('a/#', 'a'))
+        self.assertFalse(topic_matches('+/b', '$SYS/b'))
+        self.assertTrue(valid_topic_filter('$share/g/a/#'))
+        self.assertFalse(valid_topic_filter('a/#/b'))
+        self.assertFalse(valid_topic_filter('a/b+'))
+        self.assertFalse(valid_topic_filter('$share//a'))
+
+
+class BrokerTests(SimpleTestCase):
+    """进程内Broker（系统分配端口）"""
+
+    def setUp(self):
+        self.broker_thread = BrokerThread(MQTTBroker(port=0)).start()
+        self.port = self.broker_thread.broker.port
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.sock.close()
+        self.broker_thread.stop()
+
+    def connect(self, client_id, will=None):
+        client = RawClient(self.port, client_id, will)
+        self.clients.append(client)
+        return client
+
+    def test_qos1_publish_received_by_subscriber(self):
+        subscriber = self.connect('sub')
+        self.assertEqual(subscriber.subscribe('devices/+/data', qos=1), b'\x01')
+
+        publisher = self.connect('pub')
+        self.assertEqual(publisher.publish('devices/d1/data', b'{"t":1}', qos=1, packet_id=10), 10)
+
+        topic, payload, qos, packet_id, retain, _ = subscriber.receive_publish()
+        self.assertEqual((topic, payload, qos, retain), ('devices/d1/data', b'{"t":1}', 1, False))
+        self.assertIsNotNone(packet_id)
+
+    def test_qos_downgraded_to_subscription(self):
+        subscriber = self.connect('sub')
+        subscriber.subscribe('a', qos=0)
+        self.connect('pub').publish('a', b'x', qos=1, packet_id=1)
+        self.assertEqual(subscriber.receive_publish()[2], 0)
+
+    def test_invalid_filter_rejected(self):
+        self.assertEqual(self.connect('sub').subscribe('a/#/b'), bytes([packets.SUBACK_FAILURE]))
+
+    def test_shared_subscription_round_robin(self):
+        members = [self.connect(f'worker-{i}') for i in range(2)]
+        for member in members:
+            member.subscribe('$share/ingest/data/#')
+        publisher = self.connect('pub')
+        for i in range(4):
+            publisher.publish('data/x', str(i).encode())
+        publisher.ping()
+
+        received = {}
+        for member in members:
+            received[member] = [member.receive_publish()[1], member.receive_publish()[1]]
+        # 同一分组内轮流分发，每个成员各收到一半，每条消息只转发一次
+        self.assertEqual(sorted(received[members[0]] + received[members[1]]), [b'0', b'1', b'2', b'3'])
+        self.assertEqual(self.broker_thread.broker.stats['messages_delivered'], 4)
+
+    def test_retained_message(self):
+        publisher = self.connect('pub')
+        publisher.publish('config/d1', b'v1', qos=1, packet_id=1, retain=True)
+
+        subscriber = self.connect('sub')
+        subscriber.subscribe('config/+')
+        topic, payload, _, _, retain, _ = subscriber.receive_publish()
+        self.assertEqual((topic, payload, retain), ('config/d1', b'v1', True))
+
+        # 空载荷删除保留消息
+        publisher.publish('config/d1', b'', qos=1, packet_id=2, retain=True)
+        self.assertEqual(subscriber.receive_publish()[1], b'')
+        self.assertEqual(self.broker_thread.broker.retained, {})
+
+    def test_will_published_on_unclean_disconnect(self):
+        subscriber = self.connect('sub')
+        subscriber.subscribe('status/#')
+
+        device = self.connect('dev-1', will=('status/dev-1', 'offline'))
+        device.close(clean=False)
+
+        topic, payload, _, _, _, _ = subscriber.receive_publish()
+        self.assertEqual((topic, payload), ('status/dev-1', b'offline'))
+
+    def test_no_will_on_clean_disconnect(self):
+        subscriber = self.connect('sub')
+        subscriber.subscribe('status/#')
+
+        device = self.connect('dev-1', will=('status/dev-1', 'offline'))
+        device.close(clean=True)
+        deadline = time.monotonic() + 5
+        while 'dev-1' in self.broker_thread.broker.sessions and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.connect('pub').publish('status/other', b'online', qos=1, packet_id=1)
+
+        self.assertEqual(subscriber.receive_publish()[:2], ('status/other', b'online'))
@@ -0,0 +1,289 @@
+import atexit
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+# 一次动作执行任务
+ActionJob = namedtuple('ActionJob', ['action', 'sensor_data', 'attempt'])
+
+
+class ActionExecutor:
+    """
+    策略动作异步执行器
+
+    策略条件满足后，动作只被放入有界队列，由独立的工作线程池执行，
+    避免慢速WebHook或邮件服务器阻塞设备数据接入线程。
+    - 每个工作线程复用自己的HTTP会话（连接池）和SMTP连接
+    - 每次执行都有超时时间，可重试的失败按指数退避重试
+    - 执行结果对应的StrategyLog批量写入数据库
+    """
+
+    def __init__(self, workers=4, max_queue_size=1000, timeout=10, max_retries=3,
+                 retry_backoff=1.0, log_batch_size=100, log_flush_interval=1.0):
+        """初始化执行器"""
+        self.workers = workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.log_batch_size = log_batch_size
+        self.log_flush_interval = log_flush_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+
+        self._threads = []
+        self._stop_event = threading.Event()
+
+        # 等待重试的任务：(到期时间, 序号, 任务)
+        self._retry_heap = []
+        self._retry_counter = itertools.count()
+        self._retry_lock = threading.Lock()
+
+        # 待写入的执行日志
+        self._pending_logs = []
+        self._logs_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        """根据settings.STRATEGY_ENGINE_CONFIG创建执行器"""
+        config = getattr(settings, 'STRATEGY_ENGINE_CONFIG', {})
+        return cls(
+            workers=config.get('ACTION_WORKERS', 4),
+            max_queue_size=config.get('ACTION_QUEUE_SIZE', 1000),
+            timeout=config.get('ACTION_TIMEOUT', 10),
+            max_retries=config.get('ACTION_MAX_RETRIES', 3),
+            retry_backoff=config.get('ACTION_RETRY_BACKOFF', 1.0),
+            log_batch_size=config.get('LOG_BATCH_SIZE', 100),
+            log_flush_interval=config.get('LOG_FLUSH_INTERVAL', 1.0),
+        )
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        """启动工作线程和调度线程"""
+        if self.running:
+            return
+        self._stop_event.clear()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f'strategy-action-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        self._threads.append(threading.Thread(target=self._scheduler, name='strategy-action-scheduler', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"策略动作执行器已启动，工作线程: {self.workers}，队列上限: {self.queue.maxsize}")
+
+    def stop(self, timeout=10):
+        """停止执行器，等待队列中的动作执行完毕并写入剩余日志"""
+        if not self.running:
+            return
+        self._stop_event.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self._threads = []
+        self._flush_logs()
+        logger.info("策略动作执行器已停止")
+
+    def submit(self, action, sensor_data):
+        """
+        提交动作执行任务
+        :return: 是否成功入队（队列已满时返回False）
+        """
+        try:
+            self.queue.put_nowait(ActionJob(action, sensor_data, 1))
+            return True
+        except queue.Full:
+            logger.warning(f"策略动作队列已满，丢弃动作 {action.pk}")
+            return False
+
+    def _worker(self):
+        """工作线程：执行动作，复用本线程的HTTP会话和SMTP连接"""
+        session = self._create_http_session()
+        mail_connection = None
+
+        try:
+            while not (self._stop_event.is_set() and self.queue.empty()):
+                try:
+                    job = self.queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+
+                if mail_connection is None and job.action.action_type == 'send_email_notification':
+                    mail_connection = self._open_mail_connection()
+
+                try:
+                    job.action.execute(
+                        job.sensor_data,
+                        http_session=session,
+                        mail_connection=mail_connection,
+                        timeout=self.timeout,
+                    )
+                    self._record(job, True, f"动作 {job.action.get_action_type_display()} 执行成功")
+                except Exception as e:
+                    # SMTP连接可能已被服务器关闭，下次使用时重新建立
+                    if job.action.action_type == 'send_email_notification' and mail_connection is not None:
+                        self._close_mail_connection(mail_connection)
+                        mail_connection = None
+                    self._handle_failure(job, e)
+                finally:
+                    close_old_connections()
+        finally:
+            if session is not None:
+                session.close()
+            if mail_connection is not None:
+                self._close_mail_connection(mail_connection)
+
+    def _handle_failure(self, job, error):
+        """处理执行失败：可重试的错误按指数退避重新排队，否则记录失败日志"""
+        from .models import ActionRetryableError
+
+        retryable = isinstance(error, (ActionRetryableError, OSError))
+        if retryable and job.attempt < self.max_retries and not self._stop_event.is_set():
+            delay = self.retry_backoff * (2 ** (job.attempt - 1))
+            logger.warning(f"执行策略动作 {job.action.pk} 失败（第 {job.attempt} 次），{delay:.1f}s 后重试: {str(error)}")
+            with self._retry_lock:
+                heapq.heappush(self._retry_heap, (
+                    time.monotonic() + delay, next(self._retry_counter), job._replace(attempt=job.attempt + 1)
+                ))
+            return
+
+        logger.error(f"执行策略动作时出错: {str(error)}")
+        self._record(job, False, f"执行失败: {str(error)}")
+
+    def _record(self, job, result, message):
+        """记录执行结果，由调度线程批量写入"""
+        from .models import StrategyLog
+
+        log = StrategyLog(
+            strategy_id=job.action.strategy_id,
+            sensor_data=job.sensor_data,
+            action=job.action,
+            result=result,
+            message=message,
+        )
+        with self._logs_lock:
+            self._pending_logs.append(log)
+            should_flush = len(self._pending_logs) >= self.log_batch_size
+
+        if should_flush:
+            self._flush_logs()
+
+    def _scheduler(self):
+        """调度线程：把到期的重试任务放回队列，并定期批量写入执行日志"""
+        last_flush = time.monotonic()
+
+        while not self._stop_event.is_set() or any(
+            thread.is_alive() for thread in self._threads if thread is not threading.current_thread()
+        ):
+            now = time.monotonic()
+            self._requeue_due_retries(now)
+
+            if now - last_flush >= self.log_flush_interval:
+                self._flush_logs()
+                last_flush = now
+
+            time.sleep(0.1)
+
+        # 停止时仍在等待的重试直接记为失败
+        with self._retry_lock:
+            remaining, self._retry_heap = self._retry_heap, []
+        for _, _, job in remaining:
+            self._record(job, False, "执行失败: 执行器已停止，未完成重试")
+        self._flush_logs()
+        close_old_connections()
+
+    def _requeue_due_retries(self, now):
+        """把到期的重试任务放回队列，队列已满时记为失败"""
+        due = []
+        with self._retry_lock:
+            while self._retry_heap and self._retry_heap[0][0] <= now:
+                due.append(heapq.heappop(self._retry_heap)[2])
+
+        # 在锁外放回队列和记录失败，写入日志时不会阻塞工作线程登记重试
+        for job in due:
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                self._record(job, False, "执行失败: 重试时动作队列已满")
+
+    def _flush_logs(self):
+        """批量写入执行日志"""
+        from .models import StrategyLog
+
+        with self._logs_lock:
+            logs, self._pending_logs = self._pending_logs, []
+        if not logs:
+            return
+
+        try:
+            StrategyLog.objects.bulk_create(logs)
+        except Exception as e:
+            logger.exception(f"批量写入策略日志时出错: {str(e)}")
+
+    def _create_http_session(self):
+        """创建带连接池的HTTP会话（未安装requests时返回None）"""
+        try:
+            import requests
+            from requests.adapters import HTTPAdapter
+        except ImportError:
+            return None
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _open_mail_connection(self):
+        """打开可复用的SMTP连接"""
+        from django.core.mail import get_connection
+
+        connection = get_connection(timeout=self.timeout)
+        try:
+            connection.open()
+        except Exception as e:
+            logger.warning(f"打开邮件连接失败，将在发送时重试: {str(e)}")
+        return connection
+
+    def _close_mail_connection(self, connection):
+        """关闭SMTP连接"""
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_action_executor():
+    """
+    获取进程级动作执行器（首次调用时启动）
+    :return: ActionExecutor，未启用异步执行时返回None
+    """
+    global _executor
+
+    config = getattr(settings, 'STRATEGY_ENGINE_CONFIG', {})
+    if not config.get('ASYNC_ACTIONS', True):
+        return None
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                executor = ActionExecutor.from_settings()
+                executor.start()
+                atexit.register(executor.stop)
+                _executor = executor
+    return _executor
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('strategy_engine', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='strategylog',
+            index=models.Index(fields=['strategy', '-timestamp'], name='strategy_en_strateg_c55068_idx'),
+        ),
+    ]
@@ -1,12 +1,18 @@
 from django.db import models
 from django.conf import settings
 from iot_devices.models import Project, Device, Sensor, Actuator
+from core.profiling import profiled
 import json
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class ActionRetryableError(Exception):
+    """可重试的动作执行错误（例如WebHook返回5xx或429）"""
+    pass
+
+
 class Strategy(models.Model):
     """策略模型"""
     name = models.CharField('策略名称', max_length=100)
@@ -25,6 +31,7 @@ class Strategy(models.Model):
     def __str__(self):
         return f"{self.name} ({self.project.name})"
     
+    @profiled('strategy.evaluate_conditions')
     def evaluate_conditions(self, sensor_data):
         """
         评估策略条件
@@ -35,7 +42,7 @@ class Strategy(models.Model):
             return False
         
         # 检查传感器是否属于触发设备
-        if sensor_data.sensor.device != self.trigger_source_device:
+        if sensor_data.sensor.device_id != self.trigger_source_device_id:
             return False
         
         # 获取所有条件
@@ -44,40 +51,33 @@ class Strategy(models.Model):
             logger.warning(f"策略 {self.name} 没有条件")
             return False
         
-        result = None
-        
-        # 逐个评估条件
-        for i, condition in enumerate(conditions):
-            # 如果当前传感器数据不是条件关注的传感器，跳过
-            if condition.sensor != sensor_data.sensor:
-                continue
-                
-            # 检查传感器值是否符合条件
-            current_result = condition.evaluate(sensor_data)
-            
-            if i == 0:
-                # 第一个条件的结果
-                result = current_result
-            else:
-                # 根据逻辑运算符组合条件结果
-                prev_condition = conditions[i-1]
-                if prev_condition.logical_operator_to_next == 'AND':
-                    result = result and current_result
-                elif prev_condition.logical_operator_to_next == 'OR':
-                    result = result or current_result
-        
-        # 如果没有评估任何条件（没有匹配的传感器），返回False
-        if result is None:
-            return False
-            
-        return result
+        # 编译后逐个评估条件（与规则索引使用同一实现）
+        from .rule_index import CompiledCondition, evaluate_condition_chain
+        compiled = [CompiledCondition.from_condition(condition) for condition in conditions]
+        return evaluate_condition_chain(compiled, sensor_data)
     
+    @profiled('strategy.execute_actions')
     def execute_actions(self, sensor_data):
         """
         执行策略动作
         :param sensor_data: 触发的传感器数据
         """
+        from .executor import get_action_executor
+        executor = get_action_executor()
+        
         for action in self.actions.all():
+            # 异步执行：动作交给执行器，日志在执行完成后批量写入
+            if executor is not None:
+                if not executor.submit(action, sensor_data):
+                    StrategyLog.objects.create(
+                        strategy=self,
+                        sensor_data=sensor_data,
+                        action=action,
+                        result=False,
+                        message="执行失败: 动作队列已满"
+                    )
+                continue
+            
             try:
                 action.execute(sensor_data)
                 # 记录执行日志
@@ -235,19 +235,26 @@ class Action(models.Model):
             return f"WebHook调用 {self.webhook_url}"
         return f"动作: {self.get_action_type_display()}"
     
-    def execute(self, sensor_data):
+    @profiled('action.execute')
+    def execute(self, sensor_data, http_session=None, mail_connection=None, timeout=None):
         """
         执行动作
         :param sensor_data: 触发的传感器数据
+        :param http_session: 可复用的requests会话（可选）
+        :param mail_connection: 可复用的邮件连接（可选）
+        :param timeout: 网络请求超时时间（秒），默认使用STRATEGY_ENGINE_CONFIG['ACTION_TIMEOUT']
         """
+        if timeout is None:
+            timeout = getattr(settings, 'STRATEGY_ENGINE_CONFIG', {}).get('ACTION_TIMEOUT', 10)
+        
         if self.action_type == 'send_email_notification':
-            self._send_email_notification(sensor_data)
+            self._send_email_notification(sensor_data, connection=mail_connection)
         elif self.action_type == 'control_actuator':
             self._control_actuator(sensor_data)
         elif self.action_type == 'webhook':
-            self._call_webhook(sensor_data)
+            self._call_webhook(sensor_data, session=http_session, timeout=timeout)
     
-    def _send_email_notification(self, sensor_data):
+    def _send_email_notification(self, sensor_data, connection=None):
         """发送邮件通知"""
         from django.core.mail import send_mail
         from django.template import Template, Context
@@ -294,6 +301,7 @@ class Action(models.Model):
             from_email=None,  # 使用默认发件人
             recipient_list=recipients,
             fail_silently=False,
+            connection=connection,
         )
         
         logger.info(f"已发送策略触发通知邮件到 {', '.join(recipients)}")
@@ -333,9 +341,14 @@ class Action(models.Model):
         if not result:
             raise Exception(f"向设备 {self.target_actuator.device.name} 发送命令失败")
         
+        # 记录到设备影子的期望状态
+        from iot_devices.shadow import set_desired
+        command_key = self.target_actuator.command_key
+        set_desired(self.target_actuator.device_id, {command_key: command_data.get(command_key, command)})
+        
         logger.info(f"已向设备 {self.target_actuator.device.name} 的执行器 {self.target_actuator.name} 发送命令: {command}")
     
-    def _call_webhook(self, sensor_data):
+    def _call_webhook(self, sensor_data, session=None, timeout=10):
         """调用WebHook"""
         import requests
         from django.template import Template, Context
@@ -395,14 +408,17 @@ class Action(models.Model):
                 'timestamp': sensor_data.timestamp.isoformat(),
             }
         
-        # 发送HTTP请求
+        # 发送HTTP请求（优先复用会话中的连接）
+        http = session or requests
         method = self.webhook_method or 'POST'
         if method == 'GET':
-            response = requests.get(self.webhook_url, params=payload)
+            response = http.get(self.webhook_url, params=payload, timeout=timeout)
         else:
-            response = requests.post(self.webhook_url, json=payload)
+            response = http.post(self.webhook_url, json=payload, timeout=timeout)
         
-        # 检查响应
+        # 检查响应，服务端错误和限流可重试
+        if response.status_code >= 500 or response.status_code == 429:
+            raise ActionRetryableError(f"WebHook请求失败，状态码: {response.status_code}, 响应: {response.text}")
         if not response.ok:
             raise Exception(f"WebHook请求失败，状态码: {response.status_code}, 响应: {response.text}")
         
@@ -422,6 +438,9 @@ class StrategyLog(models.Model):
         verbose_name = '策略日志'
         verbose_name_plural = '策略日志'
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['strategy', '-timestamp'])
+        ]
     
     def __str__(self):
         return f"{self.strategy.name} {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')} {'成功' if self.result else '失败'}"
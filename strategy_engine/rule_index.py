@@ -0,0 +1,240 @@
+import logging
+import operator
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Count, Prefetch
+
+logger = logging.getLogger(__name__)
+
+
+# 比较运算符 -> 比较函数
+OPERATORS = {
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+# 阈值类型 -> SensorData上对应的取值字段
+VALUE_FIELDS = {
+    'float': 'value_float',
+    'string': 'value_string',
+    'boolean': 'value_boolean',
+}
+
+
+class CompiledCondition(namedtuple('CompiledCondition', [
+    'sensor_id', 'compare', 'value_field', 'threshold', 'logical_operator_to_next'
+])):
+    """预解析的条件：比较函数、取值字段和阈值在编译时确定"""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_condition(cls, condition):
+        """从Condition实例编译"""
+        return cls(
+            sensor_id=condition.sensor_id,
+            compare=OPERATORS.get(condition.operator),
+            value_field=VALUE_FIELDS.get(condition.threshold_value_type),
+            threshold=condition.get_threshold_value(),
+            logical_operator_to_next=condition.logical_operator_to_next,
+        )
+
+    def evaluate(self, sensor_data):
+        """评估条件是否满足，语义与Condition.evaluate一致"""
+        if self.value_field is None or self.compare is None:
+            return False
+
+        actual_value = getattr(sensor_data, self.value_field)
+        if actual_value is None or self.threshold is None:
+            return False
+
+        return self.compare(actual_value, self.threshold)
+
+
+def evaluate_condition_chain(conditions, sensor_data):
+    """
+    按顺序评估条件链，语义与Strategy.evaluate_conditions一致：
+    只评估关注当前传感器的条件，并按上一条件的逻辑运算符组合结果
+    :param conditions: 按id排序的CompiledCondition序列
+    """
+    result = None
+
+    for i, condition in enumerate(conditions):
+        # 如果当前传感器数据不是条件关注的传感器，跳过
+        if condition.sensor_id != sensor_data.sensor_id:
+            continue
+
+        current_result = condition.evaluate(sensor_data)
+
+        if i == 0:
+            result = current_result
+        else:
+            logical_operator = conditions[i - 1].logical_operator_to_next
+            if logical_operator == 'AND':
+                result = result and current_result
+            elif logical_operator == 'OR':
+                result = result or current_result
+
+    # 如果没有评估任何条件（没有匹配的传感器），返回False
+    return bool(result)
+
+
+class CompiledStrategy(namedtuple('CompiledStrategy', [
+    'pk', 'name', 'trigger_device_id', 'conditions', 'sensor_ids', 'has_actions'
+])):
+    """预编译的策略：条件链 + 该策略关注的传感器集合"""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_strategy(cls, strategy, conditions, has_actions):
+        """
+        编译策略
+        :param conditions: 按id排序的Condition实例（需已select_related('sensor')）
+        """
+        compiled = tuple(CompiledCondition.from_condition(condition) for condition in conditions)
+
+        # 只有属于触发设备的传感器才可能满足条件
+        sensor_ids = frozenset(
+            condition.sensor_id for condition in conditions
+            if condition.sensor.device_id == strategy.trigger_source_device_id
+        )
+
+        return cls(
+            pk=strategy.pk,
+            name=strategy.name,
+            trigger_device_id=strategy.trigger_source_device_id,
+            conditions=compiled,
+            sensor_ids=sensor_ids,
+            has_actions=has_actions,
+        )
+
+    def evaluate(self, sensor_data):
+        """评估传感器数据是否满足策略条件"""
+        return evaluate_condition_chain(self.conditions, sensor_data)
+
+
+class StrategyRuleIndex:
+    """
+    策略规则索引
+
+    以传感器id为键保存所有启用策略的预编译条件链。新数据到达时只需一次字典查找，
+    没有任何策略关注的传感器不会产生数据库查询。
+    - 首次使用时全量构建
+    - Strategy/Condition/Action变更时按策略增量重建
+    - 超过ttl秒后全量重建，用于兜底其他进程中的修改
+    """
+
+    def __init__(self, ttl=60):
+        """初始化索引"""
+        self.ttl = ttl
+        self._by_sensor = {}    # 传感器id -> (CompiledStrategy, ...)
+        self._strategies = {}   # 策略主键 -> CompiledStrategy
+        self._built_at = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_settings(cls):
+        """根据settings.STRATEGY_ENGINE_CONFIG创建索引"""
+        config = getattr(settings, 'STRATEGY_ENGINE_CONFIG', {})
+        return cls(ttl=config.get('RULE_INDEX_TTL', 60))
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def rules_for_sensor(self, sensor_id):
+        """获取关注指定传感器的已编译策略"""
+        if self._built_at is None or (self.ttl and time.monotonic() - self._built_at > self.ttl):
+            self.rebuild()
+        return self._by_sensor.get(sensor_id, ())
+
+    def _queryset(self):
+        """加载启用策略及其条件的查询集"""
+        from .models import Strategy, Condition
+
+        return Strategy.objects.filter(is_enabled=True).annotate(
+            action_count=Count('actions')
+        ).prefetch_related(
+            Prefetch('conditions', queryset=Condition.objects.select_related('sensor').order_by('id'))
+        )
+
+    def _compile(self, strategy):
+        """编译单个策略，没有条件的策略不进入索引"""
+        conditions = list(strategy.conditions.all())
+        if not conditions:
+            return None
+        return CompiledStrategy.from_strategy(strategy, conditions, strategy.action_count > 0)
+
+    def rebuild(self):
+        """全量重建索引"""
+        started = time.monotonic()
+        strategies = {}
+        for strategy in self._queryset():
+            compiled = self._compile(strategy)
+            if compiled is not None:
+                strategies[compiled.pk] = compiled
+
+        by_sensor = {}
+        for compiled in strategies.values():
+            for sensor_id in compiled.sensor_ids:
+                by_sensor.setdefault(sensor_id, []).append(compiled)
+
+        with self._lock:
+            self._strategies = strategies
+            self._by_sensor = {sensor_id: tuple(rules) for sensor_id, rules in by_sensor.items()}
+            self._built_at = time.monotonic()
+
+        logger.debug(f"策略规则索引已重建: {len(strategies)} 个策略，{len(by_sensor)} 个传感器，"
+                     f"耗时 {(time.monotonic() - started) * 1000:.1f}ms")
+
+    def refresh_strategy(self, strategy_pk):
+        """增量重建单个策略（策略被删除或禁用时从索引中移除）"""
+        if self._built_at is None:
+            # 尚未构建时无需处理，首次使用会全量加载
+            return
+
+        strategy = self._queryset().filter(pk=strategy_pk).first()
+        compiled = self._compile(strategy) if strategy is not None else None
+
+        with self._lock:
+            self._remove(strategy_pk)
+            if compiled is not None:
+                self._strategies[compiled.pk] = compiled
+                for sensor_id in compiled.sensor_ids:
+                    self._by_sensor[sensor_id] = self._by_sensor.get(sensor_id, ()) + (compiled,)
+
+    def remove_strategy(self, strategy_pk):
+        """从索引中移除策略"""
+        with self._lock:
+            self._remove(strategy_pk)
+
+    def _remove(self, strategy_pk):
+        """移除策略（调用方需持有锁）"""
+        old = self._strategies.pop(strategy_pk, None)
+        if old is None:
+            return
+        for sensor_id in old.sensor_ids:
+            rules = tuple(rule for rule in self._by_sensor.get(sensor_id, ()) if rule.pk != strategy_pk)
+            if rules:
+                self._by_sensor[sensor_id] = rules
+            else:
+                self._by_sensor.pop(sensor_id, None)
+
+    def clear(self):
+        """清空索引，下次使用时全量重建"""
+        with self._lock:
+            self._strategies = {}
+            self._by_sensor = {}
+            self._built_at = None
+
+
+# 进程级索引实例
+rule_index = StrategyRuleIndex.from_settings()
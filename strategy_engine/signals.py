@@ -1,13 +1,18 @@
 import logging
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from core.metrics import STAGE_LATENCY
+from core.profiling import profiled, span
 from iot_devices.models import SensorData
-from .models import Strategy
+from .models import Strategy, Condition, Action
+from .rule_index import rule_index
 
 logger = logging.getLogger(__name__)
 
 
 @receiver(post_save, sender=SensorData)
+@profiled('signal.evaluate_strategies')
 def evaluate_strategies(sender, instance, created, **kwargs):
     """
     当新的传感器数据保存时，评估所有相关策略
@@ -20,31 +25,60 @@ def evaluate_strategies(sender, instance, created, **kwargs):
         # 只对新创建的传感器数据进行处理
         return
     
-    # 获取传感器对应的设备
-    device = instance.sensor.device
+    # 从规则索引中查找关注该传感器的已启用策略
+    rules = rule_index.rules_for_sensor(instance.sensor_id)
     
-    # 查找所有以该设备为触发源的已启用策略
-    strategies = Strategy.objects.filter(
-        trigger_source_device=device,
-        is_enabled=True
-    )
-    
-    if not strategies:
+    if not rules:
         # 没有相关策略，直接返回
         return
     
-    logger.info(f"找到 {strategies.count()} 个关联设备 {device.name} 的策略")
+    logger.info(f"找到 {len(rules)} 个关联传感器 {instance.sensor_id} 的策略")
     
     # 评估每个策略的条件
-    for strategy in strategies:
+    for rule in rules:
         try:
-            # 评估策略条件
-            if strategy.evaluate_conditions(instance):
-                logger.info(f"策略 {strategy.name} 条件满足，准备执行动作")
-                # 执行策略动作
+            # 评估预编译的策略条件
+            with STAGE_LATENCY.time(stage='evaluate'), span('strategy.evaluate'):
+                matched = rule.evaluate(instance)
+            if not matched:
+                logger.debug(f"策略 {rule.name} 条件不满足，不执行动作")
+                continue
+            
+            logger.info(f"策略 {rule.name} 条件满足，准备执行动作")
+            if not rule.has_actions:
+                continue
+            
+            # 只有条件满足时才加载策略模型
+            strategy = Strategy.objects.filter(pk=rule.pk, is_enabled=True).first()
+            if strategy is None:
+                # 策略已在其他进程中被删除或禁用
+                rule_index.refresh_strategy(rule.pk)
+                continue
+            
+            # 执行策略动作
+            with STAGE_LATENCY.time(stage='actions'):
                 strategy.execute_actions(instance)
-            else:
-                logger.debug(f"策略 {strategy.name} 条件不满足，不执行动作")
         
         except Exception as e:
-            logger.error(f"评估策略 {strategy.name} 时出错: {str(e)}") 
\ No newline at end of file
+            logger.error(f"评估策略 {rule.name} 时出错: {str(e)}")
+
+
+def _refresh_rule_index(strategy_pk):
+    """事务提交后增量重建规则索引中的策略"""
+    transaction.on_commit(lambda: rule_index.refresh_strategy(strategy_pk))
+
+
+@receiver(post_save, sender=Strategy)
+@receiver(post_delete, sender=Strategy)
+def update_rule_index_for_strategy(sender, instance, **kwargs):
+    """策略变更时更新规则索引"""
+    _refresh_rule_index(instance.pk)
+
+
+@receiver(post_save, sender=Condition)
+@receiver(post_delete, sender=Condition)
+@receiver(post_save, sender=Action)
+@receiver(post_delete, sender=Action)
+def update_rule_index_for_strategy_part(sender, instance, **kwargs):
+    """条件或动作变更时更新所属策略的规则索引"""
+    _refresh_rule_index(instance.strategy_id)
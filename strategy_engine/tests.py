@@ -1,3 +1,46 @@
-from django.test import TestCase
+import heapq
+from unittest import mock
 
-# Create your tests here.
+from django.db.migrations.loader import MigrationLoader
+from django.test import SimpleTestCase
+
+from .executor import ActionExecutor, ActionJob
+from .models import StrategyLog
+
+
+class MigrationIndexTests(SimpleTestCase):
+    """迁移中的索引名与模型一致（否则makemigrations会生成重命名索引的迁移）"""
+
+    def test_strategy_log_timestamp_index(self):
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        migration = loader.get_migration('strategy_engine', '0002_strategylog_strategy_timestamp_index')
+        migration_indexes = {
+            operation.index.name: operation.index.fields
+            for operation in migration.operations if hasattr(operation, 'index')
+        }
+        model_indexes = {index.name: index.fields for index in StrategyLog._meta.indexes}
+        self.assertEqual(migration_indexes['strategy_en_strateg_c55068_idx'],
+                         model_indexes.get('strategy_en_strateg_c55068_idx'))
+
+
+class RetrySchedulingTests(SimpleTestCase):
+    """到期重试任务的调度"""
+
+    def test_due_retries_requeued_and_overflow_recorded_outside_lock(self):
+        executor = ActionExecutor(max_queue_size=1)
+        jobs = [ActionJob(mock.Mock(pk=i), None, 2) for i in range(3)]
+        for i, job in enumerate(jobs):
+            heapq.heappush(executor._retry_heap, (float(i), next(executor._retry_counter), job))
+
+        recorded = []
+
+        def record(job, result, message):
+            self.assertFalse(executor._retry_lock.locked())
+            recorded.append(job)
+
+        with mock.patch.object(executor, '_record', side_effect=record):
+            executor._requeue_due_retries(1.5)
+
+        self.assertIs(executor.queue.get_nowait(), jobs[0])
+        self.assertEqual(recorded, [jobs[1]])
+        self.assertEqual([entry[2] for entry in executor._retry_heap], [jobs[2]])
@@ -7,6 +7,7 @@ from django.contrib import messages
 from django.http import JsonResponse, HttpResponseForbidden
 from django.db.models import Q
 
+from core.pagination import KeysetPaginationMixin
 from iot_devices.models import Project, Device
 from .models import Strategy, Condition, Action, StrategyLog
 from .forms import StrategyForm, ConditionForm, ActionForm
@@ -405,7 +406,7 @@ class ActionDeleteView(LoginRequiredMixin, DeleteView):
 
 
 # 策略日志视图
-class StrategyLogListView(LoginRequiredMixin, ListView):
+class StrategyLogListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """策略日志列表视图"""
     model = StrategyLog
     template_name = 'strategy_engine/strategy_log_list.html'
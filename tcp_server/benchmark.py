@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+TCP服务器帧处理性能测试
+
+对比默认asyncio事件循环 + 标准库json与uvloop + orjson/ujson的帧处理速度（帧/秒）。
+测试在本机回环地址上启动一个只做分帧、JSON解析和应答编码的服务器（不访问数据库），
+由多个并发客户端流水线发送传感器数据帧并等待应答。
+
+使用方法:
+python tcp_server/benchmark.py [--clients 50] [--frames 2000] [--framing newline|length]
+
+另外会单独测试各JSON库的编解码速度（与网络无关）。
+未安装的事件循环或JSON库会被跳过。
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import importlib.util
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.codec import CODEC_PREFERENCE, JSONCodec
+from tcp_server.framing import FRAMERS
+
+
+def sample_message(index: int):
+    """构造一条典型的传感器数据消息"""
+    return {
+        "type": "data",
+        "device_id": "DEV-BENCHMARK",
+        "timestamp": 1651234567 + index,
+        "data": {
+            "temperature": round(random.uniform(15, 35), 2),
+            "humidity": round(random.uniform(30, 90), 2),
+            "pressure": round(random.uniform(990, 1030), 1),
+            "status": "正常",
+        },
+    }
+
+
+def available_codecs():
+    """已安装的JSON库，标准库json在前作为基准"""
+    return [
+        JSONCodec(name) for name in reversed(CODEC_PREFERENCE)
+        if name == 'json' or importlib.util.find_spec(name) is not None
+    ]
+
+
+def available_loops():
+    """已安装的事件循环实现 -> 运行函数"""
+    loops = {'asyncio': asyncio.run}
+    try:
+        import uvloop
+        loops['uvloop'] = uvloop.run
+    except ImportError:
+        pass
+    return loops
+
+
+async def handle_client(reader, writer, codec, framing):
+    """模拟TCPDeviceConsumer的帧处理：分帧 -> 解析 -> 应答"""
+    framer = FRAMERS[framing]()
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        framer.feed(data)
+        for frame in framer.frames():
+            message = codec.loads(frame)
+            writer.write(framer.encode(codec.dumps({
+                "type": "data_ack",
+                "timestamp": message["timestamp"],
+                "device_id": message["device_id"],
+            })))
+        await writer.drain()
+    writer.close()
+
+
+async def run_client(port, payloads, framing, codec):
+    """发送全部数据帧并等待所有应答"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    framer = FRAMERS[framing]()
+
+    async def receive():
+        received = 0
+        while received < len(payloads):
+            data = await reader.read(65536)
+            if not data:
+                raise ConnectionError("服务器提前关闭连接")
+            framer.feed(data)
+            for frame in framer.frames():
+                codec.loads(frame)
+                received += 1
+
+    receiver = asyncio.create_task(receive())
+    for payload in payloads:
+        writer.write(payload)
+        await writer.drain()
+    await receiver
+
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run_network(codec, framing, clients, frames):
+    """启动回环服务器并运行所有客户端，返回帧/秒"""
+    server = await asyncio.start_server(
+        lambda r, w: handle_client(r, w, codec, framing), '127.0.0.1', 0
+    )
+    port = server.sockets[0].getsockname()[1]
+
+    encoder = FRAMERS[framing]()
+    payloads = [encoder.encode(codec.dumps(sample_message(i))) for i in range(frames)]
+
+    started = time.perf_counter()
+    async with server:
+        await asyncio.gather(*(run_client(port, payloads, framing, codec) for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    return clients * frames / elapsed
+
+
+def bench_codec(codec, iterations):
+    """单独测试JSON编解码速度，返回(解析次数/秒, 编码次数/秒)"""
+    message = sample_message(0)
+    frame = memoryview(bytearray(codec.dumps(message)))
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        codec.loads(frame)
+    loads_rate = iterations / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        codec.dumps(message)
+    dumps_rate = iterations / (time.perf_counter() - started)
+    return loads_rate, dumps_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NovaCloud TCP服务器帧处理性能测试')
+    parser.add_argument('--clients', type=int, default=50, help='并发连接数')
+    parser.add_argument('--frames', type=int, default=2000, help='每个连接发送的帧数')
+    parser.add_argument('--framing', choices=sorted(FRAMERS), default='newline', help='分帧方式')
+    parser.add_argument('--iterations', type=int, default=100000, help='JSON编解码测试次数')
+    args = parser.parse_args()
+
+    codecs = available_codecs()
+    loops = available_loops()
+
+    print(f"JSON编解码（{args.iterations} 次）")
+    for codec in codecs:
+        loads_rate, dumps_rate = bench_codec(codec, args.iterations)
+        print(f"  {codec.name:<8} 解析 {loads_rate:>12,.0f}/s  编码 {dumps_rate:>12,.0f}/s")
+
+    print(f"\n回环TCP（{args.clients} 个连接 x {args.frames} 帧，{args.framing}分帧）")
+    baseline = None
+    for loop_name, run in loops.items():
+        for codec in codecs:
+            rate = run(run_network(codec, args.framing, args.clients, args.frames))
+            baseline = baseline or rate
+            print(f"  {loop_name:<8} + {codec.name:<8} {rate:>12,.0f} 帧/s  ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
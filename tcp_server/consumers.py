@@ -1,11 +1,18 @@
-import json
+import asyncio
 import logging
+import time
 from channels.consumer import AsyncConsumer
 from django.conf import settings
 from django.utils import timezone
-from django.db import transaction, IntegrityError
 from asgiref.sync import sync_to_async
-from iot_devices.models import Device, Sensor, SensorData
+from core import codec, events
+from core.metrics import DECODE_ERRORS, MESSAGES_RECEIVED, STAGE_LATENCY, WRITE_ERRORS
+from core.profiling import profiled, span
+from iot_devices.cache import device_metadata_cache
+from iot_devices.commands import acknowledge_command
+from iot_devices.ingest import PendingReading, send_post_save_signals, write_readings
+from iot_devices.models import Device
+from .framing import DelimiterFramer, FrameTooLarge, FRAMERS
 
 logger = logging.getLogger(__name__)
 
@@ -17,11 +24,23 @@ class TCPDeviceConsumer(AsyncConsumer):
         super().__init__(*args, **kwargs)
         self.device = None
         self.device_id = None
-        self.buffer = b''
         self.config = settings.TCP_SERVER_CONFIG
         self.authenticated = False
         self.delimiter = self.config.get('FRAME_DELIMITER', b'\n')
         self.max_size = self.config.get('MAX_MESSAGE_SIZE', 131072)  # 默认128KB
+        # 认证前使用分隔符分帧，认证时可协商为长度前缀分帧
+        self.framer = DelimiterFramer(self.delimiter, self.max_size)
+        # 服务器全局的帧处理并发限制（asyncio.Semaphore），由TCP服务器设置
+        self.frame_limiter = None
+        self.frames_received = 0
+        # 数据消息批量写入：最多累积batch_size帧或等待batch_delay秒后一次写入
+        self.batch_size = max(self.config.get('DATA_BATCH_SIZE', 1), 1)
+        self.batch_delay = self.config.get('DATA_BATCH_DELAY', 0.005)
+        self.pending_data = []
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+        # 数据确认方式：each为每帧一条确认，batch为每批一条合并确认（认证时协商）
+        self.ack_mode = 'each'
     
     async def tcp_connect(self, event):
         """
@@ -37,22 +56,31 @@ class TCPDeviceConsumer(AsyncConsumer):
         data = event.get('data', b'')
         
         # 将数据添加到缓冲区
-        self.buffer += data
+        self.framer.feed(data)
         
-        # 如果缓冲区超过最大大小，则断开连接
-        if len(self.buffer) > self.max_size:
-            logger.warning(f"缓冲区溢出，断开连接: {self.scope['client']}")
-            await self.tcp_close()
-            return
+        try:
+            # 处理缓冲区中的完整消息
+            while True:
+                framer = self.framer
+                for frame in framer.frames():
+                    self.frames_received += 1
+                    # 处理接收到的帧
+                    if self.frame_limiter is None:
+                        await self.process_frame(frame)
+                    else:
+                        async with self.frame_limiter:
+                            await self.process_frame(frame)
+                    
+                    # 认证时切换了分帧方式，剩余数据交给新的分帧器处理
+                    if self.framer is not framer:
+                        break
+                else:
+                    break
         
-        # 处理缓冲区中的完整消息
-        while self.delimiter in self.buffer:
-            pos = self.buffer.find(self.delimiter)
-            frame = self.buffer[:pos]
-            self.buffer = self.buffer[pos + len(self.delimiter):]
-            
-            # 处理接收到的帧
-            await self.process_frame(frame)
+        except FrameTooLarge as e:
+            # 如果消息超过最大大小，则断开连接
+            logger.warning(f"缓冲区溢出，断开连接: {self.scope['client']}, {str(e)}")
+            await self.tcp_close()
     
     async def tcp_disconnect(self, event):
         """
@@ -61,6 +89,9 @@ class TCPDeviceConsumer(AsyncConsumer):
         logger.info(f"TCP连接断开: {self.scope['client']}, code: {event.get('code', '')}")
         
         if self.device and self.authenticated:
+            # 写入尚未写入的数据
+            await self.flush_data()
+            
             # 更新设备状态为离线
             await self.update_device_status("offline")
     
@@ -77,13 +108,24 @@ class TCPDeviceConsumer(AsyncConsumer):
             "data": data
         })
     
+    @profiled('tcp.process_frame')
     async def process_frame(self, frame):
         """
         处理单个完整的数据帧
+        frame为指向接收缓冲区的memoryview，只在本次调用期间有效
         """
+        MESSAGES_RECEIVED.inc(protocol='tcp')
+        # 只有解析失败才报告为无效JSON（DecodeError是ValueError的子类，处理消息时的ValueError不能算作解析失败）
+        try:
+            with STAGE_LATENCY.time(stage='decode'), span('tcp.decode'):
+                message = codec.loads(frame)
+        except codec.DecodeError:
+            DECODE_ERRORS.inc(protocol='tcp')
+            logger.error(f"无效的JSON数据: {bytes(frame[:200])}")
+            await self.send_error("invalid_json", "无效的JSON格式")
+            return
+        
         try:
-            # 尝试解析JSON数据
-            message = json.loads(frame.decode('utf-8'))
             logger.debug(f"处理TCP数据: {message}")
             
             # 如果尚未认证，则尝试认证
@@ -93,10 +135,6 @@ class TCPDeviceConsumer(AsyncConsumer):
                 # 已认证的消息处理
                 await self.process_message(message)
         
-        except json.JSONDecodeError:
-            logger.error(f"无效的JSON数据: {frame}")
-            await self.send_error("invalid_json", "无效的JSON格式")
-        
         except Exception as e:
             logger.exception(f"处理数据帧时出错: {str(e)}")
             await self.send_error("internal_error", str(e))
@@ -127,12 +165,23 @@ class TCPDeviceConsumer(AsyncConsumer):
                 # 更新设备状态为在线
                 await self.update_device_status("online")
                 
-                # 发送认证成功响应
+                # 协商分帧方式（不支持的方式保持分隔符分帧）
+                framer_class = FRAMERS.get(message.get('framing'), DelimiterFramer)
+                
+                # 协商数据确认方式
+                self.ack_mode = 'batch' if message.get('ack') == 'batch' else 'each'
+                
+                # 发送认证成功响应（仍使用认证前的分帧方式）
                 await self.send_response({
                     "type": "auth_success",
                     "message": "认证成功",
+                    "framing": framer_class.name,
+                    "ack": self.ack_mode,
                     "timestamp": int(timezone.now().timestamp())
                 })
+                
+                if not isinstance(self.framer, framer_class):
+                    self.switch_framer(framer_class)
             else:
                 logger.warning(f"设备认证失败: {device_id}")
                 await self.send_error("auth_failed", "设备ID或密钥无效")
@@ -143,6 +192,16 @@ class TCPDeviceConsumer(AsyncConsumer):
             await self.send_error("auth_error", str(e))
             await self.tcp_close()
     
+    def switch_framer(self, framer_class):
+        """切换分帧方式，已接收但未处理的数据由新的分帧器继续解析"""
+        if framer_class is DelimiterFramer:
+            framer = DelimiterFramer(self.delimiter, self.max_size)
+        else:
+            framer = framer_class(self.max_size)
+        framer.feed(self.framer.remaining())
+        self.framer = framer
+        logger.info(f"设备 {self.device_id} 使用 {framer.name} 分帧")
+    
     @sync_to_async
     def validate_device(self, device_id, device_key):
         """
@@ -166,6 +225,9 @@ class TCPDeviceConsumer(AsyncConsumer):
         self.device.last_seen = timezone.now()
         self.device.save()
         logger.info(f"设备 {self.device_id} 状态已更新为: {status}")
+        events.publish(events.DEVICE_STATUS_CHANGED, {
+            'device_id': self.device_id, 'status': status, 'timestamp': self.device.last_seen.isoformat(),
+        })
     
     async def process_message(self, message):
         """
@@ -177,9 +239,17 @@ class TCPDeviceConsumer(AsyncConsumer):
         if msg_type == 'data':
             # 处理数据消息
             await self.process_data_message(message)
-        elif msg_type == 'status':
+            return
+        
+        # 其他消息在已接收的数据写入之后处理，保持与发送顺序一致
+        await self.flush_data()
+        
+        if msg_type == 'status':
             # 处理状态消息
             await self.process_status_message(message)
+        elif msg_type in ('response', 'command_response'):
+            # 处理命令响应
+            await self.process_command_response(message)
         else:
             logger.warning(f"未知的消息类型: {msg_type}")
             await self.send_error("unknown_type", f"未知的消息类型: {msg_type}")
@@ -187,26 +257,81 @@ class TCPDeviceConsumer(AsyncConsumer):
     async def process_data_message(self, message):
         """
         处理数据消息
+        消息先进入本连接的待写入队列，达到批量大小或等待时间后统一写入并发送确认
         """
-        try:
-            # 确保消息包含时间戳
-            if 'timestamp' not in message:
-                message['timestamp'] = int(timezone.now().timestamp())
+        # 确保消息包含时间戳
+        if 'timestamp' not in message:
+            message['timestamp'] = int(timezone.now().timestamp())
+        
+        self.pending_data.append(message)
+        
+        if len(self.pending_data) >= self.batch_size:
+            await self.flush_data()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.delayed_flush())
+    
+    async def delayed_flush(self):
+        """等待batch_delay秒后写入未满的批次"""
+        await asyncio.sleep(self.batch_delay)
+        self.flush_task = None
+        await self.flush_data()
+    
+    async def flush_data(self):
+        """写入本连接待写入的数据消息并发送确认"""
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        
+        async with self.flush_lock:
+            messages, self.pending_data = self.pending_data, []
+            if not messages:
+                return
             
-            # 存储传感器数据
-            result = await self.store_sensor_data(message)
+            try:
+                result = await self.store_sensor_data(messages)
+            except Exception as e:
+                logger.exception(f"处理数据消息时出错: {str(e)}")
+                await self.send_data_error(messages, "data_process_error", str(e))
+                return
             
             if result:
-                await self.send_response({
-                    "type": "data_received",
-                    "timestamp": int(timezone.now().timestamp())
-                })
+                await self.send_data_ack(messages)
             else:
-                await self.send_error("data_store_failed", "存储传感器数据失败")
+                await self.send_data_error(messages, "data_store_failed", "存储传感器数据失败")
+    
+    async def send_data_ack(self, messages):
+        """发送数据确认，消息中带有seq时确认中回传对应的序号"""
+        timestamp = int(timezone.now().timestamp())
         
-        except Exception as e:
-            logger.exception(f"处理数据消息时出错: {str(e)}")
-            await self.send_error("data_process_error", str(e))
+        if self.ack_mode == 'batch':
+            await self.send_response({
+                "type": "data_received",
+                "count": len(messages),
+                "seqs": [message['seq'] for message in messages if 'seq' in message],
+                "timestamp": timestamp
+            })
+            return
+        
+        for message in messages:
+            response = {
+                "type": "data_received",
+                "timestamp": timestamp
+            }
+            if 'seq' in message:
+                response['seq'] = message['seq']
+            await self.send_response(response)
+    
+    async def send_data_error(self, messages, code, error_message):
+        """发送数据写入失败的错误消息"""
+        if self.ack_mode == 'batch':
+            await self.send_error(code, error_message, {
+                "count": len(messages),
+                "seqs": [message['seq'] for message in messages if 'seq' in message],
+            })
+            return
+        
+        for message in messages:
+            await self.send_error(code, error_message, {"seq": message['seq']} if 'seq' in message else None)
     
     async def process_status_message(self, message):
         """
@@ -231,43 +356,45 @@ class TCPDeviceConsumer(AsyncConsumer):
             logger.exception(f"处理状态消息时出错: {str(e)}")
             await self.send_error("status_process_error", str(e))
     
+    async def process_command_response(self, message):
+        """
+        处理命令响应（更新命令记录并发布命令确认事件，不回复设备）
+        """
+        try:
+            await sync_to_async(acknowledge_command)(self.device_id, message)
+        except Exception as e:
+            logger.exception(f"处理命令响应时出错: {str(e)}")
+            await self.send_error("response_process_error", str(e))
+    
     @sync_to_async
-    def store_sensor_data(self, data):
+    @profiled('tcp.store_sensor_data')
+    def store_sensor_data(self, messages):
         """
-        存储传感器数据
+        在一个事务中存储一批数据消息（一次bulk_create，设备状态合并为一条UPDATE）
         """
         try:
-            with transaction.atomic():
-                # 更新设备状态
-                self.device.status = 'online'
-                self.device.last_seen = timezone.now()
-                self.device.save()
-                
-                # 处理传感器数据
-                for sensor in Sensor.objects.filter(device=self.device):
-                    if sensor.value_key in data:
-                        sensor_value = data[sensor.value_key]
-                        logger.info(f"传感器 {sensor.name} 数据: {sensor_value} {sensor.unit}")
-                        
-                        # 根据数据类型保存到对应字段
-                        sensor_data = SensorData(sensor=sensor)
-                        
-                        if isinstance(sensor_value, (int, float)):
-                            sensor_data.value_float = float(sensor_value)
-                        elif isinstance(sensor_value, bool):
-                            sensor_data.value_boolean = sensor_value
-                        else:
-                            sensor_data.value_string = str(sensor_value)
-                        
-                        # 保存数据
-                        sensor_data.save()
-                        logger.debug(f"保存传感器数据: {sensor_data}")
-                
-                return True
+            # 传感器列表来自进程内元数据缓存
+            if device_metadata_cache.get(self.device_id) is None:
+                logger.warning(f"设备 {self.device_id} 已不存在")
+                return False
+            
+            received_at = time.monotonic()
+            batch = [PendingReading(self.device_id, message, received_at) for message in messages]
+            created, _, signals_sent = write_readings(batch)
+            
+            self.device.status = 'online'
+            self.device.last_seen = timezone.now()
+            logger.debug(f"设备 {self.device_id} 写入 {len(messages)} 条消息，{len(created)} 条传感器数据")
         
         except Exception as e:
+            WRITE_ERRORS.inc()
             logger.exception(f"存储传感器数据时出错: {str(e)}")
             return False
+        
+        # 事务提交后补发post_save信号
+        if not signals_sent:
+            send_post_save_signals(created)
+        return True
     
     async def send_response(self, data):
         """
@@ -278,12 +405,11 @@ class TCPDeviceConsumer(AsyncConsumer):
             if 'device_id' not in data and self.device_id:
                 data['device_id'] = self.device_id
             
-            response_json = json.dumps(data)
-            await self.tcp_send(response_json.encode('utf-8') + self.delimiter)
+            await self.tcp_send(self.framer.encode(codec.dumps(data)))
         except Exception as e:
             logger.exception(f"发送响应失败: {str(e)}")
     
-    async def send_error(self, code, message):
+    async def send_error(self, code, message, extra=None):
         """
         发送错误消息
         """
@@ -294,12 +420,13 @@ class TCPDeviceConsumer(AsyncConsumer):
                 "message": message,
                 "timestamp": int(timezone.now().timestamp())
             }
+            if extra:
+                error_data.update(extra)
             
             if self.device_id:
                 error_data['device_id'] = self.device_id
             
-            error_json = json.dumps(error_data)
-            await self.tcp_send(error_json.encode('utf-8') + self.delimiter)
+            await self.tcp_send(self.framer.encode(codec.dumps(error_data)))
         
         except Exception as e:
             logger.exception(f"发送错误消息失败: {str(e)}") 
\ No newline at end of file
@@ -0,0 +1,156 @@
+import struct
+
+
+class FrameTooLarge(Exception):
+    """单帧（或未完成的帧）超过最大消息大小"""
+
+
+class BaseFramer:
+    """
+    TCP流分帧器基类
+
+    接收的数据追加到同一个bytearray中，用两个偏移量代替反复切片：
+    - _start: 下一帧的起始位置，之前的数据已被消费
+    - _scan: 下一次查找帧边界的起始位置，已扫描过的数据不会被重复扫描
+    已消费的数据在每次feed时统一压缩，每个字节最多被移动一次。
+
+    frames()产出的帧是指向缓冲区的memoryview，不复制数据；
+    帧只在下一帧产出之前有效，需要保留时请调用bytes(frame)。
+    产出的帧尚未释放时（frames()的迭代暂停在yield处）不能调用feed()。
+    """
+
+    name = None
+
+    # 已消费数据超过该大小时才压缩缓冲区，避免频繁移动少量数据
+    COMPACT_THRESHOLD = 64 * 1024
+
+    def __init__(self, max_size=131072):
+        self.max_size = max_size
+        self.buffer = bytearray()
+        self._start = 0
+        self._scan = 0
+        self._frame_out = False  # frames()产出的帧是否仍引用缓冲区
+
+    def feed(self, data):
+        """
+        追加接收到的数据
+        必须在frames()的迭代结束（或生成器关闭）之后调用：产出的memoryview仍引用缓冲区时，
+        bytearray不能扩容或压缩，直接追加会抛出BufferError
+        :raises RuntimeError: frames()产出的帧尚未释放
+        """
+        if self._frame_out:
+            raise RuntimeError("frames()产出的帧尚未释放，请先结束迭代再调用feed()")
+        self._compact()
+        self.buffer += data
+
+    def frames(self):
+        """依次产出缓冲区中的完整帧"""
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            self._frame_out = True
+            try:
+                yield frame
+            finally:
+                # 释放对缓冲区的引用，否则bytearray无法扩容或压缩
+                frame.release()
+                self._frame_out = False
+
+        if len(self.buffer) - self._start > self.max_size:
+            raise FrameTooLarge(f"未完成的帧超过最大消息大小 {self.max_size} 字节")
+
+    def remaining(self):
+        """取出尚未消费的数据（切换分帧方式时交给新的分帧器）"""
+        data = bytes(self.buffer[self._start:])
+        self._start = self._scan = len(self.buffer)
+        return data
+
+    @property
+    def pending(self):
+        """尚未消费的字节数"""
+        return len(self.buffer) - self._start
+
+    def _compact(self):
+        """丢弃已消费的数据"""
+        if self._start == 0:
+            return
+        if self._start == len(self.buffer):
+            self.buffer.clear()
+        elif self._start >= self.COMPACT_THRESHOLD or self._start * 2 >= len(self.buffer):
+            del self.buffer[:self._start]
+        else:
+            return
+        self._scan -= self._start
+        self._start = 0
+
+    def _next_frame(self):
+        raise NotImplementedError
+
+    def encode(self, payload):
+        """为发送的数据加上帧格式"""
+        raise NotImplementedError
+
+
+class DelimiterFramer(BaseFramer):
+    """分隔符分帧（默认使用换行符）"""
+
+    name = 'newline'
+
+    def __init__(self, delimiter=b'\n', max_size=131072):
+        super().__init__(max_size)
+        self.delimiter = delimiter
+
+    def _next_frame(self):
+        pos = self.buffer.find(self.delimiter, self._scan)
+        if pos < 0:
+            # 分隔符可能跨两次接收，保留末尾len(delimiter)-1字节下次重新扫描
+            self._scan = max(self._start, len(self.buffer) - len(self.delimiter) + 1)
+            return None
+
+        if pos - self._start > self.max_size:
+            raise FrameTooLarge(f"消息超过最大大小 {self.max_size} 字节")
+
+        with memoryview(self.buffer) as view:
+            frame = view[self._start:pos]
+        self._start = self._scan = pos + len(self.delimiter)
+        return frame
+
+    def encode(self, payload):
+        return payload + self.delimiter
+
+
+class LengthPrefixFramer(BaseFramer):
+    """长度前缀分帧：4字节大端无符号整数表示帧长度，后跟帧内容"""
+
+    name = 'length'
+
+    HEADER = struct.Struct('>I')
+
+    def _next_frame(self):
+        header_end = self._start + self.HEADER.size
+        if len(self.buffer) < header_end:
+            return None
+
+        (length,) = self.HEADER.unpack_from(self.buffer, self._start)
+        if length > self.max_size:
+            raise FrameTooLarge(f"消息长度 {length} 超过最大大小 {self.max_size} 字节")
+
+        end = header_end + length
+        if len(self.buffer) < end:
+            return None
+
+        with memoryview(self.buffer) as view:
+            frame = view[header_end:end]
+        self._start = self._scan = end
+        return frame
+
+    def encode(self, payload):
+        return self.HEADER.pack(len(payload)) + payload
+
+
+# 认证消息中可协商的分帧方式
+FRAMERS = {
+    DelimiterFramer.name: DelimiterFramer,
+    LengthPrefixFramer.name: LengthPrefixFramer,
+}
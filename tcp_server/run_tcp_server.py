@@ -3,16 +3,23 @@
 TCP服务器启动脚本
 
 使用方法:
-python run_tcp_server.py
+python run_tcp_server.py [--workers N] [--loop auto|uvloop|asyncio]
 
 此脚本会启动一个TCP服务器，监听9000端口，处理设备连接。
+指定--workers N（N>1）时启动N个工作进程，通过SO_REUSEPORT共享监听端口，
+由主进程监控工作进程（异常退出时自动重启）并汇总连接数和吞吐量统计。
+已安装uvloop时默认使用uvloop事件循环，可用--loop asyncio关闭。
 """
 
 import os
 import sys
+import time
+import signal
+import socket
 import django
 import argparse
 import logging
+import multiprocessing
 from typing import Dict, Any, Optional, Callable
 import asyncio
 
@@ -23,6 +30,8 @@ django.setup()
 
 # 导入消费者类
 from tcp_server.consumers import TCPDeviceConsumer
+from core.metrics import QUEUE_DEPTH, TCP_CONNECTIONS, start_snapshot_writer
+from core.profiling import install_signal_handler
 
 # 从settings获取TCP配置
 from django.conf import settings
@@ -38,25 +47,94 @@ logger = logging.getLogger("tcp_server")
 class TCPServer:
     """TCP服务器类"""
     
-    def __init__(self, host: str, port: int):
-        """初始化TCP服务器"""
+    def __init__(self, host: str, port: int, config: Optional[Dict[str, Any]] = None,
+                 reuse_port: bool = False, stats_callback: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        初始化TCP服务器
+        :param reuse_port: 是否设置SO_REUSEPORT（多进程共享端口）
+        :param stats_callback: 定期接收统计信息的回调，默认输出到日志
+        """
         self.host = host
         self.port = port
         self.server = None
         self.clients = {}  # 客户端连接映射
+        self.reuse_port = reuse_port
+        self.stats_callback = stats_callback
+        
+        # 累计统计信息（进程启动以来）
+        self.stats = {
+            'connections_total': 0,
+            'connections_rejected': 0,
+            'bytes_received': 0,
+        }
+        self._closed_frames = 0  # 已关闭连接处理的帧数
+        
+        config = config if config is not None else settings.TCP_SERVER_CONFIG
+        self.read_size = config.get('BUFFER_SIZE', 65536)                # 单次读取的最大字节数
+        self.queue_size = config.get('CONNECTION_QUEUE_SIZE', 64)        # 每个连接待处理数据块的上限
+        self.max_connections = config.get('MAX_CONNECTIONS', 0)          # 最大并发连接数，0表示不限制
+        self.max_inflight_frames = config.get('MAX_INFLIGHT_FRAMES', 0)  # 全局同时处理的帧数上限，0表示不限制
+        self.frame_limiter = None
+        self.stats_interval = config.get('STATS_INTERVAL', 60)           # 统计信息输出间隔（秒），0表示不输出
+        
+        # 指标：当前连接数和各连接待处理的数据块数
+        TCP_CONNECTIONS.set_function(lambda: len(self.clients))
+        QUEUE_DEPTH.set_function(
+            lambda: sum(client['queue'].qsize() for client in list(self.clients.values())), queue='tcp_read'
+        )
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取当前统计信息（累计值）"""
+        frames = self._closed_frames + sum(client['consumer'].frames_received for client in self.clients.values())
+        return dict(
+            self.stats,
+            connections=len(self.clients),
+            frames_received=frames,
+            time=time.monotonic(),
+        )
+    
+    async def report_stats(self):
+        """定期输出统计信息"""
+        last = self.get_stats()
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            stats = self.get_stats()
+            if self.stats_callback is not None:
+                self.stats_callback(stats)
+            else:
+                elapsed = max(stats['time'] - last['time'], 1e-6)
+                logger.info(
+                    f"TCP服务器统计: 当前连接 {stats['connections']}，"
+                    f"接收 {(stats['bytes_received'] - last['bytes_received']) / 1024 / elapsed:.1f} KB/s，"
+                    f"帧 {(stats['frames_received'] - last['frames_received']) / elapsed:.1f}/s，"
+                    f"拒绝连接 {stats['connections_rejected']}"
+                )
+            last = stats
     
     async def start_server(self):
         """启动TCP服务器"""
         try:
+            # 全局帧处理并发限制（需在事件循环中创建）
+            if self.max_inflight_frames:
+                self.frame_limiter = asyncio.Semaphore(self.max_inflight_frames)
+            
             # 创建TCP服务器
             self.server = await asyncio.start_server(
                 self.handle_client,
                 self.host,
-                self.port
+                self.port,
+                reuse_port=self.reuse_port or None
             )
             
             addr = self.server.sockets[0].getsockname()
-            logger.info(f'TCP服务器开始运行在 {addr}')
+            logger.info(f'TCP服务器开始运行在 {addr}（进程 {os.getpid()}）')
+            
+            # 定期写入指标快照，供Web进程的指标接口导出
+            start_snapshot_writer('tcp')
+            
+            if self.stats_interval:
+                # 保存任务引用，避免被垃圾回收
+                self.stats_task = asyncio.create_task(self.report_stats())
             
             # 保持服务器运行
             async with self.server:
@@ -71,11 +149,30 @@ class TCPServer:
         # 获取客户端地址
         addr = writer.get_extra_info('peername')
         client_id = f"{addr[0]}:{addr[1]}"
-        logger.info(f"新的客户端连接: {client_id}")
+        
+        # 超过最大连接数时直接拒绝；检查和占用名额之间没有await，并发建立的连接不会同时通过检查
+        if self.max_connections and len(self.clients) >= self.max_connections:
+            self.stats['connections_rejected'] += 1
+            logger.warning(f"连接数已达上限 {self.max_connections}，拒绝连接: {client_id}")
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+            return
         
         # 创建消费者实例
         consumer = TCPDeviceConsumer()
         
+        # 读取和处理分离：读取到的数据放入有界队列，由处理任务按顺序交给消费者。
+        # 处理跟不上（例如数据库变慢）时队列被填满，读取暂停，由TCP流控把压力传回设备
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        
+        # 占用连接名额（在第一个await之前）
+        self.clients[client_id] = {"consumer": consumer, "writer": writer, "queue": queue}
+        self.stats['connections_total'] += 1
+        logger.info(f"新的客户端连接: {client_id}")
+        
         # 设置消费者作用域
         scope = {
             "type": "tcp",
@@ -94,51 +191,90 @@ class TCPServer:
                 writer.close()
                 await writer.wait_closed()
         
-        # 设置消费者的发送函数
+        # 设置消费者的发送函数和全局帧处理限制
         consumer.send = send
+        consumer.frame_limiter = self.frame_limiter
         
-        # 调用连接事件
-        await consumer.tcp_connect({"type": "tcp.connect"})
-        
-        # 保存客户端连接
-        self.clients[client_id] = {"consumer": consumer, "writer": writer}
-        
+        worker = None
+        code = "server_error"
         try:
+            # 调用连接事件
+            await consumer.tcp_connect({"type": "tcp.connect"})
+            
+            worker = asyncio.create_task(self.process_queue(consumer, queue, client_id))
+            
             # 读取数据循环
             while True:
-                # 读取数据，最大1KB
-                data = await reader.read(1024)
+                data = await reader.read(self.read_size)
                 
                 if not data:
-                    # 连接关闭
                     logger.info(f"客户端断开连接: {client_id}")
-                    await consumer.tcp_disconnect({"type": "tcp.disconnect", "code": "client_closed"})
+                    code = "client_closed"
                     break
                 
-                # 处理接收到的数据
-                await consumer.tcp_receive({"type": "tcp.receive", "data": data})
+                if worker.done():
+                    code = "worker_stopped"
+                    break
+                
+                self.stats['bytes_received'] += len(data)
+                
+                # 队列已满时在这里等待，暂停读取
+                await queue.put(data)
         
         except ConnectionError:
             logger.info(f"客户端连接断开: {client_id}")
+            code = "connection_error"
         
         except asyncio.CancelledError:
             logger.info(f"客户端连接被取消: {client_id}")
+            code = "cancelled"
         
         except Exception as e:
             logger.exception(f"处理客户端数据时出错: {str(e)}")
         
         finally:
+            # 无论以何种方式退出，已接收的数据都处理完并写入，已认证的设备标记为离线；
+            # 服务器关闭时连接任务被取消，清理过程用shield保护，不会被再次取消打断
+            try:
+                await asyncio.shield(self.finish_client(consumer, queue, worker, code))
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.exception(f"关闭客户端 {client_id} 时出错: {str(e)}")
+            
             # 关闭客户端连接
             writer.close()
             try:
                 await writer.wait_closed()
-            except Exception:
+            except (Exception, asyncio.CancelledError):
                 pass
             
             # 从客户端列表中移除
             self.clients.pop(client_id, None)
+            self._closed_frames += consumer.frames_received
             logger.info(f"客户端连接已关闭: {client_id}")
     
+    async def finish_client(self, consumer: TCPDeviceConsumer, queue: asyncio.Queue, worker, code: str):
+        """处理完队列中已接收的数据，再通知消费者断开（写入批次中剩余的数据、更新设备状态）"""
+        if worker is not None and not worker.done():
+            await queue.put(None)
+            await worker
+        await consumer.tcp_disconnect({"type": "tcp.disconnect", "code": code})
+        if consumer.flush_task is not None:
+            consumer.flush_task.cancel()
+    
+    async def process_queue(self, consumer: TCPDeviceConsumer, queue: asyncio.Queue, client_id: str):
+        """按接收顺序处理单个连接的数据块，收到None时结束"""
+        while True:
+            data = await queue.get()
+            if data is None:
+                return
+            
+            try:
+                await consumer.tcp_receive({"type": "tcp.receive", "data": data})
+            except Exception as e:
+                logger.exception(f"处理客户端 {client_id} 数据时出错: {str(e)}")
+    
     def stop(self):
         """停止TCP服务器"""
         if self.server:
@@ -146,6 +282,197 @@ class TCPServer:
             logger.info("TCP服务器已停止")
 
 
+def run_event_loop(main_coro, loop: str = 'auto'):
+    """
+    运行事件循环
+    :param loop: auto（已安装uvloop时使用uvloop）、uvloop或asyncio
+    """
+    if loop in ('auto', 'uvloop'):
+        try:
+            import uvloop
+        except ImportError:
+            if loop == 'uvloop':
+                logger.warning("uvloop未安装，使用默认asyncio事件循环")
+        else:
+            logger.info("使用uvloop事件循环")
+            return uvloop.run(main_coro)
+    return asyncio.run(main_coro)
+
+
+def run_worker(index: int, host: str, port: int, stats_queue, loop: str = 'auto'):
+    """工作进程入口：启动共享端口的TCP服务器，统计信息发送给主进程"""
+    # 主进程负责处理Ctrl+C，工作进程只响应SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # SIGUSR1开启/关闭本工作进程的性能剖析
+    install_signal_handler(f'tcp-worker-{index}')
+    
+    def send_stats(stats):
+        try:
+            stats_queue.put_nowait((index, os.getpid(), stats))
+        except Exception:
+            pass
+    
+    server = TCPServer(host, port, reuse_port=True, stats_callback=send_stats)
+    run_event_loop(server.start_server(), loop)
+
+
+class WorkerSupervisor:
+    """
+    多进程TCP服务器监控器
+    
+    启动N个工作进程，每个进程运行独立的事件循环和数据库连接，
+    通过SO_REUSEPORT绑定同一端口，由内核在进程间分配新连接。
+    - 工作进程异常退出时自动重启（频繁退出时按指数退避延迟重启）
+    - 汇总各工作进程上报的连接数和吞吐量并定期输出
+    """
+    
+    # 工作进程运行时间短于该值视为启动失败，重启延迟加倍
+    MIN_HEALTHY_RUNTIME = 10
+    MAX_RESTART_DELAY = 30
+    
+    def __init__(self, host: str, port: int, workers: int, stats_interval: int = 60, loop: str = 'auto'):
+        """初始化监控器"""
+        self.loop = loop
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.stats_interval = stats_interval
+        self.context = multiprocessing.get_context('fork')
+        self.stats_queue = self.context.Queue()
+        self.processes = {}     # 序号 -> Process
+        self.started_at = {}    # 序号 -> 启动时间
+        self.restart_delay = {i: 1 for i in range(workers)}
+        self.restart_at = {}    # 序号 -> 计划重启时间
+        self.worker_stats = {}  # 序号 -> (上一次统计, 最新统计, pid)
+        self.restarts = 0
+        self._stopping = False
+    
+    def spawn(self, index: int):
+        """启动一个工作进程"""
+        # fork前关闭数据库连接，避免子进程共享同一连接
+        from django.db import connections
+        connections.close_all()
+        
+        process = self.context.Process(
+            target=run_worker,
+            args=(index, self.host, self.port, self.stats_queue, self.loop),
+            name=f'tcp-worker-{index}',
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+        logger.info(f"TCP工作进程 {index} 已启动，pid {process.pid}")
+    
+    def run(self):
+        """启动全部工作进程并持续监控，直到收到终止信号"""
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        if hasattr(signal, 'SIGUSR1'):
+            # 性能剖析开关信号转发给所有工作进程
+            signal.signal(signal.SIGUSR1, self.forward_signal)
+        
+        for index in range(self.workers):
+            self.spawn(index)
+        logger.info(f"TCP服务器以 {self.workers} 个工作进程运行在 {self.host}:{self.port}")
+        
+        last_report = time.monotonic()
+        while not self._stopping:
+            time.sleep(0.5)
+            self.collect_stats()
+            self.check_workers()
+            
+            if self.stats_interval and time.monotonic() - last_report >= self.stats_interval:
+                self.log_stats()
+                last_report = time.monotonic()
+        
+        self.shutdown()
+    
+    def handle_signal(self, signum, frame):
+        logger.info("接收到终止信号，正在停止工作进程...")
+        self._stopping = True
+    
+    def forward_signal(self, signum, frame):
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+    
+    def check_workers(self):
+        """重启已退出的工作进程"""
+        now = time.monotonic()
+        for index, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            
+            if index not in self.restart_at:
+                runtime = now - self.started_at[index]
+                if runtime < self.MIN_HEALTHY_RUNTIME:
+                    self.restart_delay[index] = min(self.restart_delay[index] * 2, self.MAX_RESTART_DELAY)
+                else:
+                    self.restart_delay[index] = 1
+                self.restart_at[index] = now + self.restart_delay[index]
+                logger.warning(f"TCP工作进程 {index}（pid {process.pid}）已退出，退出码 {process.exitcode}，"
+                               f"{self.restart_delay[index]}s 后重启")
+            
+            if now >= self.restart_at[index]:
+                del self.restart_at[index]
+                self.worker_stats.pop(index, None)
+                self.restarts += 1
+                self.spawn(index)
+    
+    def collect_stats(self):
+        """读取工作进程上报的统计信息"""
+        while True:
+            try:
+                index, pid, stats = self.stats_queue.get_nowait()
+            except Exception:
+                return
+            previous = self.worker_stats.get(index)
+            # 工作进程重启后累计值重新开始计算
+            last = previous[1] if previous and previous[2] == pid else None
+            self.worker_stats[index] = (last, stats, pid)
+    
+    def log_stats(self):
+        """输出汇总统计"""
+        total_connections = 0
+        total_bytes_rate = 0.0
+        total_frames_rate = 0.0
+        details = []
+        
+        for index in sorted(self.worker_stats):
+            last, stats, pid = self.worker_stats[index]
+            bytes_rate = frames_rate = 0.0
+            if last is not None:
+                elapsed = max(stats['time'] - last['time'], 1e-6)
+                bytes_rate = (stats['bytes_received'] - last['bytes_received']) / elapsed
+                frames_rate = (stats['frames_received'] - last['frames_received']) / elapsed
+            
+            total_connections += stats['connections']
+            total_bytes_rate += bytes_rate
+            total_frames_rate += frames_rate
+            details.append(f"#{index}(pid {pid}) 连接 {stats['connections']} 帧 {frames_rate:.1f}/s")
+        
+        logger.info(
+            f"TCP服务器汇总: 工作进程 {sum(p.is_alive() for p in self.processes.values())}/{self.workers}，"
+            f"当前连接 {total_connections}，接收 {total_bytes_rate / 1024:.1f} KB/s，"
+            f"帧 {total_frames_rate:.1f}/s，累计重启 {self.restarts} 次；{'，'.join(details)}"
+        )
+    
+    def shutdown(self, timeout: float = 10):
+        """停止所有工作进程"""
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        
+        deadline = time.monotonic() + timeout
+        for process in self.processes.values():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                process.kill()
+        logger.info("TCP服务器已停止")
+
+
 async def main(host: str, port: int):
     """主函数"""
     server = TCPServer(host, port)
@@ -168,12 +495,32 @@ if __name__ == "__main__":
     
     parser.add_argument('--host', default=default_host, help='服务器绑定地址')
     parser.add_argument('--port', type=int, default=default_port, help='服务器端口')
+    parser.add_argument('--workers', type=int, default=settings.TCP_SERVER_CONFIG.get('WORKERS', 1),
+                        help='工作进程数，大于1时通过SO_REUSEPORT共享端口')
+    parser.add_argument('--loop', choices=('auto', 'uvloop', 'asyncio'),
+                        default=settings.TCP_SERVER_CONFIG.get('EVENT_LOOP', 'auto'),
+                        help='事件循环实现，auto表示已安装uvloop时使用uvloop')
     
     args = parser.parse_args()
     
+    if args.workers > 1:
+        if not hasattr(socket, 'SO_REUSEPORT') or sys.platform == 'win32':
+            logger.error("当前平台不支持SO_REUSEPORT，无法使用多进程模式")
+            sys.exit(1)
+        
+        WorkerSupervisor(
+            args.host, args.port, args.workers,
+            stats_interval=settings.TCP_SERVER_CONFIG.get('STATS_INTERVAL', 60),
+            loop=args.loop,
+        ).run()
+        sys.exit(0)
+    
+    # SIGUSR1开启/关闭性能剖析
+    install_signal_handler('tcp')
+    
     # 启动TCP服务器
     try:
-        asyncio.run(main(args.host, args.port))
+        run_event_loop(main(args.host, args.port), args.loop)
     except KeyboardInterrupt:
         logger.info("接收到终止信号，TCP服务器已停止")
         sys.exit(0) 
\ No newline at end of file
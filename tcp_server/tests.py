@@ -1,3 +1,316 @@
-from django.test import TestCase
+import asyncio
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase
+
+from core import codec
+
+from .consumers import TCPDeviceConsumer
+from .framing import DelimiterFramer, FrameTooLarge, LengthPrefixFramer
+from .run_tcp_server import TCPServer
+
+
+def collect(framer):
+    """取出分帧器中当前所有完整的帧（复制为bytes）"""
+    return [bytes(frame) for frame in framer.frames()]
+
+
+class DelimiterFramerTests(SimpleTestCase):
+    """分隔符分帧测试"""
+
+    def test_frame_split_across_reads(self):
+        framer = DelimiterFramer(b'\n')
+        framer.feed(b'{"a":')
+        self.assertEqual(collect(framer), [])
+        framer.feed(b'1}\n{"b"')
+        self.assertEqual(collect(framer), [b'{"a":1}'])
+        framer.feed(b':2}\n')
+        self.assertEqual(collect(framer), [b'{"b":2}'])
+        self.assertEqual(framer.pending, 0)
+
+    def test_multiple_frames_in_one_read(self):
+        framer = DelimiterFramer(b'\n')
+        framer.feed(b'a\nb\n\nc')
+        self.assertEqual(collect(framer), [b'a', b'b', b''])
+        self.assertEqual(framer.pending, 1)
+
+    def test_crlf_delimiter_split_across_reads(self):
+        framer = DelimiterFramer(b'\r\n')
+        framer.feed(b'first\r')
+        self.assertEqual(collect(framer), [])
+        framer.feed(b'\nsecond\r')
+        self.assertEqual(collect(framer), [b'first'])
+        framer.feed(b'\n')
+        self.assertEqual(collect(framer), [b'second'])
+
+    def test_complete_frame_too_large(self):
+        framer = DelimiterFramer(b'\n', max_size=8)
+        framer.feed(b'0123456789\n')
+        with self.assertRaises(FrameTooLarge):
+            collect(framer)
+
+    def test_incomplete_frame_too_large(self):
+        framer = DelimiterFramer(b'\n', max_size=8)
+        framer.feed(b'0123456789')
+        with self.assertRaises(FrameTooLarge):
+            collect(framer)
+
+    def test_frame_at_max_size_is_accepted(self):
+        framer = DelimiterFramer(b'\n', max_size=8)
+        framer.feed(b'01234567\n')
+        self.assertEqual(collect(framer), [b'01234567'])
+
+    def test_encode(self):
+        self.assertEqual(DelimiterFramer(b'\r\n').encode(b'{}'), b'{}\r\n')
+
+    def test_feed_while_frame_referenced(self):
+        framer = DelimiterFramer(b'\n')
+        framer.feed(b'a\nb\n')
+        frames = framer.frames()
+        self.assertEqual(bytes(next(frames)), b'a')
+        with self.assertRaises(RuntimeError):
+            framer.feed(b'c\n')
+        frames.close()
+
+        framer.feed(b'c\n')
+        self.assertEqual(collect(framer), [b'b', b'c'])
+
+
+class LengthPrefixFramerTests(SimpleTestCase):
+    """长度前缀分帧测试"""
+
+    def test_prefix_split_across_reads(self):
+        framer = LengthPrefixFramer()
+        data = framer.encode(b'hello') + framer.encode(b'world')
+        framer.feed(data[:2])
+        self.assertEqual(collect(framer), [])
+        framer.feed(data[2:6])
+        self.assertEqual(collect(framer), [])
+        framer.feed(data[6:11])
+        self.assertEqual(collect(framer), [b'hello'])
+        framer.feed(data[11:])
+        self.assertEqual(collect(framer), [b'world'])
+        self.assertEqual(framer.pending, 0)
+
+    def test_empty_frame(self):
+        framer = LengthPrefixFramer()
+        framer.feed(framer.encode(b''))
+        self.assertEqual(collect(framer), [b''])
+
+    def test_declared_length_too_large(self):
+        framer = LengthPrefixFramer(max_size=4)
+        framer.feed(LengthPrefixFramer.HEADER.pack(5))
+        with self.assertRaises(FrameTooLarge):
+            collect(framer)
+
+    def test_compaction_keeps_partial_frame(self):
+        framer = LengthPrefixFramer()
+        framer.COMPACT_THRESHOLD = 1
+        payloads = [bytes([i]) * (i + 1) for i in range(20)]
+        stream = b''.join(framer.encode(payload) for payload in payloads)
+        received = []
+        for start in range(0, len(stream), 7):
+            framer.feed(stream[start:start + 7])
+            received.extend(collect(framer))
+        self.assertEqual(received, payloads)
+
+
+class SwitchFramerTests(SimpleTestCase):
+    """认证时切换分帧方式"""
+
+    def test_remaining_data_carried_over(self):
+        consumer = TCPDeviceConsumer()
+        consumer.device_id = 'DEV-001'
+        length_frames = LengthPrefixFramer().encode(b'{"n":1}') + LengthPrefixFramer().encode(b'{"n":2}')
+        consumer.framer.feed(b'{"type":"auth"}\n' + length_frames[:6])
+
+        frames = consumer.framer.frames()
+        self.assertEqual(bytes(next(frames)), b'{"type":"auth"}')
+        frames.close()
+
+        consumer.switch_framer(LengthPrefixFramer)
+        self.assertIsInstance(consumer.framer, LengthPrefixFramer)
+        self.assertEqual(consumer.framer.pending, 6)
+
+        consumer.framer.feed(length_frames[6:])
+        self.assertEqual(collect(consumer.framer), [b'{"n":1}', b'{"n":2}'])
+
+    def test_switch_back_to_delimiter_uses_configured_delimiter(self):
+        consumer = TCPDeviceConsumer()
+        consumer.delimiter = b'\r\n'
+        consumer.framer = LengthPrefixFramer()
+        consumer.framer.feed(b'a\r\nb')
+        consumer.switch_framer(DelimiterFramer)
+        self.assertEqual(consumer.framer.delimiter, b'\r\n')
+        consumer.framer.feed(b'\r\n')
+        self.assertEqual(collect(consumer.framer), [b'a', b'b'])
+
+
+class ProcessFrameTests(SimpleTestCase):
+    """数据帧处理的错误响应"""
+
+    def setUp(self):
+        self.consumer = TCPDeviceConsumer()
+        self.consumer.authenticated = True
+        self.sent = []
+
+        async def tcp_send(data):
+            self.sent.append(codec.loads(data.rstrip(b'\n')))
+
+        self.consumer.tcp_send = tcp_send
+
+    def test_invalid_json(self):
+        with self.assertLogs('tcp_server.consumers', 'ERROR'):
+            async_to_sync(self.consumer.process_frame)(memoryview(b'{"type":'))
+        self.assertEqual(self.sent[0]['error_code'], 'invalid_json')
+
+    def test_value_error_while_processing_is_not_invalid_json(self):
+        async def process_message(message):
+            raise ValueError('bad value')
+
+        self.consumer.process_message = process_message
+        with self.assertLogs('tcp_server.consumers', 'ERROR'):
+            async_to_sync(self.consumer.process_frame)(memoryview(b'{"type":"data"}'))
+        self.assertEqual(self.sent[0]['error_code'], 'internal_error')
+        self.assertEqual(self.sent[0]['message'], 'bad value')
+
+
+class FakeReader:
+    """按顺序返回数据块；元素为异常时抛出，读完后返回EOF"""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    async def read(self, size):
+        if not self.chunks:
+            return b''
+        chunk = self.chunks.pop(0)
+        if isinstance(chunk, BaseException):
+            raise chunk
+        return chunk
+
+
+class FakeWriter:
+    def __init__(self, port=50000):
+        self.port = port
+        self.closed = False
+
+    def get_extra_info(self, name):
+        return ('127.0.0.1', self.port)
+
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+class RecordingConsumer:
+    """记录处理过的数据块和断开事件"""
+
+    instances = []
+
+    def __init__(self):
+        self.received = []
+        self.disconnected = []
+        self.frames_received = 0
+        self.flush_task = None
+        RecordingConsumer.instances.append(self)
+
+    async def tcp_connect(self, event):
+        pass
+
+    async def tcp_receive(self, event):
+        await asyncio.sleep(0)
+        self.received.append(event['data'])
+
+    async def tcp_disconnect(self, event):
+        self.disconnected.append(event['code'])
+
+
+@mock.patch('tcp_server.run_tcp_server.TCPDeviceConsumer', RecordingConsumer)
+class HandleClientTests(SimpleTestCase):
+    """连接以各种方式结束时，已接收的数据都处理完并通知消费者断开"""
+
+    def setUp(self):
+        RecordingConsumer.instances = []
+        self.server = TCPServer('127.0.0.1', 0, config={'STATS_INTERVAL': 0})
+
+    def handle(self, chunks):
+        writer = FakeWriter()
+        async_to_sync(self.server.handle_client)(FakeReader(chunks), writer)
+        self.assertTrue(writer.closed)
+        self.assertEqual(self.server.clients, {})
+        return RecordingConsumer.instances[-1]
+
+    def test_client_closed(self):
+        consumer = self.handle([b'a', b'b'])
+        self.assertEqual(consumer.received, [b'a', b'b'])
+        self.assertEqual(consumer.disconnected, ['client_closed'])
+
+    def test_connection_error(self):
+        consumer = self.handle([b'a', b'b', ConnectionResetError()])
+        self.assertEqual(consumer.received, [b'a', b'b'])
+        self.assertEqual(consumer.disconnected, ['connection_error'])
+
+    def test_unexpected_error(self):
+        with self.assertLogs('tcp_server', 'ERROR'):
+            consumer = self.handle([b'a', RuntimeError('boom')])
+        self.assertEqual(consumer.received, [b'a'])
+        self.assertEqual(consumer.disconnected, ['server_error'])
+
+    def test_cancelled(self):
+        async def run():
+            reader = FakeReader([b'a'])
+            blocked = asyncio.Event()
+
+            async def read(size):
+                if reader.chunks:
+                    return reader.chunks.pop(0)
+                blocked.set()
+                await asyncio.Event().wait()
+
+            reader.read = read
+            task = asyncio.create_task(self.server.handle_client(reader, FakeWriter()))
+            await blocked.wait()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        async_to_sync(run)()
+        consumer = RecordingConsumer.instances[-1]
+        self.assertEqual(consumer.received, [b'a'])
+        self.assertEqual(consumer.disconnected, ['cancelled'])
+        self.assertEqual(self.server.clients, {})
+
+    def test_connection_limit_counts_connections_still_connecting(self):
+        self.server.max_connections = 1
+
+        async def run():
+            connecting = asyncio.Event()
+            release = asyncio.Event()
+
+            async def tcp_connect(consumer, event):
+                connecting.set()
+                await release.wait()
+
+            with mock.patch.object(RecordingConsumer, 'tcp_connect', tcp_connect):
+                first = asyncio.create_task(self.server.handle_client(FakeReader([]), FakeWriter(50001)))
+                await asyncio.wait_for(connecting.wait(), 5)
+                second_writer = FakeWriter(50002)
+                await asyncio.wait_for(self.server.handle_client(FakeReader([b'a']), second_writer), 1)
+                release.set()
+                await first
+            return second_writer
+
+        second_writer = async_to_sync(run)()
+        self.assertTrue(second_writer.closed)
+        self.assertEqual(self.server.stats['connections_rejected'], 1)
+        self.assertEqual(self.server.stats['connections_total'], 1)
+        self.assertEqual(len(RecordingConsumer.instances), 1)